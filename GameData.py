@@ -1,7 +1,11 @@
 # Data to be passed from client to server
 import pickle
+from copy import copy
 
-from constants import DATASIZE
+from constants import DATASIZE, HEADERSIZE, MAX_FRAME_SIZE
+
+# every pickle starts with this opcode
+PICKLE_PROTO = pickle.PROTO[0]
 
 # Generic object
 class GameData(object):
@@ -12,23 +16,89 @@ class GameData(object):
     def serialize(self) -> bytes:
         data = pickle.dumps(self)
         datalen = len(data)
-        binaryDataLen: bytes = datalen.to_bytes(2, 'little')
-        totdata = bytearray(binaryDataLen) + data
-        #ensure no multiple data on same request
-        for _ in range(datalen + len(binaryDataLen), DATASIZE):
-            totdata.append(0)
-        data = bytes(totdata)
-        assert(len(data) == DATASIZE)
-        return data
+        binaryDataLen: bytes = datalen.to_bytes(HEADERSIZE, 'little')
+        return binaryDataLen + data
 
     def deserialize(serialized: bytes):
-        binarySize = serialized[0:2]
-        assert(len(binarySize) == 2)
+        # frames produced by the binary codec carry their own tag instead of a pickle
+        if len(serialized) > HEADERSIZE and serialized[HEADERSIZE] != PICKLE_PROTO:
+            import codec
+            return codec.decode(serialized)
+        binarySize = serialized[0:HEADERSIZE]
+        assert(len(binarySize) == HEADERSIZE)
         datasize = int.from_bytes(binarySize, 'little')
-        data = serialized[2:datasize + 2]
+        data = serialized[HEADERSIZE:datasize + HEADERSIZE]
+        assert(len(data) == datasize)
         return pickle.loads(data)
 
 
+class FrameTooLarge(Exception):
+    '''
+    Raised when the length prefix of a frame exceeds the maximum frame size: the stream cannot be trusted anymore.
+    '''
+    def __init__(self, size: int, maxSize: int) -> None:
+        super().__init__(f"Frame of {size} bytes, the maximum is {maxSize}")
+        self.size = size
+        self.maxSize = maxSize
+
+
+def checkFrameSize(datasize: int, maxFrameSize: int = MAX_FRAME_SIZE):
+    '''
+    Raises FrameTooLarge if a length prefix announces more than maxFrameSize bytes.
+    '''
+    if datasize > maxFrameSize:
+        raise FrameTooLarge(datasize, maxFrameSize)
+
+
+class FrameReader(object):
+    '''
+    Buffered reader of length-prefixed frames from a stream.
+    A single recv may return part of a frame or more than one frame: bytes are kept until a whole frame is available.
+    conn: anything exposing recv(size), usually a socket.
+    maxFrameSize: the largest frame accepted, length prefix excluded. A bigger one raises FrameTooLarge before
+    anything of it is buffered.
+    '''
+    def __init__(self, conn, maxFrameSize: int = MAX_FRAME_SIZE) -> None:
+        super().__init__()
+        self.conn = conn
+        self.maxFrameSize = maxFrameSize
+        self.buffer = bytearray()
+
+    def readFrame(self) -> bytes:
+        '''
+        Returns the next whole frame (length prefix included), or None if the stream has been closed.
+        Raises FrameTooLarge if the next frame is bigger than maxFrameSize.
+        '''
+        while True:
+            if len(self.buffer) >= HEADERSIZE:
+                datasize = int.from_bytes(self.buffer[0:HEADERSIZE], 'little')
+                checkFrameSize(datasize, self.maxFrameSize)
+                framesize = HEADERSIZE + datasize
+                if len(self.buffer) >= framesize:
+                    frame = bytes(self.buffer[0:framesize])
+                    del self.buffer[0:framesize]
+                    return frame
+            data = self.conn.recv(DATASIZE)
+            if not data:
+                return None
+            if len(self.buffer) == 0 and len(data) >= HEADERSIZE and \
+                    len(data) == HEADERSIZE + int.from_bytes(data[0:HEADERSIZE], 'little') and \
+                    len(data) <= HEADERSIZE + self.maxFrameSize:
+                # exactly one frame, as sent by the in-process transport: no need to copy it into the buffer
+                return data
+            self.buffer += data
+
+    def read(self):
+        '''
+        Returns the next deserialized object, or None if the stream has been closed.
+        Raises FrameTooLarge as readFrame.
+        '''
+        frame = self.readFrame()
+        if frame is None:
+            return None
+        return GameData.deserialize(frame)
+
+
 # Client to server
 class ClientToServerData(GameData):
     def __init__(self, sender, action) -> None:
@@ -55,9 +125,13 @@ class ClientPlayerAddData(ClientToServerData):
     '''
     A connection request from client to server.
     The client requests the server to be added to the lobby.
+    table: the name of the table to join. If None the server seats the player at a table waiting in the lobby.
+    codecs: the codecs (see codec.py) the client can use, in order of preference. If None the client only uses pickle.
     '''
-    def __init__(self, sender) -> None:
+    def __init__(self, sender, table: str = None, codecs: list = None) -> None:
         action = "Connection request"
+        self.table = table
+        self.codecs = codecs
         super().__init__(sender, action)
 
 class ClientPlayerStartRequest(ClientToServerData):
@@ -123,10 +197,11 @@ class ServerHintData(ServerToClientData):
     type: can be "color" or "value"
     value: can be the color or the value of the card
     positions: a list of cards that satisfy the value of the hint
+    delta: the ServerGameStateDelta produced by the hint (set by the server when sending it).
     '''
 
     # ! ADDED 'player: str' so you know the current player (to be consistent with play and discard methods!)
-    def __init__(self, sender: str, destination: str, type: str, value, positions: list, player: str) -> None:
+    def __init__(self, sender: str, destination: str, type: str, value, positions: list, player: str, delta=None) -> None:
         action = "Hint data from server to destination client"
         # ! BUGFIX super.sender overwrites self.sender with 'Game Server', use a different name like 'self.source'
         self.source = sender
@@ -136,6 +211,7 @@ class ServerHintData(ServerToClientData):
         self.positions = positions
         # ! ADDED so you know the current player (to be consistent with play and discard methods)
         self.player = player
+        self.delta = delta
         super().__init__(action)
 
 
@@ -143,10 +219,14 @@ class ServerPlayerConnectionOk(ServerToClientData):
     '''
     Server successfully received the connection request from the player.
     You need to tell the server that you are ready.
+    table: the name of the table the player has been seated at.
+    codec: the codec chosen by the server, used for every following message in both directions.
     '''
-    def __init__(self, playerName) -> None:
+    def __init__(self, playerName, table: str = None, codec: str = "pickle") -> None:
         action = "Connection ok"
         self.message = "Player " + str(playerName) + " connected succesfully!"
+        self.table = table
+        self.codec = codec
         super().__init__(action)
 
 class ServerPlayerStartRequestAccepted(ServerToClientData):
@@ -182,9 +262,10 @@ class ServerGameStateData(ServerToClientData):
     usedStormTokens: used red (storm) tokens. 0 is the minimum, 3 is the maximum. At 3 the game is over.
     tableCards: shows the cards that are currently being played (forming the current firework).
     discardPile: shows the discard pile.
+    version: the version of the table state, increased by every move. Used to apply the ServerGameStateDelta that follow.
     NOTE: params might get added on request, if the game allows for it.
     '''
-    def __init__(self, currentPlayer: str, handSize: int, players: list, usedNoteTokens: int, usedStormTokens: int, table: dict, discard: list) -> None:
+    def __init__(self, currentPlayer: str, handSize: int, players: list, usedNoteTokens: int, usedStormTokens: int, table: dict, discard: list, version: int = 0) -> None:
         action = "Show cards response"
         self.currentPlayer = currentPlayer
         self.handSize = handSize
@@ -193,9 +274,65 @@ class ServerGameStateData(ServerToClientData):
         self.usedStormTokens = usedStormTokens
         self.tableCards = table
         self.discardPile = discard
+        self.version = version
         super().__init__(action)
 
 
+class ServerGameStateDelta(ServerToClientData):
+    '''
+    The changes made by a single move to the game state, attached to the move result.
+    version: the state version after the move. It can be applied only to the state with the previous version,
+        a client that is behind has to ask for the whole state with a ClientGetGameStateRequest.
+    currentPlayer: the name of the player that should play right now.
+    usedNoteTokens: used blue (note) tokens after the move.
+    usedStormTokens: used red (storm) tokens after the move.
+    changes: the card movements, in order. Each one is a tuple:
+        ("remove", player, index): the card at index has left the hand of player.
+        ("draw", player, card): player has drawn card. card is None for the player who drew it.
+        ("firework", card): card has been added to its firework.
+        ("discard", card): card has been added to the discard pile.
+    '''
+    def __init__(self, version: int, currentPlayer: str, usedNoteTokens: int, usedStormTokens: int, changes: list) -> None:
+        action = "Game state changes"
+        self.version = version
+        self.currentPlayer = currentPlayer
+        self.usedNoteTokens = usedNoteTokens
+        self.usedStormTokens = usedStormTokens
+        self.changes = changes
+        super().__init__(action)
+
+    def applyTo(self, state: ServerGameStateData, playerName: str) -> ServerGameStateData:
+        '''
+        Returns the state after this delta, as seen by playerName. The given state is not modified.
+        '''
+        players = []
+        hands = {}
+        for player in state.players:
+            player = copy(player)
+            player.hand = list(player.hand)
+            players.append(player)
+            hands[player.name] = player.hand
+        handSize = state.handSize
+        table = dict(state.tableCards)
+        discard = state.discardPile
+        for change in self.changes:
+            if change[0] == "remove":
+                if change[1] == playerName:
+                    handSize -= 1
+                else:
+                    hands[change[1]].pop(change[2])
+            elif change[0] == "draw":
+                if change[1] == playerName:
+                    handSize += 1
+                else:
+                    hands[change[1]].append(change[2])
+            elif change[0] == "firework":
+                table[change[1].color] = table[change[1].color] + [change[1]]
+            elif change[0] == "discard":
+                discard = discard + [change[1]]
+        return ServerGameStateData(self.currentPlayer, handSize, players, self.usedNoteTokens, self.usedStormTokens, table, discard, self.version)
+
+
 class ServerActionValid(ServerToClientData):
     '''
     Action well performed.
@@ -204,9 +341,10 @@ class ServerActionValid(ServerToClientData):
     action: the actino occurred. Now it is only "discard".
     move: the last move that occurred.
     cardHandIndex: the card index of the lastPlayer played card, given his hand order.
+    delta: the ServerGameStateDelta produced by the move, as seen by the receiving player (set by the server when sending it).
     '''
     # ! ADDED send also length of hand of lastPlayer so to know if drawing occured
-    def __init__(self, player: str, lastPlayer: str, action: str, card, cardHandIndex: int, handLength=0) -> None:
+    def __init__(self, player: str, lastPlayer: str, action: str, card, cardHandIndex: int, handLength=0, delta=None) -> None:
         # action = "Valid action performed" #! BUGFIX You are overwriting the action e.g. "discard", so we lose what happened
         self.action = action
         self.card = card
@@ -215,6 +353,7 @@ class ServerActionValid(ServerToClientData):
         self.player = player
         # ! ADDED send also length of hand of lastPlayer so to know if drawing occured i.e. you know if there are cards left in the deck
         self.handLength = handLength
+        self.delta = delta
         super().__init__(action)
 
 
@@ -225,9 +364,10 @@ class ServerPlayerMoveOk(ServerToClientData):
     lastPlayer: the player that made the last move.
     card: the last card played.
     cardHandIndex: the card index of the lastPlayer played card, given his hand order.
+    delta: the ServerGameStateDelta produced by the move, as seen by the receiving player (set by the server when sending it).
     '''
     # ! ADDED send also length of hand of lastPlayer so to know if drawing occured
-    def __init__(self, player: str, lastPlayer: str, card, cardHandIndex: int, handLength: int) -> None:
+    def __init__(self, player: str, lastPlayer: str, card, cardHandIndex: int, handLength: int, delta=None) -> None:
         action = "Correct move! Well done!"
         self.card = card
         self.cardHandIndex = cardHandIndex
@@ -235,6 +375,7 @@ class ServerPlayerMoveOk(ServerToClientData):
         self.player = player
         # ! ADDED send also length of hand of lastPlayer so to know if drawing occured
         self.handLength = handLength
+        self.delta = delta
         super().__init__(action)
 
 
@@ -246,9 +387,10 @@ class ServerPlayerThunderStrike(ServerToClientData):
     lastPlayer: the player that made the last move.
     card: the card that was just discarded.
     cardHandIndex: the card index of the lastPlayer played card, given his hand order.
+    delta: the ServerGameStateDelta produced by the move, as seen by the receiving player (set by the server when sending it).
     '''
     # ! ADDED send also length of hand of lastPlayer so to know if drawing occured
-    def __init__(self, player: str, lastPlayer: str, card, cardHandIndex: int, handLength: int) -> None:
+    def __init__(self, player: str, lastPlayer: str, card, cardHandIndex: int, handLength: int, delta=None) -> None:
         action = "The Gods are angry at you!"
         self.player = player
         self.lastPlayer = lastPlayer
@@ -256,6 +398,7 @@ class ServerPlayerThunderStrike(ServerToClientData):
         self.card = card
         # ! ADDED send also length of hand of lastPlayer so to know if drawing occured
         self.handLength = handLength
+        self.delta = delta
         super().__init__(action)
 
 class ServerActionInvalid(ServerToClientData):
@@ -284,10 +427,12 @@ class ServerGameOver(ServerToClientData):
     message: "Game over".
     score: the score you reached.
     scoreMessage: the message attached to the score.
+    seed: the seed of the game deck, dealing it again replays the game with the same cards.
     '''
-    def __init__(self, score: int, scoreMessage: str) -> None:
+    def __init__(self, score: int, scoreMessage: str, seed: int = None) -> None:
         action = "Game over"
         self.message = "Game over"
         self.score = score
         self.scoreMessage = scoreMessage
+        self.seed = seed
         super().__init__(action)
\ No newline at end of file
@@ -1,9 +1,9 @@
 from abc import ABC, abstractmethod
-from typing import List, Dict
+from typing import List, Dict, Tuple
 
-from client_state.agent_state import AgentState
+from client_state.agent_state import AgentState, MAX_BLUE_TOKENS
 from client_state.card_info import Color, Value
-from client_state.player_hand import HiddenCard
+from client_state.player_hand import HiddenCard, Hand
 from actions.actions import Action, Hint, PlayCard, DiscardCard
 import random
 import logging
@@ -48,7 +48,7 @@ class PlayRandomCard(Rule):
         if self.state.used_red_token > 1:
             return None
 
-        random_index = random.choice(range(self.state.hand_card_number))
+        random_index = random.choice(range(len(self.state.hand)))
 
         return PlayCard(self.sender, random_index)
 
@@ -151,7 +151,7 @@ class DiscardUselessCard(Rule):
         super().__init__(state)
 
     def rule_to_action(self) -> Action:
-        if self.state.used_blue_token == 0:
+        if not self.state.can_discard():
             return None
 
         # List of the playable cards indexes
@@ -172,10 +172,10 @@ class DiscardRandomCard(Rule):
 
     def rule_to_action(self) -> Action:
 
-        if self.state.used_blue_token == 0:
+        if not self.state.can_discard():
             return None
 
-        random_index = random.choice(range(self.state.hand_card_number))
+        random_index = random.choice(range(len(self.state.hand)))
 
         return DiscardCard(self.sender, random_index)
 
@@ -187,7 +187,7 @@ class DiscardDispensableCard(Rule):
         self.dispensable_threshold = dispensable_threshold
 
     def rule_to_action(self) -> Action:
-        if self.state.used_blue_token == 0:
+        if not self.state.can_discard():
             return None
 
         dispensable_cards_indexes = [idx for idx, hidden_card in enumerate(self.state.hand)
@@ -208,7 +208,7 @@ class DiscardJustHinted(Rule):
         self.dispensable_threshold = dispensable_threshold
 
     def rule_to_action(self) -> Action:
-        if self.state.used_blue_token == 0:
+        if not self.state.can_discard():
             return None
 
         max_prob = .0
@@ -231,7 +231,7 @@ class DiscardOldestUnhintedCard(Rule):
         super().__init__(state)
 
     def rule_to_action(self) -> Action:
-        if self.state.used_blue_token == 0:
+        if not self.state.can_discard():
             return None
 
         for count, hidden_card in enumerate(self.state.hand):
@@ -247,7 +247,7 @@ class DiscardOldest(Rule):
         super().__init__(state)
 
     def rule_to_action(self) -> Action:
-        if self.state.used_blue_token == 0:
+        if not self.state.can_discard():
             return None
         return DiscardCard(self.sender, 0)
 
@@ -261,61 +261,48 @@ class HintRule(Rule):
 
         self.next_player = next_player
 
-    def hintable_players(self):
+    def hintable_turns(self) -> List[int]:
 
         if self.next_player:
-            next_player_turn = (self.state.my_turn + 1) % len(self.state.players_list)
-            next_destination_player = self.state.players_list[next_player_turn].name
-            next_destination_player_hand = self.state.player_hands[next_player_turn].hand
-            return [(next_destination_player, next_destination_player_hand)]
-
-        else:
-
-            n_players = len(self.state.players_list)
-            available_blue_tokens = 8 - self.state.used_blue_token
-
-            if available_blue_tokens >= n_players:
-                hintable_players = [(self.state.my_turn + i) % len(self.state.players_list) for i in
-                                    range(1, n_players)]
-
-            else:
-                hintable_players = [(self.state.my_turn + i) % len(self.state.players_list) for i in
-                                    range(1, available_blue_tokens + 1)]
-
-            hintable_players_info = [(self.state.player_hands[turn].player_name, self.state.player_hands[turn].hand) for
-                                     turn in hintable_players]
-
-            return hintable_players_info
-
-    @staticmethod
-    def choose_random_hint(destination_player_hand):
-        index_list = range(0, len(destination_player_hand))
-        rand_card_index = list(filter(lambda x: destination_player_hand[x].is_hintable(), index_list))
+            return [(self.state.my_turn + 1) % len(self.state.players_list)]
 
-        if len(rand_card_index) == 0:
-            return None
+        n_players = len(self.state.players_list)
+        available_blue_tokens = MAX_BLUE_TOKENS - self.state.used_blue_token
 
-        rand_index = random.choice(rand_card_index)
-        rand_card = destination_player_hand[rand_index]
+        if available_blue_tokens >= n_players:
+            return [(self.state.my_turn + i) % n_players for i in range(1, n_players)]
+        return [(self.state.my_turn + i) % n_players for i in range(1, available_blue_tokens + 1)]
 
-        if rand_card.is_color_hinted:
-            return rand_card.value
-        elif rand_card.is_value_hinted:
-            return rand_card.color
-        else:
-            hints = [rand_card.value, rand_card.color]
-            return random.choice(hints)
+    def hintable_players(self):
+        return [(self.state.player_hands[turn].player_name, self.state.player_hands[turn]) for turn in
+                self.hintable_turns()]
+
+    def informative_hints(self, player_turns: List[int]) -> List[Tuple[Hint, int]]:
+        """
+        Gli hint accettati dal server per i giocatori in player_turns (state.get_legal_hints) che dicono qualcosa di nuovo,
+        ognuno col numero di carte che ricevono per la prima volta un hint di quel tipo
+        """
+        hands = {self.state.player_hands[turn].player_name: self.state.player_hands[turn] for turn in player_turns}
+        hints = []
+        for hint in self.state.get_legal_hints(player_turns):
+            hand = hands[hint.destination_player]
+            mask = hand.hint_mask(hint.hint)
+            hinted = hand.is_color_hinted if type(hint.hint) is Color else hand.is_value_hinted
+            new_cards = sum(1 for idx in range(len(hand.hand)) if mask >> idx & 1 and not hinted(idx))
+            if new_cards > 0:
+                hints.append((hint, new_cards))
+        return hints
 
     def get_hint(self, check: str, players: List, useful_threshold: float = .7, dispensable_threshold: float = .7):
         card_indexes = []
 
         selected_player = None
         for player in players:
-            card_indexes = [idx for idx, card in enumerate(player[1])
+            card_indexes = [idx for idx, card in enumerate(player[1].hand)
                             if self.state.check_card_usability(card, check,
                                                                useful_threshold=useful_threshold,
                                                                dispensable_threshold=dispensable_threshold)
-                            and card.is_hintable()]
+                            and player[1].is_hintable(idx)]
 
             if len(card_indexes) > 0:
                 selected_player = player
@@ -325,11 +312,11 @@ class HintRule(Rule):
             return None, None
 
         rand_index = random.choice(card_indexes)
-        random_card = selected_player[1][rand_index]
+        random_card = selected_player[1].hand[rand_index]
 
-        if random_card.is_color_hinted:
+        if selected_player[1].is_color_hinted(rand_index):
             return selected_player, random_card.value
-        elif random_card.is_value_hinted:
+        elif selected_player[1].is_value_hinted(rand_index):
             return selected_player, random_card.color
         else:
             hints = [random_card.value, random_card.color]
@@ -343,19 +330,15 @@ class HintRandom(HintRule):
 
     def rule_to_action(self) -> Action:
 
-        if self.state.used_blue_token == 8:
+        if not self.state.can_hint():
             return None
 
-        random_player_tuple = random.choice(self.hintable_players())
+        hints = self.informative_hints([random.choice(self.hintable_turns())])
 
-        hint, hinted_index = HintRule.choose_random_hint(random_player_tuple[1])
-
-        if hint is None:
+        if len(hints) == 0:
             return None
 
-        # self.set_hint_flag(hint, random_player_tuple)
-
-        return Hint(self.sender, random_player_tuple[0], hint)
+        return random.choice(hints)[0]
 
 
 class HintPlayableCard(HintRule):
@@ -367,16 +350,16 @@ class HintPlayableCard(HintRule):
 
     def rule_to_action(self) -> Action:
 
-        if self.state.used_blue_token == 8:
+        if not self.state.can_hint():
             return None
 
         card_indexes = []
 
         selected_player = None
         for player in self.hintable_players():
-            card_indexes = [idx for idx, card in enumerate(player[1])
+            card_indexes = [idx for idx, card in enumerate(player[1].hand)
                             if self.state.check_card_usability(card, "playable")
-                            and card.is_hintable()]
+                            and player[1].is_hintable(idx)]
 
             if len(card_indexes) > 0:
                 selected_player = player
@@ -388,22 +371,23 @@ class HintPlayableCard(HintRule):
         count_per_color: Dict[Color, int] = {color: 0 for color in Color.getColors()}
         count_per_value: Dict[Value, int] = {value: 0 for value in Value.getValues()}
 
+        selected_hand = selected_player[1]
         for idx in card_indexes:
-            card = selected_player[1][idx]
-            if not card.is_color_hinted:
+            card = selected_hand.hand[idx]
+            if not selected_hand.is_color_hinted(idx):
                 count_per_color[card.color] += 1
-            if not card.is_value_hinted:
+            if not selected_hand.is_value_hinted(idx):
                 count_per_value[card.value] += 1
 
         for idx in card_indexes:
-            card = selected_player[1][idx]
-            if not card.is_value_hinted:
+            card = selected_hand.hand[idx]
+            if not selected_hand.is_value_hinted(idx):
                 hidden_card = HiddenCard()
                 hidden_card.set_hint(card.value)
                 if self.state.is_card_playable(hidden_card) or count_per_value[card.value] == 1:
                     return Hint(self.sender, selected_player[0], card.value)
 
-            if not card.is_color_hinted:
+            if not selected_hand.is_color_hinted(idx):
                 hidden_card = HiddenCard()
                 hidden_card.set_hint(card.color)
                 if self.state.is_card_playable(hidden_card) or not count_per_color[card.color] == 1:
@@ -414,10 +398,10 @@ class HintPlayableCard(HintRule):
         hint_type = type(hint)
 
         for idx in card_indexes:
-            card = selected_player[1][idx]
-            if hint_type is Value and card.value == hint and not card.is_value_hinted:
+            card = selected_hand.hand[idx]
+            if hint_type is Value and card.value == hint and not selected_hand.is_value_hinted(idx):
                 return Hint(self.sender, selected_player[0], hint)
-            elif hint_type is Color and card.color == hint and not card.is_color_hinted:
+            elif hint_type is Color and card.color == hint and not selected_hand.is_color_hinted(idx):
                 return Hint(self.sender, selected_player[0], hint)
 
         raise RuntimeError("IMPOSSIBLE TO BE HERE")
@@ -434,7 +418,7 @@ class HintUsefulCard(HintRule):
         self.usefulness_threshold = usefulness_threshold
 
     def rule_to_action(self) -> Action:
-        if self.state.used_blue_token == 8:
+        if not self.state.can_hint():
             return None
 
         player, hint = self.get_hint(check="useful", players=self.hintable_players(),
@@ -458,7 +442,7 @@ class HintFullKnowledge(HintRule):
         self.check = check
 
     def rule_to_action(self) -> Action:
-        if self.state.used_blue_token == 8:
+        if not self.state.can_hint():
             return None
 
         players = self.hintable_players()
@@ -468,9 +452,8 @@ class HintFullKnowledge(HintRule):
 
         #Tra tutti i giocatori hintabili seleziono il primo che ha carte con un hint
         for player in players:
-            hintable_card_indexes = [idx for idx, card in enumerate(player[1])
-                                     if (card.is_value_hinted and not card.is_color_hinted) or
-                                     (card.is_color_hinted and not card.is_value_hinted)
+            hintable_card_indexes = [idx for idx, card in enumerate(player[1].hand)
+                                     if player[1].is_value_hinted(idx) != player[1].is_color_hinted(idx)
                                      if self.state.check_card_usability(card, self.check)]
 
             if len(hintable_card_indexes) > 0:
@@ -484,15 +467,17 @@ class HintFullKnowledge(HintRule):
         #che siano o playable o useful, si seleziona con priorità prima la playable
 
         checked_card = None
+        checked_card_index = None
 
         for idx in hintable_card_indexes:
-            hintable_card = selected_player[1][idx]
+            hintable_card = selected_player[1].hand[idx]
             if self.state.check_card_usability(hintable_card, self.check):
                 checked_card = hintable_card
+                checked_card_index = idx
                 break
 
         if checked_card is not None:
-            if checked_card.is_color_hinted:
+            if selected_player[1].is_color_hinted(checked_card_index):
                 return Hint(self.sender, selected_player[0], checked_card.value)
             else:
                 return Hint(self.sender, selected_player[0], checked_card.color)
@@ -506,46 +491,17 @@ class HintMostInformation(HintRule):
         super().__init__(state, next_player)
 
     def rule_to_action(self) -> Action:
-        if self.state.used_blue_token == 8:
+        if not self.state.can_hint():
             return None
 
-        players = self.hintable_players()
-        # qui sarà presente la lista dei player con i rispettivi massimi di carte di un colore e di un valore
-        player_card_info: Dict[str, ((Color, int), (Value, int))] = {}
+        # tra gli hint accettati dal server scelgo quello che dà un hint al maggior numero di carte che non lo avevano
+        hints = self.informative_hints(self.hintable_turns())
 
-        # ciclo sui player e calcolo per colore e valore la loro rispettiva quantità escludendo le carte già hintate
-        for player in players:
-            player_hand = player[1]
-            color_dict: Dict[Color, int] = {color: 0 for color in Color.getColors()}
-            value_dict: Dict[Value, int] = {value: 0 for value in Value.getValues()}
-
-            for card in player_hand:
-                if not card.is_color_hinted:
-                    color_dict[card.color] += 1
-                if not card.is_value_hinted:
-                    value_dict[card.value] += 1
-
-            # calcolo il massimo numero di carte di un colore e valore per quel player e li inserisco nella struttura sopra
-            max_color = max(color_dict.items(), key=lambda x: x[1])
-            max_value = max(value_dict.items(), key=lambda x: x[1])
-            player_card_info[player[0]] = (max_color, max_value)
-
-        # tra tutti i player scelgo il player che può essere hintato che ha il maggior numero di carte hintabili
-        max_color_player = max(player_card_info.items(), key=lambda x: x[1][0][1])
-        max_value_player = max(player_card_info.items(), key=lambda x: x[1][1][1])
-
-        max_color_player = (max_color_player[0], max_color_player[1][0])
-        max_value_player = (max_value_player[0], max_value_player[1][1])
-
-        # una volta scelto il player controllo se ottengo più hint con il colore o con il valore altrimenti scelgo a caso
-        if max_value_player[1][1] > max_color_player[1][1]:
-            max_player = max_value_player
-        elif max_value_player[1][1] < max_color_player[1][1]:
-            max_player = max_color_player
-        else:
-            max_player = random.choice([max_color_player, max_value_player])
+        if len(hints) == 0:
+            return None
 
-        return Hint(self.sender, max_player[0], max_player[1][0])
+        max_cards = max(new_cards for _, new_cards in hints)
+        return random.choice([hint for hint, new_cards in hints if new_cards == max_cards])
 
 
 class HintCritical(HintRule):
@@ -554,16 +510,16 @@ class HintCritical(HintRule):
         super().__init__(state, next_player)
 
     def rule_to_action(self) -> Action:
-        if self.state.used_blue_token == 8:
+        if not self.state.can_hint():
             return None
 
         players = self.hintable_players()
-        critical_cards = {card for card in self.state.get_critical_cards() if not card.is_value_hinted}
+        critical_cards = self.state.get_critical_cards()
 
         selected_player = None
         selected_card = None
         for player in players:
-            player_cards = set(player[1])
+            player_cards = set(player[1].hand)
             intersection = critical_cards.intersection(player_cards)
             if len(intersection) != 0:
                 selected_player = player
@@ -582,7 +538,7 @@ class HintOnes(HintRule):
 
     def rule_to_action(self) -> Action:
 
-        if self.state.used_blue_token == 8:
+        if not self.state.can_hint():
             return None
 
         empty_stacks = [stack[1] for stack in self.state.fireworks.items() if stack[1] == 0]
@@ -594,8 +550,8 @@ class HintOnes(HintRule):
         selected_player = None
 
         for player in players:
-            ones_count = len([card.value for card in player[1]
-                              if card.value == Value.ONE and not card.is_value_hinted])
+            ones_count = len([card.value for idx, card in enumerate(player[1].hand)
+                              if card.value == Value.ONE and not player[1].is_value_hinted(idx)])
 
             if ones_count > 0:
                 selected_player = player
@@ -611,14 +567,15 @@ class HintUnknown(HintRule):
         super().__init__(state, next_player)
 
     def rule_to_action(self) -> Action:
-        if self.state.used_blue_token == 8:
+        if not self.state.can_hint():
             return None
 
         players = self.hintable_players()
         selected_player = None
         unhinted_card_idxs = []
         for player in players:
-            unhinted_card_idxs = [idx for idx, card in enumerate(player[1]) if not card.is_color_hinted and not card.is_value_hinted]
+            unhinted_card_idxs = [idx for idx in range(len(player[1].hand))
+                                  if not player[1].is_color_hinted(idx) and not player[1].is_value_hinted(idx)]
             if len(unhinted_card_idxs) > 0:
                 selected_player = player
 
@@ -626,7 +583,7 @@ class HintUnknown(HintRule):
             return None
 
         rand_index = random.choice(unhinted_card_idxs)
-        random_card = selected_player[1][rand_index]
+        random_card = selected_player[1].hand[rand_index]
 
         hints = [random_card.value, random_card.color]
         hint = random.choice(hints)
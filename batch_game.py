@@ -0,0 +1,246 @@
+# Many games played in lockstep on NumPy arrays, for strategy research. Requires numpy.
+import argparse
+import time
+import numpy as np
+from compact_game import CARD_TYPES, DECK_SIZE
+
+EMPTY = -1
+NUM_COLORS = 5
+NUM_VALUES = 5
+MAX_NOTE_TOKENS = 8
+MAX_STORM_TOKENS = 3
+
+_cardTypes = np.frombuffer(CARD_TYPES, dtype=np.uint8).astype(np.int8)
+
+
+class BatchGame(object):
+    '''
+    A batch of games with the rules of game.Game (hints, plays, discards, tokens, storms and the last round),
+    advanced all together by step(): every game still running gets one move per step.
+
+    Actions are integers, for a hand of handSize cards:
+        0 .. handSize - 1: play the card in that position.
+        handSize .. 2 * handSize - 1: discard the card in position action - handSize.
+        2 * handSize + (offset - 1) * 10 + k: hint the player offset seats after the current one,
+            k < 5 about the color COLORS[k] (see codec.py), k >= 5 about the value k - 4.
+    Cards are their type, color * 5 + value - 1 as in codec.py, EMPTY where there is no card.
+
+    batchSize: the number of games.
+    numPlayers: players of every game, from 2 to 5.
+    seed: seed of the random generator shuffling the decks.
+    '''
+    def __init__(self, batchSize: int, numPlayers: int, seed=None) -> None:
+        super().__init__()
+        if numPlayers < 2 or numPlayers > 5:
+            raise ValueError("Games are played by 2 to 5 players")
+        self.batchSize = batchSize
+        self.numPlayers = numPlayers
+        self.handSize = 5 if numPlayers < 4 else 4
+        self.numActions = 2 * self.handSize + (numPlayers - 1) * (NUM_COLORS + NUM_VALUES)
+        self.rng = np.random.default_rng(seed)
+        self.reset()
+
+    def reset(self):
+        '''
+        Shuffles new decks and deals them: every game starts over.
+        '''
+        B, P, H = self.batchSize, self.numPlayers, self.handSize
+        ids = self.rng.permuted(np.tile(np.arange(DECK_SIZE), (B, 1)), axis=1)
+        # the cards to draw are deck[:, 0:deckSize], drawn from the end as in Game
+        self.deck = _cardTypes[ids]
+        self.deckSize = np.full(B, DECK_SIZE, dtype=np.int16)
+        self.hands = np.full((B, P, H), EMPTY, dtype=np.int8)
+        # hints received about each card: the hinted color or value index, EMPTY if none
+        self.colorHints = np.full((B, P, H), EMPTY, dtype=np.int8)
+        self.valueHints = np.full((B, P, H), EMPTY, dtype=np.int8)
+        # deal as Game.start: a player takes all its cards at once with less than 4 players, one per round otherwise
+        for p in range(P):
+            for slot in range(H):
+                drawn = p * H + slot if P < 4 else slot * P + p
+                self.hands[:, p, slot] = self.deck[:, DECK_SIZE - 1 - drawn]
+        self.deckSize -= P * H
+        self.handSizes = np.full((B, P), H, dtype=np.int8)
+        self.fireworks = np.zeros((B, NUM_COLORS), dtype=np.int8)
+        self.discardCounts = np.zeros((B, NUM_COLORS * NUM_VALUES), dtype=np.int8)
+        self.noteTokens = np.zeros(B, dtype=np.int8)
+        self.stormTokens = np.zeros(B, dtype=np.int8)
+        self.currentPlayer = np.zeros(B, dtype=np.int8)
+        self.lastMoves = np.full(B, P + 1, dtype=np.int8)
+        self.done = np.zeros(B, dtype=bool)
+        self.scores = np.zeros(B, dtype=np.int8)
+        self.moves = 0
+
+    def __relative(self, array: np.ndarray) -> np.ndarray:
+        # rows of every game reordered from the current player on
+        order = (self.currentPlayer[:, None] + np.arange(self.numPlayers)[None, :]) % self.numPlayers
+        index = order.reshape(order.shape + (1,) * (array.ndim - 2))
+        return np.take_along_axis(array, index, axis=1)
+
+    def legalActions(self) -> np.ndarray:
+        '''
+        Returns a (batchSize, numActions) mask of the actions allowed to the current player of every game.
+        Games already over allow nothing.
+        '''
+        B, P, H = self.batchSize, self.numPlayers, self.handSize
+        handSizes = self.__relative(self.handSizes)
+        hands = self.__relative(self.hands)[:, 1:]
+        inHand = np.arange(H)[None, :] < handSizes[:, 0:1]
+        plays = inHand
+        discards = inHand & (self.noteTokens >= 1)[:, None]
+        present = hands != EMPTY
+        colors = np.stack([((hands // NUM_VALUES) == c) & present for c in range(NUM_COLORS)], axis=2).any(axis=3)
+        values = np.stack([((hands % NUM_VALUES) == v) & present for v in range(NUM_VALUES)], axis=2).any(axis=3)
+        hints = np.concatenate([colors, values], axis=2).reshape(B, -1) & (self.noteTokens < MAX_NOTE_TOKENS)[:, None]
+        legal = np.concatenate([plays, discards, hints], axis=1)
+        legal[self.done] = False
+        return legal
+
+    def observe(self) -> dict:
+        '''
+        Returns what the current player of every game knows, as arrays whose first dimension is the game.
+        Player dimensions start from the current player, whose own cards are hidden.
+        '''
+        hands = self.__relative(self.hands).copy()
+        hands[:, 0] = EMPTY
+        return {
+            "hands": hands,
+            "handSizes": self.__relative(self.handSizes),
+            "colorHints": self.__relative(self.colorHints),
+            "valueHints": self.__relative(self.valueHints),
+            "fireworks": self.fireworks.copy(),
+            "discardCounts": self.discardCounts.copy(),
+            "noteTokens": self.noteTokens.copy(),
+            "stormTokens": self.stormTokens.copy(),
+            "deckSize": self.deckSize.copy(),
+            "currentPlayer": self.currentPlayer.copy(),
+            "legal": self.legalActions(),
+            "done": self.done.copy()
+        }
+
+    def __removeCards(self, games: np.ndarray, players: np.ndarray, slots: np.ndarray) -> np.ndarray:
+        # takes the cards out of the hands, shifting the following ones left as Game does
+        cards = self.hands[games, players, slots]
+        positions = np.arange(self.handSize)[None, :]
+        source = np.minimum(positions + (positions >= slots[:, None]), self.handSize - 1)
+        last = positions == self.handSize - 1
+        for array in (self.hands, self.colorHints, self.valueHints):
+            rows = np.take_along_axis(array[games, players], source, axis=1)
+            rows[np.broadcast_to(last, rows.shape)] = EMPTY
+            array[games, players] = rows
+        self.handSizes[games, players] -= 1
+        return cards
+
+    def __drawCards(self, games: np.ndarray, players: np.ndarray):
+        draw = self.deckSize[games] > 0
+        games, players = games[draw], players[draw]
+        self.deckSize[games] -= 1
+        slots = self.handSizes[games, players]
+        self.hands[games, players, slots] = self.deck[games, self.deckSize[games]]
+        self.handSizes[games, players] += 1
+
+    def step(self, actions: np.ndarray):
+        '''
+        Plays one move in every game still running. actions has one action per game, ignored for the games over.
+        Raises ValueError if an action is not allowed.
+        '''
+        actions = np.asarray(actions)
+        running = ~self.done
+        legal = self.legalActions()
+        games = np.nonzero(running)[0]
+        if not legal[games, actions[games]].all():
+            raise ValueError("Invalid action for games " + str(games[~legal[games, actions[games]]]))
+        H, P = self.handSize, self.numPlayers
+        actions = actions[games]
+        players = self.currentPlayer[games].astype(np.intp)
+
+        play = actions < H
+        g, p = games[play], players[play]
+        cards = self.__removeCards(g, p, actions[play])
+        self.__drawCards(g, p)
+        colors, values = cards // NUM_VALUES, cards % NUM_VALUES
+        success = self.fireworks[g, colors] == values
+        self.fireworks[g[success], colors[success]] += 1
+        completed = success & (values == NUM_VALUES - 1) & (self.noteTokens[g] > 0)
+        self.noteTokens[g[completed]] -= 1
+        self.stormTokens[g[~success]] += 1
+        np.add.at(self.discardCounts, (g[~success], cards[~success]), 1)
+
+        discard = (actions >= H) & (actions < 2 * H)
+        g, p = games[discard], players[discard]
+        cards = self.__removeCards(g, p, actions[discard] - H)
+        np.add.at(self.discardCounts, (g, cards), 1)
+        self.noteTokens[g] -= 1
+        self.__drawCards(g, p)
+
+        hint = actions >= 2 * H
+        g = games[hint]
+        offsets, kinds = np.divmod(actions[hint] - 2 * H, NUM_COLORS + NUM_VALUES)
+        targets = (players[hint] + offsets + 1) % P
+        hands = self.hands[g, targets]
+        isColor = kinds < NUM_COLORS
+        matches = np.where(isColor[:, None], hands // NUM_VALUES == kinds[:, None],
+                           hands % NUM_VALUES == (kinds - NUM_COLORS)[:, None]) & (hands != EMPTY)
+        for array, selected, value in ((self.colorHints, isColor, kinds), (self.valueHints, ~isColor, kinds - NUM_COLORS)):
+            rows = array[g, targets]
+            update = matches & selected[:, None]
+            rows[update] = np.broadcast_to(value[:, None], rows.shape)[update]
+            array[g, targets] = rows
+        self.noteTokens[g] += 1
+
+        self.currentPlayer[games] = (players + 1) % P
+        # last round: once the deck is empty every player has one more move, see Game.satisfyRequest
+        lastRound = games[self.deckSize[games] == 0]
+        self.lastMoves[lastRound] -= 1
+        self.__checkEnded(games)
+        self.moves += 1
+
+    def __checkEnded(self, games: np.ndarray):
+        fireworksScore = self.fireworks[games].sum(axis=1)
+        storm = self.stormTokens[games] == MAX_STORM_TOKENS
+        complete = fireworksScore == NUM_COLORS * NUM_VALUES
+        lastMove = self.lastMoves[games] == 0
+        ended = storm | complete | lastMove
+        self.scores[games] = np.where(storm, 0, fireworksScore)
+        self.done[games[ended]] = True
+
+    def play(self, policy) -> np.ndarray:
+        '''
+        Plays all the games to the end and returns their scores.
+        policy: called with the observations of observe() and returning one action per game.
+        '''
+        while not self.done.all():
+            self.step(policy(self.observe()))
+        return self.scores.copy()
+
+
+class RandomPolicy(object):
+    '''
+    Picks one of the allowed actions at random.
+    '''
+    def __init__(self, seed=None) -> None:
+        super().__init__()
+        self.rng = np.random.default_rng(seed)
+
+    def __call__(self, observation: dict) -> np.ndarray:
+        legal = observation["legal"]
+        weights = self.rng.random(legal.shape) * legal
+        return weights.argmax(axis=1)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Plays batches of games with a random policy")
+    parser.add_argument("num_players", nargs="?", type=int, default=2, help="number of players, from 2 to 5")
+    parser.add_argument("game_number", nargs="?", type=int, default=10000, help="number of games to play")
+    parser.add_argument("--batch-size", type=int, default=10000, help="games played in lockstep")
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    scores = []
+    games = BatchGame(min(args.batch_size, args.game_number), args.num_players, args.seed)
+    policy = RandomPolicy(args.seed)
+    while len(scores) < args.game_number:
+        games.reset()
+        scores.extend(games.play(policy)[:args.game_number - len(scores)].tolist())
+    elapsed = time.perf_counter() - start
+    print(f"{len(scores)} games in {elapsed:.1f}s ({len(scores) / elapsed:.0f} games/s), AVG SCORE: {sum(scores) / len(scores)}")
@@ -19,6 +19,9 @@ else:
     ip = argv[1]
     port = int(argv[2])
 
+# Optional table to join, otherwise the server picks one still in the lobby
+table = argv[4] if len(argv) > 4 else None
+
 run = True
 
 statuses = ["Lobby", "Game", "GameHint"]
@@ -37,14 +40,14 @@ def manageInput():
             run = False
             os._exit(0)
         elif command == "ready" and status == statuses[0]:
-            s.send(GameData.ClientPlayerStartRequest(playerName).serialize())
+            s.sendall(GameData.ClientPlayerStartRequest(playerName).serialize())
         elif command == "show" and status == statuses[1]:
-            s.send(GameData.ClientGetGameStateRequest(playerName).serialize())
+            s.sendall(GameData.ClientGetGameStateRequest(playerName).serialize())
         elif command.split(" ")[0] == "discard" and status == statuses[1]:
             try:
                 cardStr = command.split(" ")
                 cardOrder = int(cardStr[1])
-                s.send(GameData.ClientPlayerDiscardCardRequest(playerName, cardOrder).serialize())
+                s.sendall(GameData.ClientPlayerDiscardCardRequest(playerName, cardOrder).serialize())
             except:
                 print("Maybe you wanted to type 'discard <num>'?")
                 continue
@@ -52,7 +55,7 @@ def manageInput():
             try:
                 cardStr = command.split(" ")
                 cardOrder = int(cardStr[1])
-                s.send(GameData.ClientPlayerPlayCardRequest(playerName, cardOrder).serialize())
+                s.sendall(GameData.ClientPlayerPlayCardRequest(playerName, cardOrder).serialize())
             except:
                 print("Maybe you wanted to type 'play <num>'?")
                 continue
@@ -73,7 +76,7 @@ def manageInput():
                     if value not in ["green", "red", "blue", "yellow", "white"]:
                         print("Error: card color can only be green, red, blue, yellow or white")
                         continue
-                s.send(GameData.ClientHintData(playerName, destination, t, value).serialize())
+                s.sendall(GameData.ClientHintData(playerName, destination, t, value).serialize())
             except:
                 print("Maybe you wanted to type 'hint <type> <destinatary> <value>'?")
                 continue
@@ -85,30 +88,28 @@ def manageInput():
         stdout.flush()
 
 with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-    request = GameData.ClientPlayerAddData(playerName)
+    request = GameData.ClientPlayerAddData(playerName, table)
     s.connect((HOST, PORT))
-    s.send(request.serialize())
-    data = s.recv(DATASIZE)
-    data = GameData.GameData.deserialize(data)
+    s.sendall(request.serialize())
+    reader = GameData.FrameReader(s)
+    data = reader.read()
     if type(data) is GameData.ServerPlayerConnectionOk:
-        print("Connection accepted by the server. Welcome " + playerName)
+        print("Connection accepted by the server. Welcome " + playerName + " (table " + str(data.table) + ")")
     print("[" + playerName + " - " + status + "]: ", end="")
     Thread(target=manageInput).start()
     while run:
         dataOk = False
-        data = s.recv(DATASIZE)
-        if not data:
+        data = reader.read()
+        if data is None:
             continue
-        data = GameData.GameData.deserialize(data)
         if type(data) is GameData.ServerPlayerStartRequestAccepted:
             dataOk = True
             print("Ready: " + str(data.acceptedStartRequests) + "/"  + str(data.connectedPlayers) + " players")
-            data = s.recv(DATASIZE)
-            data = GameData.GameData.deserialize(data)
+            data = reader.read()
         if type(data) is GameData.ServerStartGameData:
             dataOk = True
             print("Game start!")
-            s.send(GameData.ClientPlayerReadyData(playerName).serialize())
+            s.sendall(GameData.ClientPlayerReadyData(playerName).serialize())
             status = statuses[1]
         if type(data) is GameData.ServerGameStateData:
             dataOk = True
@@ -2,11 +2,12 @@ import logging
 
 import GameData
 from game import Player
-from client_state.card_info import Color, Value, DECK_SIZE, DECK_COLOR_STRUCTURE, DECK_VALUE_STRUCTURE, \
-    DECK_SINGLE_FIREWORK_STRUCTURE
+from client_state.card_info import Color, Value, DECK_SINGLE_FIREWORK_STRUCTURE, COLOR_INDEXES
 from client_state.player_hand import Hand, ObservableCard, HiddenCard
 from typing import Dict, List, Set
-from actions.actions import HintResult, PlayCardResult, DiscardCardResult, Action
+from actions.actions import HintResult, PlayCardResult, DiscardCardResult, Action, Hint, PlayCard, DiscardCard
+
+MAX_BLUE_TOKENS = 8
 
 
 class AgentState:
@@ -40,9 +41,22 @@ class AgentState:
         # indexes of the just hinted cards in my hand
         self.just_hinted: Set[int] = set()
 
+        # versione dello stato: cresce a ogni update_state e handle_action_result, le query derivate (carte
+        # giocabili, critiche, osservabili, fireworks minimo e massimo) restano in cache finché non cambia
+        self.version: int = 0
+        self.__cache: Dict[str, object] = {}
+        self.__cache_version: int = 0
+        self.cache_hits: int = 0
+        self.cache_misses: int = 0
+
         self.update_state(game_state)
 
+        # carte viste (mani degli altri, fireworks, scarti e carte mie con entrambi gli hint) come matrice
+        # [indice colore][valore - 1]: si conta tutto una volta qui, poi la aggiorna handle_action_result
+        self.seen_cards: List[List[int]] = self.__count_seen_cards()
+
     def handle_action_result(self, action: Action):
+        self.version += 1
         action_type = type(action)
         if action_type is HintResult:
 
@@ -60,16 +74,55 @@ class AgentState:
         elif action_type is PlayCardResult or action_type is DiscardCardResult:
 
             if action.source_player == self.agent_name:
+                # la carta usata ora è visibile sul tavolo, se la conoscevo già era contata nella mia mano
+                old_card = self.hand[action.card_index]
+                if old_card.hasColorHint() and old_card.hasValueHint():
+                    self.__see_card(old_card.hint_color, old_card.hint_value, -1)
+                used_card = action.played_card if action_type is PlayCardResult else action.discarded_card
+                self.__see_card(used_card.color, used_card.value)
                 self.on_new_card(action.card_index, action.card_drawn)
             else:
+                # la carta usata passa dalla mano al tavolo, si aggiunge solo quella pescata
                 for player_hand in self.player_hands.values():
                     if player_hand.player_name == action.source_player:
                         player_hand.draw_card(action.card_index, action.card_drawn)
                         break
+                if action.card_drawn is not None:
+                    self.__see_card(action.card_drawn.color, action.card_drawn.value)
 
         else:
             logging.error("handle_action_result(): Unknown action result")
 
+    def can_discard(self) -> bool:
+        return self.used_blue_token > 0
+
+    def can_hint(self) -> bool:
+        return self.used_blue_token < MAX_BLUE_TOKENS
+
+    def get_legal_hints(self, player_turns: List[int] = None) -> List[Hint]:
+        """
+        Tutti gli hint accettati dal server, per i giocatori in player_turns (tutti gli altri se None):
+        solo i colori e i valori presenti nella loro mano, letti dalle bitmask di Hand
+        """
+        if not self.can_hint():
+            return []
+        if player_turns is None:
+            player_turns = self.player_hands.keys()
+        hints = []
+        for turn in player_turns:
+            player_hand = self.player_hands[turn]
+            hints += [Hint(self.agent_name, player_hand.player_name, color) for color in player_hand.color_masks]
+            hints += [Hint(self.agent_name, player_hand.player_name, value) for value in player_hand.value_masks]
+        return hints
+
+    def get_legal_actions(self) -> List[Action]:
+        """Tutte le azioni accettate dal server nello stato attuale: giocate, scarti e hint"""
+        card_indexes = range(len(self.hand))
+        actions: List[Action] = [PlayCard(self.agent_name, idx) for idx in card_indexes]
+        if self.can_discard():
+            actions += [DiscardCard(self.agent_name, idx) for idx in card_indexes]
+        return actions + self.get_legal_hints()
+
     def on_hint_received(self, hint: Color or Value, card_indexes: List[int]):
         # Gli hint possono arrivare più volte da vari giocatori se si gioca in più di 2
         # quindi vanno "appesi"
@@ -77,7 +130,11 @@ class AgentState:
         all_card_indexes = set(range(len(self.hand)))
         unhinted_card_indexes = all_card_indexes.difference(card_indexes)
         for i in card_indexes:
-            self.hand[i].set_hint(hint)
+            card = self.hand[i]
+            was_known = card.hasColorHint() and card.hasValueHint()
+            card.set_hint(hint)
+            if not was_known and card.hasColorHint() and card.hasValueHint():
+                self.__see_card(card.hint_color, card.hint_value)
 
         for i in unhinted_card_indexes:
             self.hand[i].exclude(hint)
@@ -88,43 +145,59 @@ class AgentState:
             assert type(card_drawn) is HiddenCard
             self.hand.append(card_drawn)
 
-    def get_observable_cards(self) -> Dict[ObservableCard, int]:
-        # {Colore,valore: count}
-        observable_cards = dict()
+    def __count_seen_cards(self) -> List[List[int]]:
+        seen_cards = [[0] * len(Value) for _ in Color]
         for player_hand in self.player_hands.values():
             for card in player_hand.hand:
-                previous_card_count = observable_cards.get(card, 0)
-                observable_cards[card] = previous_card_count + 1
+                seen_cards[COLOR_INDEXES[card.color]][card.value.value - 1] += 1
 
         for color, card_value in self.fireworks.items():
             for i in range(card_value):
-                card = ObservableCard(value=i + 1, color=str(color))
-                previous_card_count = observable_cards.get(card, 0)
-                observable_cards[card] = previous_card_count + 1
+                seen_cards[COLOR_INDEXES[color]][i] += 1
 
         for card, count in self.discard_pile.items():
-            previous_card_count = observable_cards.get(card, 0)
-            observable_cards[card] = previous_card_count + count
+            seen_cards[COLOR_INDEXES[card.color]][card.value.value - 1] += count
 
         for hidden_card in self.hand:
             if hidden_card.hasValueHint() and hidden_card.hasColorHint():
-                card = ObservableCard(hidden_card.hint_value.value, hidden_card.hint_color.value)
-                previous_card_count = observable_cards.get(card, 0)
-                observable_cards[card] = previous_card_count + 1
+                seen_cards[COLOR_INDEXES[hidden_card.hint_color]][hidden_card.hint_value.value - 1] += 1
+
+        return seen_cards
+
+    def __see_card(self, color: Color, value: Value, count: int = 1):
+        row = self.seen_cards[COLOR_INDEXES[color]]
+        row[value.value - 1] += count
+        assert 0 <= row[value.value - 1] <= DECK_SINGLE_FIREWORK_STRUCTURE[value]
+
+    def get_seen_count(self, color: Color, value: Value) -> int:
+        return self.seen_cards[COLOR_INDEXES[color]][value.value - 1]
+
+    def __cached(self, key: str, compute):
+        # i valori in cache sono condivisi tra i chiamanti, non vanno modificati
+        if self.__cache_version != self.version:
+            self.__cache = {}
+            self.__cache_version = self.version
+        if key in self.__cache:
+            self.cache_hits += 1
+            return self.__cache[key]
+        self.cache_misses += 1
+        value = compute()
+        self.__cache[key] = value
+        return value
 
-        for card, count in observable_cards.items():
-            assert count <= DECK_SINGLE_FIREWORK_STRUCTURE[card.value]
+    def get_observable_cards(self) -> Dict[ObservableCard, int]:
+        return self.__cached("observable_cards", self.__get_observable_cards)
 
-        return observable_cards
+    def __get_observable_cards(self) -> Dict[ObservableCard, int]:
+        # {Colore,valore: count}, letto dalla matrice delle carte viste
+        return {ObservableCard(value.value, color.value): self.get_seen_count(color, value)
+                for color in Color for value in Value if self.get_seen_count(color, value) > 0}
 
     def get_cards_of_color_value(self) -> (Dict[Color, int], Dict[Value, int]):
 
-        played_for_color: Dict[Color, int] = {color: 0 for color in Color.getColors()}
-        played_for_value: Dict[Value, int] = {value: 0 for value in Value.getValues()}
-
-        for observable_card, count in self.get_observable_cards().items():
-            played_for_color[observable_card.color] += count
-            played_for_value[observable_card.value] += count
+        played_for_color: Dict[Color, int] = {color: sum(self.seen_cards[COLOR_INDEXES[color]]) for color in Color}
+        played_for_value: Dict[Value, int] = {
+            value: sum(row[value.value - 1] for row in self.seen_cards) for value in Value}
 
         return played_for_color, played_for_value
 
@@ -142,6 +215,7 @@ class AgentState:
         return hinted_color_count, hinted_value_count
 
     def update_state(self, game_state: GameData.ServerGameStateData):
+        self.version += 1
         self.used_blue_token = game_state.usedNoteTokens
         self.used_red_token = game_state.usedStormTokens
         self.current_player = game_state.currentPlayer
@@ -176,139 +250,58 @@ class AgentState:
 
         self.is_state_updated = True
 
-    @staticmethod
-    def __update_card_current_belief(card: HiddenCard, all_observable_cards):
-
-        # se è stato hintato il colore setto le probabilità di quel colore a 1 e il resto a 0
-        if card.hasColorHint():
-            card.possible_colors = {color: 0 for color in Color.getColors()}
-            card.possible_colors[card.hint_color] = 1
-        # se è stato hintato il value setto le probabilità di quel value a 1 e il resto a 0
-        if card.hasValueHint():
-            card.possible_values = {value: 0 for value in Value.getValues()}
-            card.possible_values[card.hint_value] = 1
-
-        # se ho entrambi gli hint non faccio più nulla
-        if card.hasColorHint() and card.hasValueHint():
-            return
-
-        not_excluded_values = Value.getValues().difference(card.excluded_values)
-        not_excluded_colors = Color.getColors().difference(card.excluded_colors)
-
-        # se ho solo l'hint sul colore calcolo le probabilità dei value considerando solo le carte di quel colore
-        if card.hasColorHint() and not card.hasValueHint():
-
-            excluded_card_number = sum(
-                [DECK_SINGLE_FIREWORK_STRUCTURE[excluded_value] for excluded_value in card.excluded_values])
-            observable_card_not_excluded = {not_excluded_value: all_observable_cards.get(
-                ObservableCard(not_excluded_value.value, card.hint_color.value), 0)
-                for not_excluded_value in not_excluded_values}
-
-            observable_card_not_excluded_number = sum(observable_card_not_excluded.values())
-
-            for value in card.possible_values:
-                if value in card.excluded_values:
-                    card.possible_values[value] = 0
-                else:
-                    possible_cards = DECK_SINGLE_FIREWORK_STRUCTURE[value] - observable_card_not_excluded[value]
-                    total_cards = DECK_COLOR_STRUCTURE[
-                                      card.hint_color] - excluded_card_number - observable_card_not_excluded_number
-
-                    assert total_cards != 0
-
-                    card.possible_values[value] = possible_cards / total_cards
-
-        # se ho solo l'hint sul value calcolo le probabilità dei colors considerando solo le carte di quel value
-        elif card.hasValueHint() and not card.hasColorHint():
-
-            excluded_card_number = DECK_SINGLE_FIREWORK_STRUCTURE[card.hint_value] * len(card.excluded_colors)
-            single_value_possible_color = {
-                color: all_observable_cards.get(ObservableCard(card.hint_value.value, color), 0) for color in
-                not_excluded_colors}
-            observable_card_not_excluded_number = sum(single_value_possible_color.values())
-
-            for color in card.possible_colors:
-                # Se il colore rientra nei colori esclusi metto la probabilità a 0
-                if color in card.excluded_colors:
-                    card.possible_colors[color] = 0
-                else:
-                    possible_cards = DECK_SINGLE_FIREWORK_STRUCTURE[card.hint_value] - single_value_possible_color[
-                        color]
-                    total_cards = DECK_VALUE_STRUCTURE[
-                                      card.hint_value] - excluded_card_number - observable_card_not_excluded_number
-
-                    assert total_cards != 0
-
-                    card.possible_colors[color] = possible_cards / total_cards
-
-        # non ho nessun hint, calcolo le probabilità considerando solo i not excluded values e colors
-        else:
-            excluded_cards = 0
-
-            # per ogni colore escluso setto le probabilità a 0 e sommo 10 alle carte escluse per ogni colore
-            for excluded_color in card.excluded_colors:
-                card.possible_colors[excluded_color] = 0
-                excluded_cards += DECK_COLOR_STRUCTURE[excluded_color]
-
-            # per ogni value escluso setto la probabilità a 0 e sommo il numero di carte totali di quel valore (15 in
-            # caso di value 1) evitando di contare quelle già incluse per i colori esclusi (in caso di value 1 tolgo
-            # 3 carte per ogni colore escluso)
-            count_excluded = 0
-            for excluded_value in card.excluded_values:
-                count_excluded += DECK_SINGLE_FIREWORK_STRUCTURE[excluded_value]
-                card.possible_values[excluded_value] = 0
-                excluded_cards += DECK_VALUE_STRUCTURE[excluded_value] - (
-                            DECK_SINGLE_FIREWORK_STRUCTURE[excluded_value] * len(card.excluded_colors))
-
-            # calcolo tutte le carte giocate not excluded
-            not_excluded_observable_cards = 0
-
-            not_excluded_values_dict: Dict[Value: int] = {value: 0 for value in Value.getValues()}
-            not_excluded_colors_dict: Dict[Color: int] = {color: 0 for color in Color.getColors()}
-
-            for obs_card, count in all_observable_cards.items():
-                if obs_card.color in not_excluded_colors and obs_card.value in not_excluded_values:
-                    not_excluded_observable_cards += count
-                    not_excluded_values_dict[obs_card.value] += count
-                    not_excluded_colors_dict[obs_card.color] += count
-
-            total_cards = DECK_SIZE - excluded_cards - not_excluded_observable_cards
-            assert total_cards != 0
-
-            for color in not_excluded_colors:
-                possible_cards = DECK_COLOR_STRUCTURE[color] - count_excluded - not_excluded_colors_dict[color]
-                card.possible_colors[color] = possible_cards / total_cards
-
-            for value in not_excluded_values:
-                possible_cards = DECK_VALUE_STRUCTURE[value] - (DECK_SINGLE_FIREWORK_STRUCTURE[value]*len(card.excluded_colors)) - not_excluded_values_dict[value]
-                card.possible_values[value] = possible_cards / total_cards
-
-        assert abs(sum(card.possible_values.values()) - 1) < 0.001
-        assert abs(sum(card.possible_colors.values()) - 1) < 0.001
-
     def update_current_belief(self):
 
         if not self.is_state_updated:
             raise Exception(f"You have to call the updateState() method first")
 
-        all_observable_cards = self.get_observable_cards()
-        played_color_cards, played_value_cards = self.get_cards_of_color_value()
+        # copie non ancora viste di ogni coppia colore/valore, comuni a tutta la mano
+        unseen_cards = [DECK_SINGLE_FIREWORK_STRUCTURE[value] - row[value.value - 1]
+                        for row in self.seen_cards for value in Value]
+        values_number = len(Value)
+        cards_range = range(len(unseen_cards))
 
         for card in self.hand:
-            AgentState.__update_card_current_belief(card, all_observable_cards)
+            # ogni coppia compatibile con hint ed esclusioni pesa quanto le sue copie non viste; con entrambi gli
+            # hint la carta è nota (ed è già contata tra le carte viste) e resta una sola coppia
+            mask = card.constraint_mask
+            if card.hasColorHint() and card.hasValueHint():
+                possible_cards = [1 if mask >> idx & 1 else 0 for idx in cards_range]
+            else:
+                possible_cards = [unseen_cards[idx] if mask >> idx & 1 else 0 for idx in cards_range]
+
+            total_cards = sum(possible_cards)
+            assert total_cards != 0
+
+            card.belief = [count / total_cards for count in possible_cards]
+            # le marginali si sommano sugli interi e si dividono una volta sola
+            for color in card.possible_colors:
+                start = COLOR_INDEXES[color] * values_number
+                card.possible_colors[color] = sum(possible_cards[start:start + values_number]) / total_cards
+            for value in card.possible_values:
+                card.possible_values[value] = sum(possible_cards[value.value - 1::values_number]) / total_cards
 
     def get_playable_cards(self) -> Dict[Color, Value]:
+        return self.__cached("playable_cards", self.__get_playable_cards)
+
+    def __get_playable_cards(self) -> Dict[Color, Value]:
         return {color: Value(value + 1) for color, value in self.fireworks.items() if value != Value.FIVE.value}
 
+    def get_min_firework_value(self) -> int:
+        return self.__cached("min_firework_value", lambda: min(self.fireworks.values()))
+
+    def get_max_firework_value(self) -> int:
+        return self.__cached("max_firework_value", lambda: max(self.fireworks.values()))
+
     def is_card_playable(self, card) -> bool:
 
         if type(card) is HiddenCard:
 
             # Una carta è playable in due casi:
             # Ha un valore che può essere messo su qualsiasi firework
-            firework_values = list(self.fireworks.values())
-            if len(set(firework_values)) == 1 and card.hasValueHint():
-                return (card.hint_value.value - 1) == firework_values[0]
+            min_firework_value = self.get_min_firework_value()
+            if min_firework_value == self.get_max_firework_value() and card.hasValueHint():
+                return (card.hint_value.value - 1) == min_firework_value
 
             elif not card.hasColorHint() or not card.hasValueHint():
                 return False
@@ -336,8 +329,7 @@ class AgentState:
         if type(card) is HiddenCard:
 
             # troviamo la carta minima giocabile: tutte le carte sotto quel valore sono useless
-            min_firework_value = min(self.fireworks.values())
-            if card.hasValueHint() and card.hint_value.value <= min_firework_value:
+            if card.hasValueHint() and card.hint_value.value <= self.get_min_firework_value():
                 return True
 
             if card.hasColorHint():
@@ -369,11 +361,7 @@ class AgentState:
 
         if type(card) is HiddenCard:
             # HiddenCard è useful se ha una probabilità alta di essere una determinata combinazione colore/valore
-            probability_list = []
-            for color, value in playable_cards.items():
-                probability_list.append(card.possible_colors[color] * card.possible_values[value])
-
-            max_probability = max(probability_list)
+            max_probability = max(card.get_probability(color, value) for color, value in playable_cards.items())
 
         elif type(card) is ObservableCard:
             # ObsevableCard è useful se è quella subito dopo la playable
@@ -396,14 +384,11 @@ class AgentState:
         if type(card) is HiddenCard:
 
             #HiddenCard sacrificabile se ha una bassa probabilità di essere critica
-            probability_list = []
-            for critical_card in critical_cards:
-                probability_list.append(card.possible_colors[critical_card.color] * card.possible_values[critical_card.value])
-
-            if len(probability_list) == 0:
+            if len(critical_cards) == 0:
                 return 1
 
-            max_probability = max(probability_list)
+            max_probability = max(card.get_probability(critical_card.color, critical_card.value)
+                                  for critical_card in critical_cards)
 
         elif type(card) is ObservableCard:
 
@@ -433,6 +418,9 @@ class AgentState:
             raise Exception("Wrong usability check!")
 
     def get_critical_cards(self) -> Set[ObservableCard]:
+        return self.__cached("critical_cards", self.__get_critical_cards)
+
+    def __get_critical_cards(self) -> Set[ObservableCard]:
         firework_structure = DECK_SINGLE_FIREWORK_STRUCTURE
         critical_cards = set()
 
@@ -471,8 +459,9 @@ class AgentState:
         return f"""
         FIREWORKS: {{{fireworks}}}
         DISCARD_PILE: {{{discard_pile}}}
-        TOKENS: Blue({self.used_blue_token}/8) - Red({self.used_red_token}/3)
+        TOKENS: Blue({self.used_blue_token}/{MAX_BLUE_TOKENS}) - Red({self.used_red_token}/3)
         SCORE: {self.score}/25
+        CACHE: {self.cache_hits} hits, {self.cache_misses} misses (state version {self.version})
 
         PLAYERS:
         {players}
@@ -42,4 +42,18 @@ DECK_VALUE_STRUCTURE = {Value.ONE: 15, Value.TWO: 10, Value.THREE: 10, Value.FOU
 DECK_COLOR_STRUCTURE = {Color.WHITE: 10, Color.YELLOW: 10, Color.GREEN: 10, Color.BLUE: 10, Color.RED: 10}
 DECK_SINGLE_FIREWORK_STRUCTURE = {Value.ONE: 3, Value.TWO: 2, Value.THREE: 2, Value.FOUR: 2, Value.FIVE: 1}
 
-DECK_SIZE = 50
\ No newline at end of file
+DECK_SIZE = 50
+
+# indice di riga di ogni colore nelle matrici 5x5 colore/valore, le colonne sono value - 1
+COLOR_INDEXES = {color: idx for idx, color in enumerate(Color)}
+
+
+def card_index(color: Color, value: Value) -> int:
+    # posizione della coppia colore/valore nelle liste piatte di 25 elementi, riga per riga come le matrici 5x5
+    return COLOR_INDEXES[color] * len(Value) + value.value - 1
+
+
+# bitmask delle 25 coppie colore/valore: tutte, quelle di un colore e quelle di un valore
+ALL_CARDS_MASK = (1 << len(Color) * len(Value)) - 1
+COLOR_MASKS = {color: sum(1 << card_index(color, value) for value in Value) for color in Color}
+VALUE_MASKS = {value: sum(1 << card_index(color, value) for color in Color) for value in Value}
\ No newline at end of file
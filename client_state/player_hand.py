@@ -1,7 +1,8 @@
 import logging
 from typing import Dict, List, Set
 
-from client_state.card_info import Value, Color, DECK_VALUE_STRUCTURE
+from client_state.card_info import Value, Color, DECK_VALUE_STRUCTURE, DECK_SINGLE_FIREWORK_STRUCTURE, DECK_SIZE, \
+    COLOR_INDEXES, card_index, ALL_CARDS_MASK, COLOR_MASKS, VALUE_MASKS
 from game import Player
 
 
@@ -10,6 +11,13 @@ class Hand:
     def __init__(self, player: Player):
         self.player_name = player.name
         self.hand = [ObservableCard(c.value, c.color) for c in player.hand]
+        # le carte sono condivise (vedi ObservableCard), gli hint ricevuti si tengono per posizione nella mano
+        self.color_hinted: List[bool] = [False] * len(self.hand)
+        self.value_hinted: List[bool] = [False] * len(self.hand)
+        # posizioni di ogni colore e valore nella mano: il bit i è acceso se la carta i ha quel colore o valore
+        self.color_masks: Dict[Color, int] = {}
+        self.value_masks: Dict[Value, int] = {}
+        self.__update_masks()
 
     def __str__(self):
         return f"{self.player_name} - {self.hand}"
@@ -24,24 +32,71 @@ class Hand:
             # if not (old_card.color.value == card.color and old_card.value.value == card.value):
             #     print("hand inconsistency")
 
+    def __update_masks(self):
+        # si ricalcolano solo quando la mano cambia, le mani hanno al più 5 carte
+        self.color_masks = {}
+        self.value_masks = {}
+        for idx, card in enumerate(self.hand):
+            self.color_masks[card.color] = self.color_masks.get(card.color, 0) | 1 << idx
+            self.value_masks[card.value] = self.value_masks.get(card.value, 0) | 1 << idx
+
+    def hint_mask(self, hint: Value or Color) -> int:
+        """Bitmask delle posizioni indicate dall'hint, 0 se l'hint non è valido per questa mano"""
+        if type(hint) is Color:
+            return self.color_masks.get(hint, 0)
+        return self.value_masks.get(hint, 0)
+
+    def is_color_hinted(self, idx: int) -> bool:
+        return self.color_hinted[idx]
+
+    def is_value_hinted(self, idx: int) -> bool:
+        return self.value_hinted[idx]
+
+    def is_hintable(self, idx: int) -> bool:
+        return not (self.color_hinted[idx] and self.value_hinted[idx])
+
     def hint_cards(self, hint: Value or Color, positions: List[int]):
+        if type(hint) is Color:
+            hinted = self.color_hinted
+        elif type(hint) is Value:
+            hinted = self.value_hinted
+        else:
+            raise Exception("Unknown hint type")
         for pos in positions:
-            self.hand[pos].set_hint(hint)
+            hinted[pos] = True
 
     def draw_card(self, used_card_index: int, drawn_card):
         del self.hand[used_card_index]
+        del self.color_hinted[used_card_index]
+        del self.value_hinted[used_card_index]
         if drawn_card is not None:
             assert type(drawn_card) is ObservableCard
             self.hand.append(drawn_card)
+            self.color_hinted.append(False)
+            self.value_hinted.append(False)
+        self.__update_masks()
 
 
 class ObservableCard:
+    """
+    Carta di cui si conoscono colore e valore. Le 25 carte esistono una volta sola: ObservableCard(value, color)
+    (con int o Value, str o Color) restituisce sempre la stessa istanza, immutabile, quindi due carte uguali
+    sono lo stesso oggetto
+    """
+
+    __slots__ = ("value", "color", "__hash")
 
-    def __init__(self, value: int, color: str, is_color_hinted: bool = False, is_value_hinted: bool = False):
-        self.value = Value(value)
-        self.color = Color(color)
-        self.is_color_hinted = is_color_hinted
-        self.is_value_hinted = is_value_hinted
+    def __new__(cls, value: int or Value, color: str or Color):
+        try:
+            return _OBSERVABLE_CARDS[(value, color)]
+        except KeyError:
+            raise ValueError(f"There is no card {value} {color}") from None
+
+    def __setattr__(self, name, value):
+        raise AttributeError("ObservableCard is immutable")
+
+    def __reduce__(self):
+        return ObservableCard, (self.value.value, self.color.value)
 
     def __str__(self):
         return f"({self.color} {self.value})"
@@ -50,24 +105,27 @@ class ObservableCard:
         return self.__str__()
 
     def __hash__(self):
-        return (self.color, self.value).__hash__()
+        return self.__hash
 
     def __eq__(self, other):
-        if not hasattr(other, 'color') or not hasattr(other, 'value'):
-            return False
+        return self is other
 
-        return self.color == other.color and self.value == other.value
 
-    def is_hintable(self):
-        return not (self.is_color_hinted and self.is_value_hinted)
+def _make_observable_cards() -> Dict:
+    cards = {}
+    for color in Color:
+        for value in Value:
+            card = object.__new__(ObservableCard)
+            object.__setattr__(card, "value", value)
+            object.__setattr__(card, "color", color)
+            object.__setattr__(card, "_ObservableCard__hash", (color, value).__hash__())
+            for value_key in (value, value.value):
+                for color_key in (color, color.value):
+                    cards[(value_key, color_key)] = card
+    return cards
 
-    def set_hint(self, hint: Color or Value):
-        if type(hint) is Color:
-            self.is_color_hinted = True
-        elif type(hint) is Value:
-            self.is_value_hinted = True
-        else:
-            raise Exception("Unknown hint type")
+
+_OBSERVABLE_CARDS = _make_observable_cards()
 
 
 class HiddenCard:
@@ -76,6 +134,10 @@ class HiddenCard:
 
         self.possible_values: Dict[Value: float] = {value: DECK_VALUE_STRUCTURE[value] / 50 for value in Value.getValues()}
         self.possible_colors: Dict[Color: float] = {color: 1 / len(Color.getColors()) for color in Color.getColors()}
+        # probabilità congiunta di ogni coppia colore/valore, lista piatta indicizzata da card_index
+        self.belief: List[float] = [DECK_SINGLE_FIREWORK_STRUCTURE[value] / DECK_SIZE for _ in Color for value in Value]
+        # bit card_index acceso se la coppia colore/valore è ancora compatibile con hint ed esclusioni
+        self.constraint_mask: int = ALL_CARDS_MASK
         self.hint_color = None
         self.hint_value = None
         self.excluded_values: Set[Value] = set()
@@ -85,6 +147,7 @@ class HiddenCard:
     def set_hint_color(self, hinted_color: Color):
 
         self.hint_color = hinted_color
+        self.constraint_mask &= COLOR_MASKS[hinted_color]
         for color in self.possible_colors:
             if hinted_color == color:
                 self.possible_colors[color] = 1.0
@@ -94,6 +157,7 @@ class HiddenCard:
     def set_hint_value(self, hinted_value: Value):
 
         self.hint_value = hinted_value
+        self.constraint_mask &= VALUE_MASKS[hinted_value]
         for value in self.possible_values:
             if hinted_value == value:
                 self.possible_values[value] = 1
@@ -114,10 +178,12 @@ class HiddenCard:
         # se è già stata hintata non c'è bisogno di aggiungere un valore ai colori esclusi
         if hint_type is Color and self.hint_color is None:
             self.excluded_colors.add(hint)
+            self.constraint_mask &= ~COLOR_MASKS[hint]
 
         # se è già stata hintata non c'è bisogno di aggiungere un valore ai valori esclusi
         elif hint_type is Value:
             self.excluded_values.add(hint)
+            self.constraint_mask &= ~VALUE_MASKS[hint]
 
     def hasValueHint(self) -> bool:
         return self.hint_value is not None
@@ -125,10 +191,20 @@ class HiddenCard:
     def hasColorHint(self) -> bool:
         return self.hint_color is not None
 
+    def get_probability(self, color: Color, value: Value) -> float:
+        return self.belief[card_index(color, value)]
+
+    def get_color_probability(self, color: Color) -> float:
+        start = COLOR_INDEXES[color] * len(Value)
+        return sum(self.belief[start:start + len(Value)])
+
+    def get_value_probability(self, value: Value) -> float:
+        return sum(self.belief[value.value - 1::len(Value)])
+
 if __name__ == '__main__':
     c1 = ObservableCard(2, "red")
     c2 = ObservableCard(2, "red")
     d = dict()
     d[c1] = 1
     d[c2] = 2
-    print(d)
+    print(d, c1 is c2)
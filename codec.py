@@ -0,0 +1,376 @@
+# Compact binary encoding of the GameData messages, alternative to pickle
+import pickle
+import struct
+
+import GameData
+from constants import HEADERSIZE
+from game import Card, Player
+
+PICKLE = "pickle"
+BINARY = "binary"
+# Codecs known by this implementation, in order of preference
+CODECS = [BINARY, PICKLE]
+
+# First byte of a binary payload. A pickle payload always starts with the PROTO opcode (0x80)
+BINARY_TAG = 0x01
+PICKLE_TAG = GameData.PICKLE_PROTO
+
+COLORS = ["red", "yellow", "green", "blue", "white"]
+_colorIndexes = {color: i for i, color in enumerate(COLORS)}
+
+_NONE = 0xFF
+_NONE_STR = 0xFFFF
+_NONE_U32 = 0xFFFFFFFF
+
+# One shared Card per color/value pair, indexed by cardCode
+_cards = [Card(color * 5 + value - 1, value, COLORS[color]) for color in range(5) for value in range(1, 6)]
+
+
+def cardCode(card: Card) -> int:
+    '''
+    A card is encoded as a single byte: color * 5 + value - 1, so 0..24.
+    '''
+    return _colorIndexes[card.color] * 5 + card.value - 1
+
+
+def codeCard(code: int) -> Card:
+    '''
+    Inverse of cardCode. Decoded cards are shared between messages and their id is the card code,
+    the id of the card in the server deck is not sent.
+    '''
+    return _cards[code]
+
+
+# Field encoders: each one appends the field to a bytearray
+def _packU8(buf: bytearray, value):
+    buf.append(_NONE if value is None else value)
+
+
+def _packI32(buf: bytearray, value):
+    buf += struct.pack("<i", value)
+
+
+def _packU32(buf: bytearray, value):
+    buf += struct.pack("<I", _NONE_U32 if value is None else value)
+
+
+def _packStr(buf: bytearray, value):
+    if value is None:
+        buf += struct.pack("<H", _NONE_STR)
+        return
+    data = str(value).encode("utf-8")
+    buf += struct.pack("<H", len(data))
+    buf += data
+
+
+def _packCard(buf: bytearray, card):
+    buf.append(_NONE if card is None else cardCode(card))
+
+
+def _packCards(buf: bytearray, cards):
+    buf.append(len(cards))
+    buf += bytes(cardCode(card) for card in cards)
+
+
+def _packU8s(buf: bytearray, values):
+    buf.append(len(values))
+    buf += bytes(values)
+
+
+def _packStrs(buf: bytearray, values):
+    values = values or []
+    buf.append(len(values))
+    for value in values:
+        _packStr(buf, value)
+
+
+def _packPlayers(buf: bytearray, players):
+    buf.append(len(players))
+    for player in players:
+        _packStr(buf, player.name)
+        _packCards(buf, player.hand)
+
+
+def _packTable(buf: bytearray, table):
+    for color in COLORS:
+        _packCards(buf, table[color])
+
+
+def _packHint(buf: bytearray, value):
+    # a hint is either a value (1..5) or a color, stored as 6 + its index
+    if type(value) is int:
+        buf.append(value)
+    else:
+        buf.append(6 + _colorIndexes[value])
+
+
+# Operations of a state delta, the index is the opcode
+_CHANGES = ["remove", "draw", "firework", "discard"]
+_changeCodes = {change: i for i, change in enumerate(_CHANGES)}
+
+
+def _packChanges(buf: bytearray, changes):
+    buf.append(len(changes))
+    for change in changes:
+        buf.append(_changeCodes[change[0]])
+        if change[0] == "remove":
+            _packStr(buf, change[1])
+            buf.append(change[2])
+        elif change[0] == "draw":
+            _packStr(buf, change[1])
+            _packCard(buf, change[2])
+        else:
+            _packCard(buf, change[1])
+
+
+def _packAny(buf: bytearray, value):
+    # only used for debug messages: anything that is not a string is sent as its string representation
+    _packStr(buf, value if value is None or type(value) is str else str(value))
+
+
+# Field decoders: each one returns the field and the offset of the next one
+def _unpackU8(data: bytes, offset: int):
+    value = data[offset]
+    return (None if value == _NONE else value), offset + 1
+
+
+def _unpackI32(data: bytes, offset: int):
+    return struct.unpack_from("<i", data, offset)[0], offset + 4
+
+
+def _unpackU32(data: bytes, offset: int):
+    value = struct.unpack_from("<I", data, offset)[0]
+    return (None if value == _NONE_U32 else value), offset + 4
+
+
+def _unpackStr(data: bytes, offset: int):
+    size = struct.unpack_from("<H", data, offset)[0]
+    offset += 2
+    if size == _NONE_STR:
+        return None, offset
+    return bytes(data[offset:offset + size]).decode("utf-8"), offset + size
+
+
+def _unpackCard(data: bytes, offset: int):
+    code = data[offset]
+    return (None if code == _NONE else codeCard(code)), offset + 1
+
+
+def _unpackCards(data: bytes, offset: int):
+    count = data[offset]
+    offset += 1
+    return [_cards[code] for code in data[offset:offset + count]], offset + count
+
+
+def _unpackU8s(data: bytes, offset: int):
+    count = data[offset]
+    offset += 1
+    return list(data[offset:offset + count]), offset + count
+
+
+def _unpackStrs(data: bytes, offset: int):
+    count = data[offset]
+    offset += 1
+    values = []
+    for _ in range(count):
+        value, offset = _unpackStr(data, offset)
+        values.append(value)
+    return values, offset
+
+
+def _unpackPlayers(data: bytes, offset: int):
+    count = data[offset]
+    offset += 1
+    players = []
+    for _ in range(count):
+        name, offset = _unpackStr(data, offset)
+        player = Player(name)
+        player.hand, offset = _unpackCards(data, offset)
+        players.append(player)
+    return players, offset
+
+
+def _unpackTable(data: bytes, offset: int):
+    table = {}
+    for color in COLORS:
+        table[color], offset = _unpackCards(data, offset)
+    return table, offset
+
+
+def _unpackHint(data: bytes, offset: int):
+    value = data[offset]
+    if value <= 5:
+        return value, offset + 1
+    return COLORS[value - 6], offset + 1
+
+
+def _unpackChanges(data: bytes, offset: int):
+    count = data[offset]
+    offset += 1
+    changes = []
+    for _ in range(count):
+        change = _CHANGES[data[offset]]
+        offset += 1
+        if change == "remove":
+            player, offset = _unpackStr(data, offset)
+            changes.append((change, player, data[offset]))
+            offset += 1
+        elif change == "draw":
+            player, offset = _unpackStr(data, offset)
+            card, offset = _unpackCard(data, offset)
+            changes.append((change, player, card))
+        else:
+            card, offset = _unpackCard(data, offset)
+            changes.append((change, card))
+    return changes, offset
+
+
+_kinds = {
+    "u8": (_packU8, _unpackU8),
+    "i32": (_packI32, _unpackI32),
+    "u32": (_packU32, _unpackU32),
+    "str": (_packStr, _unpackStr),
+    "card": (_packCard, _unpackCard),
+    "cards": (_packCards, _unpackCards),
+    "u8s": (_packU8s, _unpackU8s),
+    "strs": (_packStrs, _unpackStrs),
+    "players": (_packPlayers, _unpackPlayers),
+    "table": (_packTable, _unpackTable),
+    "hint": (_packHint, _unpackHint),
+    "changes": (_packChanges, _unpackChanges),
+    "any": (_packAny, _unpackStr),
+}
+
+# Message schemas: (class, action, fields)
+# action is the constant debug string set by the class constructor, None when it is sent as a field.
+# fields are (attribute, kind) pairs, in wire order. The message type is its index in this list.
+SCHEMAS = [
+    # Client to server
+    (GameData.ClientHintData, "Hint data from client to server",
+        [("sender", "str"), ("destination", "str"), ("type", "str"), ("value", "hint")]),
+    (GameData.ClientPlayerAddData, "Connection request",
+        [("sender", "str"), ("table", "str"), ("codecs", "strs")]),
+    (GameData.ClientPlayerStartRequest, "Player start request",
+        [("sender", "str")]),
+    (GameData.ClientPlayerReadyData, "Player start status received",
+        [("sender", "str")]),
+    (GameData.ClientGetGameStateRequest, "Show cards request",
+        [("sender", "str")]),
+    (GameData.ClientPlayerDiscardCardRequest, "Discard card request",
+        [("sender", "str"), ("handCardOrdered", "i32")]),
+    (GameData.ClientPlayerPlayCardRequest, "Play card request",
+        [("sender", "str"), ("handCardOrdered", "i32")]),
+    # Server to client
+    (GameData.ServerHintData, "Hint data from server to destination client",
+        [("source", "str"), ("destination", "str"), ("type", "str"), ("value", "hint"), ("positions", "u8s"),
+         ("player", "str"), ("delta", "message")]),
+    (GameData.ServerPlayerConnectionOk, "Connection ok",
+        [("message", "str"), ("table", "str"), ("codec", "str")]),
+    (GameData.ServerPlayerStartRequestAccepted, "Player start request accepted",
+        [("connectedPlayers", "u8"), ("acceptedStartRequests", "u8")]),
+    (GameData.ServerStartGameData, "Game start",
+        [("players", "strs")]),
+    (GameData.ServerGameStateData, "Show cards response",
+        [("currentPlayer", "str"), ("handSize", "u8"), ("players", "players"), ("usedNoteTokens", "u8"),
+         ("usedStormTokens", "u8"), ("tableCards", "table"), ("discardPile", "cards"), ("version", "i32")]),
+    (GameData.ServerGameStateDelta, "Game state changes",
+        [("version", "i32"), ("currentPlayer", "str"), ("usedNoteTokens", "u8"), ("usedStormTokens", "u8"),
+         ("changes", "changes")]),
+    (GameData.ServerActionValid, None,
+        [("action", "str"), ("player", "str"), ("lastPlayer", "str"), ("card", "card"), ("cardHandIndex", "u8"),
+         ("handLength", "u8"), ("delta", "message")]),
+    (GameData.ServerPlayerMoveOk, "Correct move! Well done!",
+        [("player", "str"), ("lastPlayer", "str"), ("card", "card"), ("cardHandIndex", "u8"), ("handLength", "u8"),
+         ("delta", "message")]),
+    (GameData.ServerPlayerThunderStrike, "The Gods are angry at you!",
+        [("player", "str"), ("lastPlayer", "str"), ("card", "card"), ("cardHandIndex", "u8"), ("handLength", "u8"),
+         ("delta", "message")]),
+    (GameData.ServerActionInvalid, "Invalid action",
+        [("message", "str")]),
+    (GameData.ServerInvalidDataReceived, "Invalid data received",
+        [("data", "any")]),
+    (GameData.ServerGameOver, "Game over",
+        [("message", "str"), ("score", "u8"), ("scoreMessage", "str"), ("seed", "u32")]),
+]
+_types = {schema[0]: (typeId, schema) for typeId, schema in enumerate(SCHEMAS)}
+
+
+def _packMessage(buf: bytearray, data):
+    if data is None:
+        buf.append(_NONE)
+        return
+    typeId, (_, action, fields) = _types[type(data)]
+    buf.append(typeId)
+    for attribute, kind in fields:
+        _kinds[kind][0](buf, getattr(data, attribute, None))
+
+
+def _unpackMessage(data: bytes, offset: int):
+    typeId = data[offset]
+    offset += 1
+    if typeId == _NONE:
+        return None, offset
+    cls, action, fields = SCHEMAS[typeId]
+    # the constructors compute derived attributes, so the object is rebuilt field by field
+    obj = cls.__new__(cls)
+    if issubclass(cls, GameData.ServerToClientData):
+        obj.sender = "Game Server"
+    obj.action = action
+    for attribute, kind in fields:
+        value, offset = _kinds[kind][1](data, offset)
+        setattr(obj, attribute, value)
+    return obj, offset
+
+
+# a message nested in another one, e.g. the state delta attached to the result of a move
+_kinds["message"] = (_packMessage, _unpackMessage)
+
+
+def isPickle(frame: bytes) -> bool:
+    return len(frame) > HEADERSIZE and frame[HEADERSIZE] == PICKLE_TAG
+
+
+def negotiate(proposed: list, accepted: list = CODECS) -> str:
+    '''
+    Returns the first codec proposed by the client that is also accepted by the server.
+    Clients that do not propose anything speak pickle.
+    '''
+    for codecName in proposed or [PICKLE]:
+        if codecName in accepted:
+            return codecName
+    return None
+
+
+def encode(data: GameData.GameData, codecName: str = BINARY) -> bytes:
+    '''
+    Serializes a message into a length-prefixed frame using the given codec.
+    Messages without a binary schema are always pickled.
+    '''
+    if codecName != BINARY or type(data) not in _types:
+        return data.serialize()
+    buf = bytearray(HEADERSIZE)
+    buf.append(BINARY_TAG)
+    _packMessage(buf, data)
+    buf[0:HEADERSIZE] = (len(buf) - HEADERSIZE).to_bytes(HEADERSIZE, 'little')
+    return bytes(buf)
+
+
+def decode(frame: bytes, allowPickle: bool = True) -> GameData.GameData:
+    '''
+    Deserializes a length-prefixed frame, whatever codec it has been encoded with.
+    Raises ValueError if the frame cannot be decoded or if it is pickled and pickle is not allowed.
+    '''
+    if isPickle(frame):
+        if not allowPickle:
+            raise ValueError("Pickle data not accepted")
+        return pickle.loads(frame[HEADERSIZE:])
+    data = memoryview(frame)
+    try:
+        if data[HEADERSIZE] != BINARY_TAG:
+            raise ValueError("Unknown data format")
+        obj, _ = _unpackMessage(data, HEADERSIZE + 1)
+        if obj is None:
+            raise ValueError("Empty binary data")
+    except (IndexError, struct.error, UnicodeDecodeError) as e:
+        raise ValueError("Malformed binary data: " + str(e))
+    return obj
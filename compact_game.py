@@ -0,0 +1,431 @@
+from copy import copy
+import random
+import logging
+import GameData
+import codec
+from game import Card, Player, MAX_SEED, newSeed
+
+# Cards are numbered 0..49 in the order Game builds its deck, their type is their code in codec.py (color * 5 + value - 1)
+_CARD_COPIES = [3, 2, 2, 2, 1]
+CARD_TYPES = bytes(color * 5 + value - 1 for value in range(1, 6) for _ in range(_CARD_COPIES[value - 1]) for color in range(5))
+DECK_SIZE = len(CARD_TYPES)
+
+
+def _card(cardId: int) -> Card:
+    return codec.codeCard(CARD_TYPES[cardId])
+
+
+class CompactGame(object):
+    '''
+    Same rules and same public methods as Game, with a compact state: cards are the integers 0..49,
+    the deck, the hands and the discard pile are preallocated bytearrays and the fireworks are the height of each pile.
+    Messages carry the shared Card objects of codec.py, built only when a message needs them.
+    With the same seed it deals the same deck as Game, so the two play exactly the same games.
+    '''
+
+    __scoreMessages = [
+        "Booooooooooooring!",
+        "Meh!",
+        "Good!",
+        "Outstanding!",
+        "AMAZING!",
+        "YOU'RE THE BEST!"
+    ]
+    __actionResults = (GameData.ServerHintData, GameData.ServerActionValid, GameData.ServerPlayerMoveOk, GameData.ServerPlayerThunderStrike)
+    __MAX_NOTE_TOKENS = 8
+    __MAX_STORM_TOKENS = 3
+    __HAND_CAPACITY = 5
+
+    def __init__(self, version: int = 0, seed: int = None, eventLog=None) -> None:
+        super().__init__()
+        if seed is None:
+            seed = newSeed()
+        if not 0 <= seed < MAX_SEED:
+            raise ValueError("Seeds must be between 0 and " + str(MAX_SEED - 1))
+        self.__seed = seed
+        self.__eventLog = eventLog
+        self.__record = None
+        # see Game.lookahead
+        self.__lookaheadDepth = 0
+        # the cards still to draw are deck[0:deckSize], drawn from the end
+        self.__deck = bytearray(range(DECK_SIZE))
+        self.__deckSize = DECK_SIZE
+        self.__discardPile = bytearray(DECK_SIZE)
+        self.__discardSize = 0
+        self.__fireworks = bytearray(5)
+        self.__hands = []
+        self.__handSizes = []
+        # positions of each color and of each value in the hand of each player, as bitmasks
+        self.__colorMasks = []
+        self.__valueMasks = []
+        self.__noteTokens = 0
+        self.__stormTokens = 0
+        self.__players = []
+        self.__playerIndexes = {}
+        self.__numReadyPlayers = 0
+        self.__currentPlayer = 0
+        self.__started = False
+        self.__lastTurn = False
+        self.__lastMoves = 0
+        self.__gameOver = False
+        self.__score = 0
+        self.__completedFireworks = 0
+        self.__version = version
+        self.__delta = None
+        self.__drawerDelta = None
+        self.__drawer = None
+        self.__dataActions = {
+            GameData.ClientPlayerDiscardCardRequest: self.__satisfyDiscardRequest,
+            GameData.ClientGetGameStateRequest: self.__satisfyShowCardRequest,
+            GameData.ClientPlayerPlayCardRequest: self.__satisfyPlayCardRequest,
+            GameData.ClientHintData: self.__satisfyHintRequest
+        }
+
+    def satisfyRequest(self, data: GameData.ClientToServerData, playerName: str):
+        if type(data) not in self.__dataActions:
+            return GameData.ServerInvalidDataReceived(data), None
+        if type(data) == GameData.ClientGetGameStateRequest:
+            data.sender = playerName
+        result = self.__dataActions[type(data)](data)
+        if self.__record is not None and type(result[1]) in self.__actionResults:
+            self.__record.move(result[1])
+        if type(data) != GameData.ClientGetGameStateRequest:
+            if self.__deckSize == 0:
+                self.__lastTurn = True
+                self.__lastMoves -= 1
+        self.__gameOver, self.__score = self.__checkGameEnded()
+        if self.__gameOver:
+            scoreMessage = self.__scoreMessages[self.__score // len(self.__scoreMessages)]
+            logging.info("Game over, people.")
+            logging.info("Score: " + str(self.__score) + "; message: " + scoreMessage)
+            if self.__record is not None and self.__lookaheadDepth == 0:
+                self.__record.gameOver(self.__score)
+                self.__record = None
+            return None, GameData.ServerGameOver(self.__score, scoreMessage, self.__seed)
+        return result
+
+    def __satisfyDiscardRequest(self, data: GameData.ClientPlayerDiscardCardRequest):
+        player = self.__currentPlayer
+        if self.__players[player].name != data.sender:
+            return GameData.ServerActionInvalid("It is not your turn yet"), None
+        if data.handCardOrdered >= self.__handSizes[player] or data.handCardOrdered < 0:
+            return GameData.ServerActionInvalid("You don't have that many cards!"), None
+        if self.__noteTokens < 1:
+            logging.warning("Impossible discarding a card: there is no used token available")
+            return GameData.ServerActionInvalid("You have no used tokens"), None
+        self.__noteTokens -= 1
+        cardId = self.__removeCard(player, data.handCardOrdered)
+        self.__discardPile[self.__discardSize] = cardId
+        self.__discardSize += 1
+        drawnId = self.__drawCard(player)
+        self.__updateHintMasks(player)
+        self.__nextTurn()
+        card = _card(cardId)
+        self.__recordMove([("remove", data.sender, data.handCardOrdered), ("discard", card)], data.sender, drawnId)
+        return None, GameData.ServerActionValid(self.__players[self.__currentPlayer].name, data.sender, "discard", card,
+                                                data.handCardOrdered, self.__handSizes[player])
+
+    def __satisfyShowCardRequest(self, data: GameData.ClientGetGameStateRequest):
+        return self.getGameState(data.sender), None
+
+    def __satisfyPlayCardRequest(self, data: GameData.ClientPlayerPlayCardRequest):
+        player = self.__currentPlayer
+        if self.__players[player].name != data.sender:
+            return GameData.ServerActionInvalid("It is not your turn yet"), None
+        if data.handCardOrdered >= self.__handSizes[player] or data.handCardOrdered < 0:
+            return GameData.ServerActionInvalid("You don't have that many cards!"), None
+        cardId = self.__removeCard(player, data.handCardOrdered)
+        drawnId = self.__drawCard(player)
+        self.__updateHintMasks(player)
+        cardType = CARD_TYPES[cardId]
+        color = cardType // 5
+        card = _card(cardId)
+        if cardType % 5 != self.__fireworks[color]:
+            self.__discardPile[self.__discardSize] = cardId
+            self.__discardSize += 1
+            self.__stormTokens += 1
+            self.__nextTurn()
+            self.__recordMove([("remove", data.sender, data.handCardOrdered), ("discard", card)], data.sender, drawnId)
+            return None, GameData.ServerPlayerThunderStrike(self.__players[self.__currentPlayer].name, data.sender, card,
+                                                            data.handCardOrdered, self.__handSizes[player])
+        self.__fireworks[color] += 1
+        self.__score += 1
+        if self.__fireworks[color] == 5:
+            self.__completedFireworks += 1
+            if self.__noteTokens > 0:
+                self.__noteTokens -= 1
+        self.__nextTurn()
+        self.__recordMove([("remove", data.sender, data.handCardOrdered), ("firework", card)], data.sender, drawnId)
+        return None, GameData.ServerPlayerMoveOk(self.__players[self.__currentPlayer].name, data.sender, card,
+                                                 data.handCardOrdered, self.__handSizes[player])
+
+    def __satisfyHintRequest(self, data: GameData.ClientHintData):
+        if self.__players[self.__currentPlayer].name != data.sender:
+            return GameData.ServerActionInvalid("It is not your turn yet"), None
+        if data.destination == data.sender:
+            return GameData.ServerActionInvalid("You are giving a suggestion to yourself! Bad!"), None
+        if self.__noteTokens == self.__MAX_NOTE_TOKENS:
+            return GameData.ServerActionInvalid("All the note tokens have been used"), None
+        destination = self.__getPlayerIndex(data.destination)
+        if destination is None:
+            return GameData.ServerInvalidDataReceived(data="The selected player does not exist"), None
+        if data.type == "color" or data.type == "colour":
+            matches = lambda cardType: codec.COLORS[cardType // 5] == data.value
+        elif data.type == "value":
+            matches = lambda cardType: cardType % 5 + 1 == data.value
+        elif self.__handSizes[destination] > 0:
+            # same as Game: an unknown hint type gives back a note token
+            self.__noteTokens -= 1
+            return GameData.ServerInvalidDataReceived(data=data.type), None
+        else:
+            matches = lambda cardType: False
+        hand = self.__hands[destination]
+        positions = [i for i in range(self.__handSizes[destination]) if matches(CARD_TYPES[hand[i]])]
+        if len(positions) == 0:
+            return GameData.ServerInvalidDataReceived(data="You cannot give hints about cards that the other person does not have"), None
+        self.__nextTurn()
+        self.__noteTokens += 1
+        self.__recordMove([])
+        return None, GameData.ServerHintData(data.sender, data.destination, data.type, data.value, positions,
+                                             self.__players[self.__currentPlayer].name)
+
+    def getGameState(self, playerName: str) -> GameData.ServerGameStateData:
+        players = []
+        handSize = 0
+        for i, p in enumerate(self.__players):
+            player = Player(p.name)
+            if p.name == playerName:
+                handSize = self.__handSizes[i]
+            else:
+                player.hand = [_card(cardId) for cardId in self.__hands[i][0:self.__handSizes[i]]]
+            players.append(player)
+        table = {}
+        for color, height in enumerate(self.__fireworks):
+            table[codec.COLORS[color]] = [codec.codeCard(color * 5 + value) for value in range(height)]
+        discard = [_card(cardId) for cardId in self.__discardPile[0:self.__discardSize]]
+        return GameData.ServerGameStateData(self.__players[self.__currentPlayer].name, handSize, players, self.__noteTokens,
+                                            self.__stormTokens, table, discard, self.__version)
+
+    def getPlayerViews(self, data: GameData.ServerToClientData) -> dict:
+        '''
+        Same as Game.getPlayerViews.
+        '''
+        if type(data) not in self.__actionResults:
+            return {p.name: data for p in self.__players}
+        view = copy(data)
+        view.delta = self.__delta
+        views = {p.name: view for p in self.__players}
+        if self.__drawer in views:
+            drawerView = copy(data)
+            drawerView.delta = self.__drawerDelta
+            views[self.__drawer] = drawerView
+        return views
+
+    def getVersion(self) -> int:
+        return self.__version
+
+    def __recordMove(self, changes: list, playerName: str = None, drawnId: int = None):
+        self.__version += 1
+        self.__delta = GameData.ServerGameStateDelta(self.__version, self.__players[self.__currentPlayer].name,
+                                                     self.__noteTokens, self.__stormTokens, changes)
+        self.__drawerDelta = self.__delta
+        self.__drawer = None
+        if drawnId is not None:
+            self.__delta.changes = changes + [("draw", playerName, _card(drawnId))]
+            self.__drawerDelta = copy(self.__delta)
+            self.__drawerDelta.changes = changes + [("draw", playerName, None)]
+            self.__drawer = playerName
+
+    def isGameOver(self):
+        return self.__gameOver
+
+    def getLegalActions(self) -> list:
+        '''
+        Same as Game.getLegalActions.
+        '''
+        if not self.__started or self.__gameOver:
+            return []
+        player = self.__currentPlayer
+        name = self.__players[player].name
+        handSize = self.__handSizes[player]
+        actions = [GameData.ClientPlayerPlayCardRequest(name, i) for i in range(handSize)]
+        if self.__noteTokens >= 1:
+            actions += [GameData.ClientPlayerDiscardCardRequest(name, i) for i in range(handSize)]
+        if self.__noteTokens < self.__MAX_NOTE_TOKENS:
+            for p, destination in enumerate(self.__players):
+                if p == player:
+                    continue
+                colorMasks, valueMasks = self.__colorMasks[p], self.__valueMasks[p]
+                actions += [GameData.ClientHintData(name, destination.name, "color", codec.COLORS[color])
+                            for color in range(5) if colorMasks[color]]
+                actions += [GameData.ClientHintData(name, destination.name, "value", value + 1)
+                            for value in range(5) if valueMasks[value]]
+        return actions
+
+    def getHintMasks(self, playerName: str):
+        '''
+        Same as Game.getHintMasks, built from the masks kept for every color and value.
+        '''
+        p = self.__getPlayerIndex(playerName)
+        return ({codec.COLORS[color]: mask for color, mask in enumerate(self.__colorMasks[p]) if mask},
+                {value + 1: mask for value, mask in enumerate(self.__valueMasks[p]) if mask})
+
+    def __updateHintMasks(self, player: int):
+        colorMasks = self.__colorMasks[player]
+        valueMasks = self.__valueMasks[player]
+        colorMasks[:] = bytes(5)
+        valueMasks[:] = bytes(5)
+        hand = self.__hands[player]
+        for i in range(self.__handSizes[player]):
+            cardType = CARD_TYPES[hand[i]]
+            colorMasks[cardType // 5] |= 1 << i
+            valueMasks[cardType % 5] |= 1 << i
+
+    def snapshot(self):
+        '''
+        Same as Game.snapshot: the whole state is a few short byte strings.
+        '''
+        return (self.__record, len(self.__record.data) if self.__record is not None else 0, self.__lookaheadDepth, bytes(self.__deck), self.__deckSize, bytes(self.__discardPile), self.__discardSize, bytes(self.__fireworks),
+                [bytes(hand) for hand in self.__hands], list(self.__handSizes), [(p, p.ready) for p in self.__players],
+                self.__noteTokens, self.__stormTokens, self.__currentPlayer, self.__started, self.__lastTurn,
+                self.__lastMoves, self.__gameOver, self.__score, self.__completedFireworks, self.__version, self.__delta,
+                self.__drawerDelta, self.__drawer, [bytes(masks) for masks in self.__colorMasks], [bytes(masks) for masks in self.__valueMasks])
+
+    def lookahead(self):
+        '''
+        Same as Game.lookahead.
+        '''
+        snapshot = self.snapshot()
+        self.__lookaheadDepth += 1
+        return snapshot
+
+    def restore(self, snapshot):
+        '''
+        Same as Game.restore.
+        '''
+        (record, recordLength, self.__lookaheadDepth, deck, self.__deckSize, discardPile, self.__discardSize, fireworks, hands, handSizes, players,
+         self.__noteTokens, self.__stormTokens, self.__currentPlayer, self.__started, self.__lastTurn,
+         self.__lastMoves, self.__gameOver, self.__score, self.__completedFireworks, self.__version, self.__delta,
+         self.__drawerDelta, self.__drawer, colorMasks, valueMasks) = snapshot
+        self.__record = record if record is not None and not record.finished else None
+        if self.__record is not None:
+            del self.__record.data[recordLength:]
+        self.__deck = bytearray(deck)
+        self.__discardPile = bytearray(discardPile)
+        self.__fireworks = bytearray(fireworks)
+        self.__hands = [bytearray(hand) for hand in hands]
+        self.__colorMasks = [bytearray(masks) for masks in colorMasks]
+        self.__valueMasks = [bytearray(masks) for masks in valueMasks]
+        self.__handSizes = list(handSizes)
+        self.__players = []
+        for player, ready in players:
+            player.ready = ready
+            self.__players.append(player)
+        self.__playerIndexes = {p.name: i for i, p in enumerate(self.__players)}
+        self.__numReadyPlayers = sum(1 for p in self.__players if p.ready)
+
+    def addPlayer(self, name: str):
+        self.__playerIndexes[name] = len(self.__players)
+        self.__players.append(Player(name))
+        self.__hands.append(bytearray(self.__HAND_CAPACITY))
+        self.__handSizes.append(0)
+        self.__colorMasks.append(bytearray(5))
+        self.__valueMasks.append(bytearray(5))
+
+    def removePlayer(self, name: str):
+        index = self.__playerIndexes.pop(name, None)
+        if index is not None:
+            if self.__players[index].ready:
+                self.__numReadyPlayers -= 1
+            del self.__players[index]
+            del self.__hands[index]
+            del self.__handSizes[index]
+            del self.__colorMasks[index]
+            del self.__valueMasks[index]
+            for i in range(index, len(self.__players)):
+                self.__playerIndexes[self.__players[i].name] = i
+
+    def setPlayerReady(self, name: str):
+        index = self.__playerIndexes.get(name)
+        if index is not None and not self.__players[index].ready:
+            self.__players[index].ready = True
+            self.__numReadyPlayers += 1
+
+    def getNumReadyPlayers(self) -> int:
+        return self.__numReadyPlayers
+
+    def __getPlayerIndex(self, name: str) -> int:
+        return self.__playerIndexes.get(name)
+
+    def __nextTurn(self):
+        self.__currentPlayer = (self.__currentPlayer + 1) % len(self.__players)
+
+    def start(self):
+        self.__lastMoves = len(self.__players) + 1
+        random.Random(self.__seed).shuffle(self.__deck)
+        if len(self.__players) < 2:
+            logging.warning("Not enough players!")
+            return
+        logging.info("Ok, let's start the game!")
+        if self.__eventLog is not None:
+            self.__record = self.__eventLog.startGame(self.__seed, [p.name for p in self.__players],
+                                                      [_card(cardId) for cardId in reversed(self.__deck)])
+        if len(self.__players) < 4:
+            for p in range(len(self.__players)):
+                for _ in range(5):
+                    self.__drawCard(p)
+        else:
+            for _ in range(4):
+                for p in range(len(self.__players)):
+                    self.__drawCard(p)
+        for p in range(len(self.__players)):
+            self.__updateHintMasks(p)
+        self.__started = True
+        self.__version += 1
+
+    def __drawCard(self, player: int) -> int:
+        if self.__deckSize == 0:
+            return None
+        self.__deckSize -= 1
+        cardId = self.__deck[self.__deckSize]
+        self.__hands[player][self.__handSizes[player]] = cardId
+        self.__handSizes[player] += 1
+        return cardId
+
+    def __removeCard(self, player: int, position: int) -> int:
+        hand = self.__hands[player]
+        size = self.__handSizes[player]
+        cardId = hand[position]
+        hand[position:size - 1] = hand[position + 1:size]
+        self.__handSizes[player] = size - 1
+        return cardId
+
+    def __checkGameEnded(self):
+        if self.__completedFireworks == len(self.__fireworks):
+            return True, self.__score
+        if self.__stormTokens == self.__MAX_STORM_TOKENS:
+            return True, 0
+        if self.__lastTurn and self.__lastMoves == 0:
+            return True, self.__score
+        return False, self.__score
+
+    def getPlayers(self):
+        return self.__players
+
+    def getScore(self):
+        '''
+        Same as Game.getScore.
+        '''
+        return self.__score
+
+    def getFireworkHeights(self) -> dict:
+        return {codec.COLORS[color]: height for color, height in enumerate(self.__fireworks)}
+
+    def getCompletedFireworks(self) -> int:
+        return self.__completedFireworks
+
+    def getMovesLeft(self):
+        return self.__lastMoves if self.__lastTurn else None
+
+    def getSeed(self):
+        return self.__seed
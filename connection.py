@@ -0,0 +1,170 @@
+import asyncio
+import logging
+import socket
+import threading
+from collections import deque
+import codec
+import GameData
+from constants import SEND_QUEUE_LIMIT
+
+# What to do with a frame when the frames still waiting to be sent to a client exceed the limit
+DISCONNECT = "disconnect"
+DROP = "drop"
+POLICIES = [DISCONNECT, DROP]
+
+# Frames that are never dropped: the move results carry the state delta and the move itself, which a client cannot
+# get back by asking for the state again, and the game over ends the game. When the queue is full they disconnect
+# the client, whatever the policy.
+UNDROPPABLE = (GameData.ServerHintData, GameData.ServerActionValid, GameData.ServerPlayerMoveOk,
+               GameData.ServerPlayerThunderStrike, GameData.ServerGameOver)
+
+
+def isDroppable(data: GameData.ServerToClientData) -> bool:
+    return type(data) not in UNDROPPABLE
+
+
+class Connection(object):
+    '''
+    A client connection, as seen by the server.
+    Messages are encoded with the codec negotiated when the player joined (pickle until then).
+    Frames are queued and written by a thread of their own, so sending never blocks on a slow client.
+    sock: anything exposing sendall(bytes), usually a socket.
+    maxQueued: high-water mark, in bytes, of the frames waiting to be written.
+    policy: applied to a frame that would exceed maxQueued. DISCONNECT closes the connection, DROP discards the frame
+        if it is droppable (see UNDROPPABLE) and closes the connection otherwise.
+    '''
+
+    # seconds given to the writer to flush the queue when the connection is closed
+    CLOSE_TIMEOUT = 1.0
+
+    def __init__(self, sock, addr, maxQueued: int = SEND_QUEUE_LIMIT, policy: str = DISCONNECT) -> None:
+        super().__init__()
+        self.sock = sock
+        self.addr = addr
+        self.codec = codec.PICKLE
+        self.maxQueued = maxQueued
+        self.policy = policy
+        self.closed = False
+        # counters
+        self.sentFrames = 0
+        self.droppedFrames = 0
+        self.peakQueuedBytes = 0
+        self.queue = deque()
+        self.queuedBytes = 0
+        self.queueCondition = threading.Condition()
+        self.writerThread = None
+        if sock is not None:
+            self.writerThread = threading.Thread(target=self.__write, daemon=True)
+            self.writerThread.start()
+
+    def send(self, data: GameData.ServerToClientData):
+        self.sendFrame(codec.encode(data, self.codec), isDroppable(data))
+
+    def sendFrame(self, frame: bytes, droppable: bool = False):
+        '''
+        Queues an encoded frame. droppable: whether the DROP policy may discard it, see isDroppable.
+        '''
+        with self.queueCondition:
+            if self.closed:
+                return
+            # a single frame bigger than the limit is still sent when nothing else is waiting
+            if self.queuedBytes > 0 and self.queuedBytes + len(frame) > self.maxQueued:
+                self._overflow(droppable)
+                return
+            self.queue.append(frame)
+            self.queuedBytes += len(frame)
+            self.peakQueuedBytes = max(self.peakQueuedBytes, self.queuedBytes)
+            self.queueCondition.notify()
+
+    def _overflow(self, droppable: bool):
+        if self.policy == DROP and droppable:
+            self.droppedFrames += 1
+            # the drops are counted, only the first one is logged
+            if self.droppedFrames == 1:
+                logging.warning("Send queue of " + str(self.addr) + " is full, dropping frames")
+        else:
+            logging.warning("Send queue of " + str(self.addr) + " is full, disconnecting")
+            self.abort()
+
+    def __write(self):
+        while True:
+            with self.queueCondition:
+                self.queueCondition.wait_for(lambda: len(self.queue) > 0 or self.closed)
+                if len(self.queue) == 0:
+                    return
+                frame = self.queue[0]
+            try:
+                self.sock.sendall(frame)
+            except OSError:
+                self.abort()
+                return
+            with self.queueCondition:
+                if len(self.queue) == 0:
+                    # aborted while writing
+                    return
+                self.queue.popleft()
+                self.queuedBytes -= len(frame)
+                self.sentFrames += 1
+
+    def abort(self):
+        '''
+        Drops the queued frames and shuts the socket down.
+        The thread reading from the connection sees it as closed by the client.
+        '''
+        with self.queueCondition:
+            self.closed = True
+            self.queue.clear()
+            self.queuedBytes = 0
+            self.queueCondition.notify()
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+    def close(self):
+        '''
+        Stops accepting frames, gives the writer some time to flush the queue and closes the socket.
+        '''
+        with self.queueCondition:
+            self.closed = True
+            self.queueCondition.notify()
+        self.writerThread.join(self.CLOSE_TIMEOUT)
+        self.sock.close()
+
+    def getStats(self) -> dict:
+        return {
+            "sentFrames": self.sentFrames,
+            "droppedFrames": self.droppedFrames,
+            "peakQueuedBytes": self.peakQueuedBytes
+        }
+
+
+class AsyncConnection(Connection):
+    '''
+    Connection served by the asyncio server.
+    The transport of the event loop is the queue: writes are buffered and flushed by the loop,
+    maxQueued and policy apply to its write buffer.
+    '''
+    def __init__(self, writer: asyncio.StreamWriter, addr, maxQueued: int = SEND_QUEUE_LIMIT, policy: str = DISCONNECT) -> None:
+        super().__init__(None, addr, maxQueued, policy)
+        self.writer = writer
+
+    def sendFrame(self, frame: bytes, droppable: bool = False):
+        if self.closed:
+            return
+        queuedBytes = self.writer.transport.get_write_buffer_size()
+        if queuedBytes > 0 and queuedBytes + len(frame) > self.maxQueued:
+            self._overflow(droppable)
+            return
+        self.writer.write(frame)
+        self.sentFrames += 1
+        self.peakQueuedBytes = max(self.peakQueuedBytes, queuedBytes + len(frame))
+
+    def abort(self):
+        # the coroutine reading from the connection gets an IncompleteReadError
+        self.closed = True
+        self.writer.transport.abort()
+
+    def close(self):
+        self.closed = True
+        self.writer.close()
@@ -1,4 +1,7 @@
 # Program constants / server constants
 HOST = "127.0.0.1"
 PORT =  1024 # 0x4A7AB1 could have been a better port, but networkers did not allow us to have it
-DATASIZE = int(10240 / 4)
\ No newline at end of file
+DATASIZE = int(10240 / 4) # size of a single read from the socket
+HEADERSIZE = 4 # length prefix of every frame sent on the wire
+MAX_FRAME_SIZE = 1 << 20 # bytes a frame may declare after its length prefix, bigger frames close the connection
+SEND_QUEUE_LIMIT = 1 << 20 # bytes the server queues for a client before applying the slow client policy
@@ -0,0 +1,293 @@
+# Compact binary log of the games played and a fast replay of any of their turns
+import argparse
+import os
+import struct
+import threading
+import GameData
+import codec
+from game import Player
+
+MAGIC = b"HNB1"
+
+# Records start with a byte: its high nibble is the kind of the record, the low one the index of the player who moved.
+# Moves and game over are 4 bytes long:
+#   PLAY    kind|player, hand position, card, 1 if it went on the fireworks 0 otherwise
+#   DISCARD kind|player, hand position, card, 0
+#   HINT    kind|player, destination index, hint (0..4 the color index, 5..9 the value + 4), mask of the hinted positions
+#   OVER    kind, score, 0, 0
+# A game starts with
+#   START   kind, number of players, seed (u32), the names (u8 length and utf-8 each), deck size (u8), the deck in draw order
+# Cards are their code in codec.py.
+START = 0
+PLAY = 1
+DISCARD = 2
+HINT = 3
+OVER = 4
+RECORD_SIZE = 4
+
+_SEED = struct.Struct("<I")
+
+
+class EventLog(object):
+    '''
+    A file the games are appended to. Every game is kept in memory while it is played and written as a whole
+    when it is over, so games played at the same time at different tables never interleave.
+    Games that never end (e.g. all the players left) are not written.
+    path: the file, created if missing.
+    '''
+    def __init__(self, path: str) -> None:
+        super().__init__()
+        self.path = path
+        self.lock = threading.Lock()
+        self.games = 0
+        with self.lock:
+            with open(path, "ab") as fp:
+                if fp.tell() == 0:
+                    fp.write(MAGIC)
+
+    def startGame(self, seed: int, playerNames: list, deck: list):
+        '''
+        Returns the record of a new game. deck: the cards in the order they are going to be drawn.
+        '''
+        return GameRecord(self, seed, playerNames, deck)
+
+    def write(self, data: bytes):
+        with self.lock:
+            with open(self.path, "ab") as fp:
+                fp.write(data)
+            self.games += 1
+
+
+class GameRecord(object):
+    '''
+    The events of a game being played, see EventLog.startGame.
+    '''
+    def __init__(self, log: EventLog, seed: int, playerNames: list, deck: list) -> None:
+        super().__init__()
+        self.log = log
+        self.players = {name: i for i, name in enumerate(playerNames)}
+        self.data = bytearray((START, len(playerNames)))
+        self.data += _SEED.pack(seed)
+        for name in playerNames:
+            encoded = name.encode("utf-8")
+            self.data.append(len(encoded))
+            self.data += encoded
+        self.data.append(len(deck))
+        self.data += bytes(codec.cardCode(card) for card in deck)
+        # True once the game is written to the log
+        self.finished = False
+
+    def move(self, result: GameData.ServerToClientData):
+        '''
+        Records the result of a hint, a play or a discard, as sent to the players.
+        '''
+        if type(result) is GameData.ServerHintData:
+            if result.type == "value":
+                hint = result.value + 4
+            else:
+                hint = codec.COLORS.index(result.value)
+            mask = 0
+            for position in result.positions:
+                mask |= 1 << position
+            self.data += bytes((HINT << 4 | self.players[result.source], self.players[result.destination], hint, mask))
+            return
+        kind = DISCARD if type(result) is GameData.ServerActionValid else PLAY
+        success = 1 if type(result) is GameData.ServerPlayerMoveOk else 0
+        self.data += bytes((kind << 4 | self.players[result.lastPlayer], result.cardHandIndex,
+                            codec.cardCode(result.card), success))
+
+    def gameOver(self, score: int):
+        self.data += bytes((OVER << 4, score, 0, 0))
+        self.log.write(bytes(self.data))
+        self.finished = True
+
+
+class LoggedGame(object):
+    '''
+    A game read from an event log. moves holds the move records as they are in the file, RECORD_SIZE bytes each.
+    '''
+    def __init__(self, seed: int, playerNames: list, deck: bytes, moves: bytes, score: int) -> None:
+        super().__init__()
+        self.seed = seed
+        self.playerNames = playerNames
+        self.deck = deck
+        self.moves = moves
+        self.score = score
+
+    def numMoves(self) -> int:
+        return len(self.moves) // RECORD_SIZE
+
+    def replay(self):
+        return Replay(self)
+
+    def stateAt(self, turn: int):
+        '''
+        Returns the Replay of the game after its first turn moves.
+        '''
+        replay = Replay(self)
+        replay.advance(turn)
+        return replay
+
+
+def readGames(path: str):
+    '''
+    Yields the games of an event log, in the order they were written.
+    '''
+    with open(path, "rb") as fp:
+        data = fp.read()
+    if data[:len(MAGIC)] != MAGIC:
+        raise ValueError(path + " is not an event log")
+    offset = len(MAGIC)
+    end = len(data)
+    while offset < end:
+        if data[offset] != START:
+            raise ValueError("Corrupted event log at byte " + str(offset))
+        numPlayers = data[offset + 1]
+        seed = _SEED.unpack_from(data, offset + 2)[0]
+        offset += 6
+        names = []
+        for _ in range(numPlayers):
+            length = data[offset]
+            names.append(data[offset + 1:offset + 1 + length].decode("utf-8"))
+            offset += 1 + length
+        deckSize = data[offset]
+        deck = data[offset + 1:offset + 1 + deckSize]
+        offset += 1 + deckSize
+        # the moves run up to the game over record
+        movesStart = offset
+        while data[offset] >> 4 != OVER:
+            offset += RECORD_SIZE
+        yield LoggedGame(seed, names, deck, data[movesStart:offset], data[offset + 1])
+        offset += RECORD_SIZE
+
+
+class Replay(object):
+    '''
+    The state of a logged game, moved forward one move at a time by step() without checking the rules again:
+    the log already has the results. Cards are their codes in codec.py, as in the log.
+    The whole state is public: hands of every player, deck, fireworks, discard pile and tokens.
+    '''
+    __MAX_FIREWORKS = 5
+
+    def __init__(self, game: LoggedGame) -> None:
+        super().__init__()
+        self.game = game
+        self.turn = 0
+        numPlayers = len(game.playerNames)
+        self.hands = [[] for _ in range(numPlayers)]
+        # the deck is drawn from position nextCard on
+        self.nextCard = 0
+        self.fireworks = [0] * len(codec.COLORS)
+        self.discardPile = []
+        self.noteTokens = 0
+        self.stormTokens = 0
+        self.currentPlayer = 0
+        # the deal of Game.start: all the cards of a player at once with less than 4 players, one per round otherwise
+        if numPlayers < 4:
+            for hand in self.hands:
+                for _ in range(5):
+                    self.__draw(hand)
+        else:
+            for _ in range(4):
+                for hand in self.hands:
+                    self.__draw(hand)
+
+    def __draw(self, hand: list):
+        if self.nextCard < len(self.game.deck):
+            hand.append(self.game.deck[self.nextCard])
+            self.nextCard += 1
+
+    def isOver(self) -> bool:
+        return self.turn == self.game.numMoves()
+
+    def step(self):
+        '''
+        Plays the next move of the log.
+        '''
+        if self.isOver():
+            raise IndexError("The game is over")
+        moves = self.game.moves
+        offset = self.turn * RECORD_SIZE
+        kind = moves[offset] >> 4
+        player = moves[offset] & 0x0F
+        if kind == HINT:
+            self.noteTokens += 1
+        else:
+            hand = self.hands[player]
+            card = hand.pop(moves[offset + 1])
+            if card != moves[offset + 2]:
+                raise ValueError("The log does not match the deal at move " + str(self.turn))
+            self.__draw(hand)
+            if kind == DISCARD:
+                self.noteTokens -= 1
+                self.discardPile.append(card)
+            elif moves[offset + 3]:
+                self.fireworks[card // 5] += 1
+                if card % 5 == self.__MAX_FIREWORKS - 1 and self.noteTokens > 0:
+                    self.noteTokens -= 1
+            else:
+                self.stormTokens += 1
+                self.discardPile.append(card)
+        self.currentPlayer = (player + 1) % len(self.hands)
+        self.turn += 1
+
+    def advance(self, moves: int):
+        for _ in range(moves):
+            self.step()
+
+    def getScore(self) -> int:
+        return sum(self.fireworks)
+
+    def getGameState(self, playerName: str) -> GameData.ServerGameStateData:
+        '''
+        The state as the server would send it to playerName. The version is the turn.
+        '''
+        players = []
+        handSize = 0
+        for name, hand in zip(self.game.playerNames, self.hands):
+            player = Player(name)
+            if name == playerName:
+                handSize = len(hand)
+            else:
+                player.hand = [codec.codeCard(card) for card in hand]
+            players.append(player)
+        table = {color: [codec.codeCard(c * 5 + value) for value in range(self.fireworks[c])]
+                 for c, color in enumerate(codec.COLORS)}
+        discard = [codec.codeCard(card) for card in self.discardPile]
+        return GameData.ServerGameStateData(self.game.playerNames[self.currentPlayer], handSize, players, self.noteTokens,
+                                            self.stormTokens, table, discard, self.turn)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Summarizes an event log, or shows a turn of one of its games")
+    parser.add_argument("path", help="the event log")
+    parser.add_argument("--game", type=int, default=None, help="index of the game to show")
+    parser.add_argument("--turn", type=int, default=None, help="turn to show, the end of the game by default")
+    args = parser.parse_args()
+
+    if args.game is None:
+        games = 0
+        moves = 0
+        scores = 0
+        for game in readGames(args.path):
+            games += 1
+            moves += game.numMoves()
+            scores += game.score
+        print(f"{args.path}: {os.path.getsize(args.path)} bytes, {games} games, {moves} moves, "
+              f"AVG SCORE: {scores / games if games else 0}")
+    else:
+        game = None
+        for index, logged in enumerate(readGames(args.path)):
+            if index == args.game:
+                game = logged
+                break
+        if game is None:
+            parser.error(f"there is no game {args.game} in {args.path}")
+        replay = game.stateAt(game.numMoves() if args.turn is None else args.turn)
+        print(f"Game {args.game}, seed {game.seed}, turn {replay.turn}/{game.numMoves()}, score {game.score}")
+        print(f"Current player: {game.playerNames[replay.currentPlayer]}")
+        for name, hand in zip(game.playerNames, replay.hands):
+            print(f"{name}: {[codec.codeCard(card).toClientString() for card in hand]}")
+        print(f"Fireworks: {dict(zip(codec.COLORS, replay.fireworks))}")
+        print(f"Discard pile: {[codec.codeCard(card).toClientString() for card in replay.discardPile]}")
+        print(f"Note tokens: {replay.noteTokens}, storm tokens: {replay.stormTokens}, cards left: {len(game.deck) - replay.nextCard}")
@@ -1,8 +1,52 @@
-from copy import deepcopy
-from random import shuffle
+from copy import copy, deepcopy
+import random
+import re
 import GameData
 import logging
 
+# Seeds are 32 bit unsigned integers, the largest one is reserved by the binary codec (see codec.py)
+MAX_SEED = 2 ** 32 - 1
+
+
+def newSeed() -> int:
+    return random.randrange(MAX_SEED)
+
+
+def seedSequence(seeds: list = None, first: int = None):
+    '''
+    Yields the seeds of consecutive games: the given seeds first,
+    then first, first + 1, ... if first is given, random seeds otherwise.
+    '''
+    if seeds is not None:
+        yield from seeds
+    while True:
+        if first is None:
+            yield newSeed()
+        else:
+            yield first % MAX_SEED
+            first += 1
+
+
+def readSeeds(path: str) -> list:
+    '''
+    Reads a list of seeds from a file: either a results file written by rule_based_agent.py or simulator.py,
+    whose list after the GAME SEEDS: header is read and the rest (scores, names, average) ignored,
+    or a plain list of seeds, every integer in the file.
+    Raises ValueError if a game of the GAME SEEDS list has no seed.
+    '''
+    with open(path) as fp:
+        text = fp.read()
+    match = re.search(r"GAME SEEDS:\s*\[([^\]]*)\]", text)
+    if match is None:
+        return [int(seed) for seed in re.findall(r"\d+", text)]
+    seeds = []
+    for item in match.group(1).split(","):
+        item = item.strip()
+        if not item.isdigit():
+            raise ValueError(f"{path}: game {len(seeds) + 1} of GAME SEEDS has no seed ({item})")
+        seeds.append(int(item))
+    return seeds
+
 
 class Card(object):
     def __init__(self, id, value, color) -> None:
@@ -69,8 +113,6 @@ class Player(object):
 
 class Game(object):
 
-    __dataActions = {}
-
     __scoreMessages = [
         "Booooooooooooring!",
         "Meh!",
@@ -80,12 +122,29 @@ class Game(object):
         "YOU'RE THE BEST!"
     ]
     __cards = []  # cards are the same for everyone
+    # results of the moves, they carry the changes made by the move
+    __actionResults = (GameData.ServerHintData, GameData.ServerActionValid, GameData.ServerPlayerMoveOk, GameData.ServerPlayerThunderStrike)
     __MAX_NOTE_TOKENS = 8
     __MAX_STORM_TOKENS = 3
     __MAX_FIREWORKS = 5
 
-    def __init__(self) -> None:
+    def __init__(self, version: int = 0, seed: int = None, eventLog=None) -> None:
+        '''
+        version: the state version to start from, so that a table keeps increasing it across games.
+        seed: the seed of the deck shuffle, a random one if None. The same seed always deals the same cards.
+        eventLog: an event_log.EventLog the game is written to once it is over, if not None.
+        '''
         super().__init__()
+        if seed is None:
+            seed = newSeed()
+        if not 0 <= seed < MAX_SEED:
+            raise ValueError("Seeds must be between 0 and " + str(MAX_SEED - 1))
+        self.__seed = seed
+        self.__eventLog = eventLog
+        # the events of this game, see event_log.GameRecord
+        self.__record = None
+        # number of lookahead() not restored yet: a game over reached inside a lookahead is not written
+        self.__lookaheadDepth = 0
         self.__discardPile = []
         # Init cards
         self.__gameOver = False
@@ -164,15 +223,30 @@ class Game(object):
         # Init players
         self.__players = []
         self.__currentPlayer = 0
+        # position of each player in self.__players, by name, and how many of them are ready
+        self.__playerIndexes = {}
+        self.__numReadyPlayers = 0
+        # positions of the colors and of the values in the hand of each player, by name: ({color: mask}, {value: mask})
+        self.__hintMasks = {}
 
         # init game
         self.__started = False
         self.__lastTurn = False
         self.__lastMoves = 0
 
-        # score
+        # score: the cards on the fireworks, kept up to date by every play, and the fireworks completed
         self.__score = 0
+        self.__completedFireworks = 0
+
+        # state version, increased by every move, and the changes made by the last move
+        self.__version = version
+        self.__delta = None
+        # the same changes as seen by the player who drew a card, who cannot see it
+        self.__drawerDelta = None
+        self.__drawer = None
         # add actions for each class of data
+        # (per instance: a class-level dict would route every table's requests to the last Game created)
+        self.__dataActions = {}
         self.__dataActions[GameData.ClientPlayerDiscardCardRequest] = self.__satisfyDiscardRequest
         self.__dataActions[GameData.ClientGetGameStateRequest] = self.__satisfyShowCardRequest
         self.__dataActions[GameData.ClientPlayerPlayCardRequest] = self.__satisfyPlayCardRequest
@@ -187,6 +261,8 @@ class Game(object):
             if type(data) == GameData.ClientGetGameStateRequest:
                 data.sender = playerName
             result = self.__dataActions[type(data)](data)
+            if self.__record is not None and type(result[1]) in self.__actionResults:
+                self.__record.move(result[1])
             if type(data) != GameData.ClientGetGameStateRequest:
                 if len(self.__cardsToDraw) == 0:
                     self.__lastTurn = True
@@ -197,8 +273,11 @@ class Game(object):
                 logging.info("Please, close the server now")
                 logging.info("Score: " + str(self.__score) + "; message: " +
                              self.__scoreMessages[self.__score // len(self.__scoreMessages)])  # ! BUGFIX index
+                if self.__record is not None and self.__lookaheadDepth == 0:
+                    self.__record.gameOver(self.__score)
+                    self.__record = None
                 # ! BUGFIX index
-                return (None, GameData.ServerGameOver(self.__score, self.__scoreMessages[self.__score // len(self.__scoreMessages)]))
+                return (None, GameData.ServerGameOver(self.__score, self.__scoreMessages[self.__score // len(self.__scoreMessages)], self.__seed))
             return result
         else:
             return GameData.ServerInvalidDataReceived(data), None
@@ -211,15 +290,17 @@ class Game(object):
             if data.handCardOrdered >= len(player.hand) or data.handCardOrdered < 0:
                 return (GameData.ServerActionInvalid("You don't have that many cards!"), None)
             card: Card = player.hand[data.handCardOrdered]
-            if not self.__discardCard(card.id, player.name):
+            if not self.__discardCard(data.handCardOrdered, player.name):
                 logging.warning(
                     "Impossible discarding a card: there is no used token available")
                 return (GameData.ServerActionInvalid("You have no used tokens"), None)
             else:
-                self.__drawCard(player.name)
+                drawnCard = self.__drawCard(player.name)
+                self.__updateHintMasks(player)
                 logging.info("Player: " + self.__getCurrentPlayer().name +
                              ": card " + str(card.id) + " discarded successfully")
                 self.__nextTurn()
+                self.__recordMove([("remove", player.name, data.handCardOrdered), ("discard", card)], player.name, drawnCard)
                 # ! ADDED last param. see GameData relative comment in ServerActionValid
                 return (None, GameData.ServerActionValid(self.__getCurrentPlayer().name, player.name, "discard", card, data.handCardOrdered, len(player.hand)))
         else:
@@ -228,8 +309,47 @@ class Game(object):
     # Show request
     def __satisfyShowCardRequest(self, data: GameData.ClientGetGameStateRequest):
         logging.info("Showing hand to: " + data.sender)
-        currentPlayer, playerList, playerHandSize = self.__getPlayersStatus(data.sender)
-        return (GameData.ServerGameStateData(currentPlayer, playerHandSize, playerList, self.__noteTokens, self.__stormTokens, self.__tableCards, self.__discardPile), None)
+        return (self.getGameState(data.sender), None)
+
+    def getGameState(self, playerName: str) -> GameData.ServerGameStateData:
+        currentPlayer, playerList, playerHandSize = self.__getPlayersStatus(playerName)
+        return GameData.ServerGameStateData(currentPlayer, playerHandSize, playerList, self.__noteTokens, self.__stormTokens, self.__tableCards, self.__discardPile, self.__version)
+
+    def getPlayerViews(self, data: GameData.ServerToClientData) -> dict:
+        '''
+        Returns the data to send to each player, by name, for a message that has to be sent to all players.
+        Action results get a copy carrying the changes made by the action as seen by the player,
+        so clients can keep their game state up to date without asking for it with a ClientGetGameStateRequest.
+        Players who see the same thing share the same object, so it can be encoded once for all of them.
+        '''
+        if type(data) not in self.__actionResults:
+            return {p.name: data for p in self.__players}
+        view = copy(data)
+        view.delta = self.__delta
+        views = {p.name: view for p in self.__players}
+        if self.__drawer in views:
+            drawerView = copy(data)
+            drawerView.delta = self.__drawerDelta
+            views[self.__drawer] = drawerView
+        return views
+
+    def getVersion(self) -> int:
+        return self.__version
+
+    def __recordMove(self, changes: list, playerName: str = None, drawnCard: Card = None):
+        '''
+        Bumps the state version and stores the changes made by the move of playerName,
+        to be sent along with its result. Token and turn changes are read from the current state.
+        '''
+        self.__version += 1
+        self.__delta = GameData.ServerGameStateDelta(self.__version, self.__getCurrentPlayer().name, self.__noteTokens, self.__stormTokens, changes)
+        self.__drawerDelta = self.__delta
+        self.__drawer = None
+        if drawnCard is not None:
+            self.__delta.changes = changes + [("draw", playerName, drawnCard)]
+            self.__drawerDelta = copy(self.__delta)
+            self.__drawerDelta.changes = changes + [("draw", playerName, None)]
+            self.__drawer = playerName
 
     # Play card request
 
@@ -240,10 +360,12 @@ class Game(object):
             if data.handCardOrdered >= len(p.hand) or data.handCardOrdered < 0:
                 return (GameData.ServerActionInvalid("You don't have that many cards!"), None)
             card: Card = p.hand[data.handCardOrdered]
-            self.__playCard(p.name, data.handCardOrdered)
-            ok = self.__checkTableCards()
+            drawnCard = self.__playCard(p.name, data.handCardOrdered)
+            self.__updateHintMasks(p)
+            ok = self.__checkTableCards(card)
             if not ok:
                 self.__nextTurn()
+                self.__recordMove([("remove", p.name, data.handCardOrdered), ("discard", card)], p.name, drawnCard)
                 # ! ADDED last param. see GameData relative comment of GameData.ServerPlayerThunderStrike
                 return (None, GameData.ServerPlayerThunderStrike(self.__getCurrentPlayer().name, p.name, card, data.handCardOrdered, len(p.hand)))
             else:
@@ -255,6 +377,7 @@ class Game(object):
                         self.__noteTokens -= 1
                         logging.info("Giving 1 free note token.")
                 self.__nextTurn()
+                self.__recordMove([("remove", p.name, data.handCardOrdered), ("firework", card)], p.name, drawnCard)
                 # ! ADDED last param. see GameData relative comment of GameData.ServerPlayerMoveOk
                 return (None, GameData.ServerPlayerMoveOk(self.__getCurrentPlayer().name, p.name, card, data.handCardOrdered, len(p.hand)))
         else:
@@ -271,11 +394,7 @@ class Game(object):
                 "All the note tokens have been used. Impossible getting hints")
             return GameData.ServerActionInvalid("All the note tokens have been used"), None
         positions = []
-        destPlayer: Player = None
-        for p in self.__players:
-            if p.name == data.destination:
-                destPlayer = p
-                break
+        destPlayer: Player = self.__getPlayer(data.destination)
         if destPlayer is None:
             return GameData.ServerInvalidDataReceived(data="The selected player does not exist"), None
 
@@ -298,6 +417,7 @@ class Game(object):
             return GameData.ServerInvalidDataReceived(data="You cannot give hints about cards that the other person does not have"), None
         self.__nextTurn()
         self.__noteTokens += 1
+        self.__recordMove([])
         logging.info("Player " + data.sender + " providing hint to " + data.destination +
                      ": cards with " + data.type + " " + str(data.value) + " are in positions: " + str(positions))
         # ! ADDED last param. see GameData relative comment
@@ -306,29 +426,118 @@ class Game(object):
     def isGameOver(self):
         return self.__gameOver
 
+    def getLegalActions(self) -> list:
+        '''
+        Returns every request the current player can make that the game accepts: plays, discards and hints,
+        as the ClientToServerData to pass to satisfyRequest, in no particular order. Empty if the game is not running.
+        '''
+        if not self.__started or self.__gameOver:
+            return []
+        player = self.__getCurrentPlayer()
+        actions = [GameData.ClientPlayerPlayCardRequest(player.name, i) for i in range(len(player.hand))]
+        if self.__noteTokens >= 1:
+            actions += [GameData.ClientPlayerDiscardCardRequest(player.name, i) for i in range(len(player.hand))]
+        if self.__noteTokens < self.__MAX_NOTE_TOKENS:
+            for p in self.__players:
+                if p is player:
+                    continue
+                colorMasks, valueMasks = self.__hintMasks[p.name]
+                actions += [GameData.ClientHintData(player.name, p.name, "color", color) for color in colorMasks]
+                actions += [GameData.ClientHintData(player.name, p.name, "value", value) for value in valueMasks]
+        return actions
+
+    def getHintMasks(self, playerName: str):
+        '''
+        Returns ({color: mask}, {value: mask}) for the hand of playerName, a mask having bit i set when the card
+        in position i has that color or value. Only the colors and values in the hand are there. Do not modify them.
+        '''
+        return self.__hintMasks[playerName]
+
+    def __updateHintMasks(self, player: Player):
+        # called when the hand of the player changes: hands have at most 5 cards
+        colorMasks = {}
+        valueMasks = {}
+        for i, card in enumerate(player.hand):
+            colorMasks[card.color] = colorMasks.get(card.color, 0) | 1 << i
+            valueMasks[card.value] = valueMasks.get(card.value, 0) | 1 << i
+        self.__hintMasks[player.name] = (colorMasks, valueMasks)
+
+    def snapshot(self):
+        '''
+        Returns an opaque copy of the state of the game, to be given back to restore().
+        Cards never change, so only the lists holding them are copied: no deepcopy.
+        The game goes on as usual after a snapshot: to try moves that must not end up in the event log use lookahead().
+        '''
+        return (self.__record, len(self.__record.data) if self.__record is not None else 0, self.__lookaheadDepth,
+                list(self.__cardsToDraw), list(self.__discardPile),
+                {color: list(pile) for color, pile in self.__tableCards.items()},
+                [(p, list(p.hand), p.ready) for p in self.__players],
+                self.__noteTokens, self.__stormTokens, self.__currentPlayer, self.__started, self.__lastTurn,
+                self.__lastMoves, self.__gameOver, self.__score, self.__completedFireworks, self.__version, self.__delta,
+                self.__drawerDelta, self.__drawer, dict(self.__hintMasks))
+
+    def lookahead(self):
+        '''
+        Starts a lookahead and returns its snapshot: until restore() brings the game back to it,
+        a game over is not written to the event log. Restore the snapshot of every lookahead, one per tried line.
+        '''
+        snapshot = self.snapshot()
+        self.__lookaheadDepth += 1
+        return snapshot
+
+    def restore(self, snapshot):
+        '''
+        Brings the game back to a snapshot taken with snapshot() or lookahead(). The same snapshot can be restored
+        many times. The moves played after the snapshot are taken out of the event log record too.
+        '''
+        (record, recordLength, self.__lookaheadDepth, cardsToDraw, discardPile, tableCards, players,
+         self.__noteTokens, self.__stormTokens, self.__currentPlayer, self.__started, self.__lastTurn,
+         self.__lastMoves, self.__gameOver, self.__score, self.__completedFireworks, self.__version, self.__delta,
+         self.__drawerDelta, self.__drawer, hintMasks) = snapshot
+        # the masks of a hand are replaced, never modified
+        self.__hintMasks = dict(hintMasks)
+        # a game already written to the file cannot be taken back: the replayed moves are not recorded again
+        self.__record = record if record is not None and not record.finished else None
+        if self.__record is not None:
+            # the moves played after the snapshot never happened
+            del self.__record.data[recordLength:]
+        self.__cardsToDraw = list(cardsToDraw)
+        self.__discardPile = list(discardPile)
+        self.__tableCards = {color: list(pile) for color, pile in tableCards.items()}
+        self.__players = []
+        for player, hand, ready in players:
+            player.hand = list(hand)
+            player.ready = ready
+            self.__players.append(player)
+        self.__playerIndexes = {p.name: i for i, p in enumerate(self.__players)}
+        self.__numReadyPlayers = sum(1 for p in self.__players if p.ready)
+
     # Player functions
     # players list. Not the best, but there are literally max 5 players and the list should give us the order of connection = the order of the rounds
     def addPlayer(self, name: str):
+        self.__playerIndexes[name] = len(self.__players)
         self.__players.append(Player(name))
 
     def removePlayer(self, name: str):
-        for p in self.__players:
-            if p.name == name:
-                self.__players.remove(p)
-                break
+        index = self.__playerIndexes.pop(name, None)
+        if index is None:
+            return
+        p = self.__players.pop(index)
+        if p.ready:
+            self.__numReadyPlayers -= 1
+        self.__hintMasks.pop(name, None)
+        # the following players move back by one
+        for i in range(index, len(self.__players)):
+            self.__playerIndexes[self.__players[i].name] = i
 
     def setPlayerReady(self, name: str):
-        for p in self.__players:
-            if p.name == name:
-                p.ready = True
-                break
+        p = self.__getPlayer(name)
+        if p is not None and not p.ready:
+            p.ready = True
+            self.__numReadyPlayers += 1
 
     def getNumReadyPlayers(self) -> int:
-        count = 0
-        for p in self.__players:
-            if p.ready:
-                count += 1
-        return count
+        return self.__numReadyPlayers
 
     def __nextTurn(self):
         self.__currentPlayer += 1
@@ -336,11 +545,14 @@ class Game(object):
 
     def start(self):
         self.__lastMoves = len(self.__players) + 1
-        shuffle(self.__cardsToDraw)
+        random.Random(self.__seed).shuffle(self.__cardsToDraw)
         if len(self.__players) < 2:
             logging.warning("Not enough players!")
             return
         logging.info("Ok, let's start the game!")
+        if self.__eventLog is not None:
+            # cards are drawn from the end of the deck
+            self.__record = self.__eventLog.startGame(self.__seed, [p.name for p in self.__players], self.__cardsToDraw[::-1])
         if len(self.__players) < 4:
             for p in self.__players:
                 for _ in range(5):
@@ -349,7 +561,11 @@ class Game(object):
             for _ in range(4):
                 for p in self.__players:
                     p.takeCard(self.__cardsToDraw)
+        for p in self.__players:
+            self.__updateHintMasks(p)
         self.__started = True
+        # the deal is a new state: snapshots of the previous game at this table are outdated
+        self.__version += 1
 
     def __getPlayersStatus(self, currentPlayerName):
         players = []
@@ -366,84 +582,85 @@ class Game(object):
         return (self.__players[self.__currentPlayer].name, players, handSize)
 
     def __getPlayer(self, currentPlayerName: str) -> Player:
-        for p in self.__players:
-            if p.name == currentPlayerName:
-                return p
+        index = self.__playerIndexes.get(currentPlayerName)
+        return self.__players[index] if index is not None else None
 
     def __getCurrentPlayer(self) -> Player:
         return self.__players[self.__currentPlayer]
 
-    def __discardCard(self, cardID: int, playerName: str) -> bool:
+    def __discardCard(self, cardPosition: int, playerName: str) -> bool:
         if self.__noteTokens < 1:  # Ok only if you already used at least 1 token
             return False
         self.__noteTokens -= 1
-        endLoop = False
-        # find player
-        for p in self.__players:
-            if endLoop:
-                break
-            if p.name == playerName:
-                # find card
-                for card in p.hand:
-                    if endLoop:
-                        break
-                    if card.id == cardID:
-                        self.__discardPile.append(card)  # discard
-                        p.hand.remove(card)  # remove from hand
-                        endLoop = True
+        self.__discardPile.append(self.__getPlayer(playerName).hand.pop(cardPosition))
         return True
 
-    def __drawCard(self, playerName: str):
+    def __drawCard(self, playerName: str) -> Card:
         if len(self.__cardsToDraw) == 0:
-            return
+            return None
         card = self.__cardsToDraw.pop()
-        for p in self.__players:
-            if p.name == playerName:
-                p.hand.append(card)
+        self.__getPlayer(playerName).hand.append(card)
+        return card
 
-    def __playCard(self, playerName: str, cardPosition: int):
+    def __playCard(self, playerName: str, cardPosition: int) -> Card:
         p = self.__getPlayer(playerName)
         self.__tableCards[p.hand[cardPosition].color].append(
             p.hand[cardPosition])
         p.hand.pop(cardPosition)
         if len(self.__cardsToDraw) > 0:
             p.hand.append(self.__cardsToDraw.pop())
-
-    def __checkTableCards(self) -> bool:
-        for cardPool in self.__tableCards:
-            if len(self.__tableCards[cardPool]) > 0 and self.__tableCards[cardPool][len(self.__tableCards[cardPool]) - 1].value != len(self.__tableCards[cardPool]):
-                card = self.__tableCards[cardPool].pop()
-                self.__discardPile.append(card)
-                self.__strikeThunder()
-                return False
+            return p.hand[-1]
+        return None
+
+    def __checkTableCards(self, card: Card) -> bool:
+        # the other piles were checked when their cards were played: only the pile of the played card can be wrong
+        pile = self.__tableCards[card.color]
+        if card.value != len(pile):
+            pile.pop()
+            self.__discardPile.append(card)
+            self.__strikeThunder()
+            return False
+        self.__score += 1
+        if len(pile) == self.__MAX_FIREWORKS:
+            self.__completedFireworks += 1
         return True
 
-    # assumes cards checked
-    def __checkFinishedFirework(self, pile) -> bool:
-        return len(pile) == 5
-
     def __strikeThunder(self):
         self.__stormTokens += 1
 
     def __checkGameEnded(self):
-        ended = True
-        for pile in self.__tableCards:
-            ended = ended and self.__checkFinishedFirework(pile)
-        if ended:
-            return True, 25
+        # constant time: the counters are kept up to date by the moves
+        if self.__completedFireworks == len(self.__tableCards):
+            return True, self.__score
         if self.__stormTokens == self.__MAX_STORM_TOKENS:
             return True, 0
-        ended = self.__lastTurn and self.__lastMoves == 0
-        if ended:
-            score = 0
-            for pile in self.__tableCards:
-                # ! BUGFIX # instead of 'len(pile)' --> 'pile' is the key (eg. 'red')
-                score += len(self.__tableCards[pile])
-            return True, score
-        return False, 0
+        if self.__lastTurn and self.__lastMoves == 0:
+            return True, self.__score
+        return False, self.__score
 
     def getPlayers(self):
         return self.__players
 
     def getScore(self):
+        '''
+        The cards on the fireworks while the game is running, the final score once it is over.
+        '''
         return self.__score
+
+    def getFireworkHeights(self) -> dict:
+        '''
+        The number of cards on each firework, by color.
+        '''
+        return {color: len(pile) for color, pile in self.__tableCards.items()}
+
+    def getCompletedFireworks(self) -> int:
+        return self.__completedFireworks
+
+    def getMovesLeft(self):
+        '''
+        The moves left once the deck is empty, None before.
+        '''
+        return self.__lastMoves if self.__lastTurn else None
+
+    def getSeed(self):
+        return self.__seed
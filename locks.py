@@ -0,0 +1,45 @@
+import threading
+import time
+
+
+class TimedLock(object):
+    '''
+    A threading.Lock that keeps track of how long its users have been waiting for it.
+    name: shown along with the statistics.
+    '''
+    def __init__(self, name: str) -> None:
+        super().__init__()
+        self.name = name
+        self.lock = threading.Lock()
+        self.acquisitions = 0
+        self.waitTime = 0.0
+        self.maxWaitTime = 0.0
+
+    def acquire(self):
+        start = time.perf_counter()
+        self.lock.acquire()
+        # counters are only updated while holding the lock
+        wait = time.perf_counter() - start
+        self.acquisitions += 1
+        self.waitTime += wait
+        self.maxWaitTime = max(self.maxWaitTime, wait)
+
+    def release(self):
+        self.lock.release()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *args):
+        self.release()
+
+    def getStats(self) -> dict:
+        '''
+        Wait times are in seconds.
+        '''
+        return {
+            "acquisitions": self.acquisitions,
+            "waitTime": self.waitTime,
+            "maxWaitTime": self.maxWaitTime
+        }
@@ -1,9 +1,10 @@
 import threading
 from abc import ABC, abstractmethod
 import logging
-import socket
 import GameData
-from constants import HOST, PORT, DATASIZE
+import codec
+import transport
+from constants import HOST, PORT
 from sys import stdout
 from enum import Enum
 from actions.actions import Action, HintResult, PlayCardResult, DiscardCardResult
@@ -11,6 +12,8 @@ from typing import Tuple
 from client_state.player_hand import HiddenCard, ObservableCard
 from game import Card
 from threading import Lock
+from collections import deque
+from copy import copy
 
 logging.basicConfig(
     format="[%(asctime)s] %(levelname)s: %(message)s",
@@ -40,37 +43,64 @@ class ClientState(Enum):
 class Client(ABC):
     """Classe base per interagire col server"""
 
-    def __init__(self, player_name: str, host: str = HOST, port: int = PORT, game_number: int = 1, agent_number: int = 1):
+    def __init__(self, player_name: str, host: str = HOST, port: int = PORT, game_number: int = 1, agent_number: int = 1,
+                 table: str = None, codecs: list = codec.CODECS, transport_name: str = transport.TCP, address=None,
+                 connect: bool = True):
         self.player_name = player_name
+        # tcp, unix o inproc (vedi transport.py), per tcp l'indirizzo di default è (host, port)
+        self.transport_name = transport_name
+        self.address = address
+        # codec proposti al server in ordine di preferenza, la connection request usa il primo
+        self.codecs = codecs
+        self.codec = codecs[0]
+        # se None il server ci fa sedere ad un tavolo ancora in lobby
+        self.table = table
         self.starting_hand_size = None
         self.host = host
         self.port = port
         self.socket = None
+        self.reader = None
+        # messaggi arrivati mentre si aspettava lo stato del gioco, vanno letti prima di quelli nuovi
+        self.pending_responses = deque()
+        # copia locale dello stato del gioco, aggiornata coi delta allegati ai risultati delle mosse
+        self.game_state = None
         self.client_state = ClientState.NOT_CONNECTED
         self.current_player = None
         self.game_number = game_number
         self.current_game = 0
         self.player_number = agent_number
-        self.__connect_to_server()
+        # senza connessione l'agente viene guidato direttamente da chi gestisce la partita (vedi simulator.py)
+        if connect:
+            self.__connect_to_server()
 
     def __read_response(self) -> GameData.ServerToClientData:
         """Legge il prossimo messaggio del server"""
-        data = self.socket.recv(DATASIZE)
-        response = GameData.GameData.deserialize(data)
+        if len(self.pending_responses) > 0:
+            return self.pending_responses.popleft()
+        return self.__receive()
+
+    def __receive(self) -> GameData.ServerToClientData:
+        """Legge il prossimo messaggio dal socket"""
+        response = self.reader.read()
+        if response is None:
+            raise ConnectionError("The server closed the connection.")
         return response
 
     def __send_request(self, request: GameData.ClientToServerData):
         """Invia una richiesta generica al server"""
-        self.socket.send(request.serialize())
+        self.socket.sendall(codec.encode(request, self.codec))
         return
 
     def __connect_to_server(self):
         # creo il socket e mi connetto al server
-        self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        self.socket.connect((self.host, self.port))
+        address = self.address
+        if address is None and self.transport_name == transport.TCP:
+            address = (self.host, self.port)
+        self.socket = transport.connect(self.transport_name, address)
+        self.reader = GameData.FrameReader(self.socket)
 
         # chiedo di entrare in partita
-        connection_request = GameData.ClientPlayerAddData(self.player_name)
+        connection_request = GameData.ClientPlayerAddData(self.player_name, self.table, self.codecs)
         self.__send_request(connection_request)
 
         # aspetto la risposta del server
@@ -79,8 +109,10 @@ class Client(ABC):
             raise ConnectionError("There was an error while connecting to the server.")
 
         self.client_state = ClientState.CONNECTED
+        self.table = response.table
+        self.codec = response.codec
         logging.info(
-            f"Connection accepted by the server. {self.player_name} is waiting in lobby"
+            f"Connection accepted by the server. {self.player_name} is waiting in lobby at table {self.table}"
         )
 
     def send_start(self):
@@ -112,21 +144,31 @@ class Client(ABC):
                 self.__send_request(ready_request)
                 self.client_state = ClientState.PLAYING
 
-                state = self.get_game_status()
-                self._init_game_state(state)
+                self.init_game(self.get_game_status())
 
-                logging.info(msg=f"{self.player_name} - Game started")
+                # nessuno gioca finché tutti gli agenti non hanno lo stato iniziale,
+                # altrimenti uno stato recuperato in ritardo conterrebbe già la prima mossa
+                self.__wait_other_agents()
 
     def restart(self):
-        global restarted_client, restart_cv, client_update_state, select_action
-
         if self.client_state != ClientState.GAME_OVER:
             raise RuntimeError("Match is not over yet")
 
         self.client_state = ClientState.PLAYING
 
-        state = self.get_game_status()
-        self._init_game_state(state)
+        self.init_game(self.get_game_status())
+
+        self.__wait_other_agents()
+        self.run()
+
+    def init_game(self, state: GameData.ServerGameStateData):
+        """Inizia una nuova partita a partire dal suo stato iniziale"""
+        self.client_state = ClientState.PLAYING
+        self.game_state = state
+        self._init_game_state(copy(state))
+
+    def __wait_other_agents(self):
+        global restarted_client, restart_cv, client_update_state, select_action
 
         restart_cv.acquire()
         logging.info(msg=f"{self.player_name} - Game started")
@@ -139,7 +181,6 @@ class Client(ABC):
             restart_cv.wait_for(lambda: restarted_client == 0)
 
         restart_cv.release()
-        self.run()
 
     def run(self):
         global play_action_cv, client_update_state, select_action
@@ -202,22 +243,24 @@ class Client(ABC):
         # (for all kind of moves)
         # - hint: send ServerHintData
         # - discard: send ServerActionValid
-        #   requires a state fetch
         # - play: send either ServerPlayerThunderStrike, ServerPlayerMoveOk
-        #   requires a state fetch
+        # every result carries the changes made by the move in 'delta',
+        # the whole state is fetched again only if we are behind or the server does not attach it
         """
-        response = self.__read_response()
+        return self.process_response(self.__read_response())
 
+    def process_response(self, response: GameData.ServerToClientData) -> Tuple[Action or None, GameData.ServerGameStateData or None]:
+        """Come fetch_action_result, per un messaggio già ricevuto dal server"""
         if type(response) is GameData.ServerActionInvalid:
             raise ValueError(f"ActionInvalid received: {response.message}")
         elif type(response) is GameData.ServerInvalidDataReceived:
             raise ValueError(f"InvalidData received: {response.data}")
         elif type(response) is GameData.ServerGameOver:
             self.client_state = ClientState.GAME_OVER
-            self.game_over(response.score)
+            self.game_over(response.score, getattr(response, "seed", None))
             return None, None
 
-        new_state = self.get_game_status()
+        new_state = self.__apply_delta(getattr(response, "delta", None))
         played_action = self.build_action_from_server_response(response, new_state)
         return played_action, new_state
 
@@ -229,11 +272,25 @@ class Client(ABC):
         request = GameData.ClientGetGameStateRequest(self.player_name)
         self.__send_request(request)
 
-        response = self.__read_response()
+        # i messaggi che arrivano prima dello stato (es. la mossa di un altro giocatore) non vanno persi
+        response = self.__receive()
         while not type(response) is GameData.ServerGameStateData:
-            response = self.__read_response()
-
-        return response
+            self.pending_responses.append(response)
+            response = self.__receive()
+
+        self.game_state = response
+        # gli agenti possono modificare lo stato ricevuto (es. handSize), la copia locale resta intatta
+        return copy(response)
+
+    def __apply_delta(self, delta: GameData.ServerGameStateDelta) -> GameData.ServerGameStateData:
+        """Aggiorna la copia locale dello stato col delta ricevuto e la ritorna,
+        se il delta non segue la versione della copia locale lo stato viene richiesto per intero"""
+        if delta is None or self.game_state is None or delta.version > self.game_state.version + 1:
+            return self.get_game_status()
+        if delta.version == self.game_state.version + 1:
+            self.game_state = delta.applyTo(self.game_state, self.player_name)
+        # altrimenti lo stato recuperato include già il delta
+        return copy(self.game_state)
 
     def build_action_from_server_response(
         self, data: GameData.ServerToClientData, new_state: GameData.ServerToClientData
@@ -309,5 +366,5 @@ class Client(ABC):
         raise NotImplementedError
 
     @abstractmethod
-    def game_over(self, score: int):
+    def game_over(self, score: int, seed: int = None):
         logging.info("Game Over!")
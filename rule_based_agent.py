@@ -5,18 +5,29 @@ from actions.rule_manager import RuleManager
 from client_state.agent_state import AgentState
 from my_client import Client
 from typing import List
-import sys
+import argparse
+import itertools
+import multiprocessing
 import os
+import random
+import sys
+import threading
+import transport
+from game import readSeeds, seedSequence
 
 
 class RuleBasedAgent(Client):
 
-    def __init__(self, player_name: str, game_number: int = 1, agent_number: int = 1, step_by_step: bool = False):
+    def __init__(self, player_name: str, game_number: int = 1, agent_number: int = 1, step_by_step: bool = False,
+                 transport_name: str = transport.TCP, address=None, connect: bool = True):
         self.state = None
         self.rule_set = None
         self.final_scores = []
+        # seed del mazzo di ogni partita, per poterla rigiocare
+        self.final_seeds = []
         self.step_by_step = step_by_step
-        super().__init__(player_name, game_number=game_number, agent_number=agent_number)
+        super().__init__(player_name, game_number=game_number, agent_number=agent_number,
+                         transport_name=transport_name, address=address, connect=connect)
 
     def _init_game_state(self, state: GameData.ServerGameStateData):
         super()._init_game_state(state)
@@ -37,18 +48,27 @@ class RuleBasedAgent(Client):
             input("PRESS ENTER TO CONTINUE")
 
         self.rule_set = RuleManager(self.state).most_info_strategy2()
+        legal_hints = None
         for rule in self.rule_set:
             rule = rule(self.state)
             action = rule.rule_to_action()
+            if type(action) is Hint:
+                if legal_hints is None:
+                    legal_hints = {(hint.destination_player, hint.hint) for hint in self.state.get_legal_hints()}
+                if (action.destination_player, action.hint) not in legal_hints:
+                    # il server lo rifiuterebbe: si passa alla regola successiva
+                    logging.error(f"{self.player_name}: {rule} chose a hint the server does not accept: {action}")
+                    continue
             if action is not None:
                 logging.info(f"{self.player_name}: {rule}")
                 self.state.is_state_updated = False
                 self.state.just_hinted = set()
                 return action
 
-    def game_over(self, score: int):
-        super().game_over(score)
+    def game_over(self, score: int, seed: int = None):
+        super().game_over(score, seed)
         self.final_scores.append(score)
+        self.final_seeds.append(seed)
         self.state = None
         self.rule_set = None
 
@@ -68,28 +88,16 @@ class AgentDeployer:
         self.agent.run()
 
 
-if __name__ == '__main__':
-    agent_number = 2
+def play_match(agent_number: int, game_number: int, step_by_step: bool = False, transport_name: str = transport.TCP,
+               address=None, agent_prefix: str = "agent") -> (List[int], List[int], List[str]):
+    """
+    Gioca game_number partite tra agent_number agenti, un thread per agente
+    Ritorna i punteggi e i seed delle partite, in ordine, e i nomi degli agenti
+    """
     agents_deployers = []
-    game_number = 100
-    scores: List[int] = []
-    agent_prefix = "agent"
-    step_by_step = False
-
-    args = sys.argv
-    if len(args) == 2:
-        agent_number = int(args[1])
-    elif len(args) == 3:
-        agent_number = int(args[1])
-        game_number = int(args[2])
-    elif len(args) == 4:
-        agent_number = int(args[1])
-        game_number = int(args[2])
-        step_by_step = True if args[3] == 'true' else False
-
     for a in range(agent_number):
         name = f"{agent_prefix}{a}"
-        agent = RuleBasedAgent(name, game_number, agent_number, step_by_step)
+        agent = RuleBasedAgent(name, game_number, agent_number, step_by_step, transport_name, address)
         agents_deployers.append(AgentDeployer(agent))
 
     for deployer in agents_deployers:
@@ -104,21 +112,157 @@ if __name__ == '__main__':
     for deployer in agents_deployers:
         deployer.start_game_thread.join()
 
+    scores: List[int] = []
     for game in range(game_number):
         scores.append(0)
         for deployer in agents_deployers:
             scores[game] = max(scores[game], deployer.agent.final_scores[game])
+    seeds = agents_deployers[0].agent.final_seeds
+    return scores, seeds, [deployer.agent.player_name for deployer in agents_deployers]
+
+
+def play_shard(shard: (int, int, List[int])) -> (int, List[int], List[int]):
+    """
+    Worker della farm: gioca in un processo a parte un blocco di partite, una per seed,
+    contro un server in-process tutto suo
+    shard: (indice del blocco, numero di agenti, seed delle partite)
+    Ritorna l'indice del blocco, i punteggi e i seed delle sue partite
+    Se un agente va in errore solleva RuntimeError, invece di lasciare gli altri agenti ad aspettarlo per sempre
+    """
+    index, agent_number, seeds = shard
+    import server
+    # con molti worker i log di ogni mossa e le stampe del server sarebbero solo rumore
+    logging.getLogger().setLevel(logging.WARNING)
+    sys.stdout = open(os.devnull, "w")
+    random.seed(seeds[0])
+    address = f"farm{os.getpid()}"
+    server.serve(agent_number, transportName=transport.INPROC, address=address, standalone=False, seeds=seeds)
+
+    results = []
+    errors = []
+    done = threading.Event()
+
+    def agent_failed(args):
+        errors.append(args.exc_value)
+        done.set()
+
+    def match():
+        results.append(play_match(agent_number, len(seeds), transport_name=transport.INPROC, address=address))
+        done.set()
+
+    threading.excepthook = agent_failed
+    # i thread rimasti bloccati non fermano il worker: il processo termina alla fine del blocco
+    threading.Thread(target=match, daemon=True).start()
+    done.wait()
+    if len(errors) > 0:
+        raise RuntimeError(f"shard {index} (seeds {seeds[0]}..{seeds[-1]}) failed: {errors[0]!r}")
+    scores, played_seeds, _ = results[0]
+    return index, scores, played_seeds
+
+
+def play_farm(agent_number: int, seeds: List[int], workers: int, shard_size: int) -> (List[int], List[int]):
+    """
+    Divide le partite in blocchi da shard_size giocati da un pool di workers processi,
+    ognuno col suo server: i risultati arrivano blocco per blocco e vengono riordinati alla fine
+    I blocchi in cui un agente va in errore vengono saltati
+    Ritorna i punteggi e i seed delle partite giocate, nell'ordine dei seed
+    """
+    shards = [(i, agent_number, seeds[start:start + shard_size]) for i, start in enumerate(range(0, len(seeds), shard_size))]
+    results = {}
+    played = 0
+    total_score = 0
+    # un processo nuovo per ogni blocco: lo stato globale di server e client non passa da un blocco all'altro
+    with multiprocessing.Pool(workers, maxtasksperchild=1) as pool:
+        shard_results = pool.imap_unordered(play_shard, shards)
+        while True:
+            try:
+                index, scores, played_seeds = next(shard_results)
+            except StopIteration:
+                break
+            except RuntimeError as e:
+                logging.error(f"FARM: {e}")
+                continue
+            results[index] = (scores, played_seeds)
+            played += len(scores)
+            total_score += sum(scores)
+            logging.info(f"FARM: {played}/{len(seeds)} games, AVG SCORE: {total_score / played}")
+    scores = [score for index in sorted(results) for score in results[index][0]]
+    played_seeds = [seed for index in sorted(results) for seed in results[index][1]]
+    return scores, played_seeds
+
+
+if __name__ == '__main__':
+    agent_number = 2
+    game_number = 100
+    step_by_step = False
+
+    parser = argparse.ArgumentParser(description="Hanabi rule based agents")
+    parser.add_argument("agent_number", nargs="?", type=int, default=agent_number, help="number of agents, from 2 to 5")
+    parser.add_argument("game_number", nargs="?", type=int, default=game_number, help="number of games to play")
+    parser.add_argument("step_by_step", nargs="?", default="false",
+                        help="'true' to wait for enter before every move of the agents")
+    parser.add_argument("--transport", choices=transport.TRANSPORTS, default=None,
+                        help="how to reach the server. inproc starts the server inside this process")
+    parser.add_argument("--address", default=None,
+                        help="host:port for tcp, the socket path for unix, the server name for inproc")
+    parser.add_argument("--seed", type=int, default=None,
+                        help="inproc only: deal the games with this seed and the following ones")
+    parser.add_argument("--seeds-file", default=None, metavar="FILE",
+                        help="inproc only: deal the games with the seeds in this file: the GAME SEEDS of a results file, or just the seeds")
+    parser.add_argument("--farm", type=int, default=0, metavar="WORKERS",
+                        help="play the games on this many processes, each one with its own in-process server")
+    parser.add_argument("--shard-size", type=int, default=50,
+                        help="with --farm, games played by a worker process before the next one takes over")
+    args = parser.parse_args()
+    seeds_given = args.seed is not None or args.seeds_file is not None
+    if args.farm > 0 and (args.transport is not None or args.address is not None):
+        parser.error("--farm starts its own in-process servers, --transport and --address cannot be used with it")
+    if args.transport is None:
+        args.transport = transport.TCP
+    if args.transport != transport.INPROC and seeds_given and args.farm == 0:
+        parser.error("--seed and --seeds-file need --transport inproc or --farm, pass them to the server otherwise")
+    if args.farm > 0 and args.step_by_step == 'true':
+        parser.error("--farm cannot play step by step")
+    agent_number = args.agent_number
+    game_number = args.game_number
+    step_by_step = args.step_by_step == 'true'
+    address = transport.parseAddress(args.transport, args.address)
+
+    if args.farm > 0:
+        # i seed sono scelti qui: i processi figli partono tutti dallo stesso stato del generatore casuale
+        seeds = list(itertools.islice(seedSequence(readSeeds(args.seeds_file) if args.seeds_file is not None else None,
+                                                   args.seed), game_number))
+        scores, seeds = play_farm(agent_number, seeds, args.farm, args.shard_size)
+        agent_names = [f"agent{a}" for a in range(agent_number)]
+    else:
+        if args.transport == transport.INPROC:
+            # il server gira in questo processo e i messaggi passano per delle code, senza socket
+            import server
+            server.serve(agent_number, transportName=transport.INPROC, address=address, standalone=False,
+                         seeds=readSeeds(args.seeds_file) if args.seeds_file is not None else None, seed=args.seed)
+            if args.seed is not None:
+                # anche le scelte casuali delle regole dipendono dal seed
+                random.seed(args.seed)
+        scores, seeds, agent_names = play_match(agent_number, game_number, step_by_step, args.transport, address)
+
+    if len(scores) == 0:
+        # con la farm succede se tutti i blocchi sono andati in errore
+        logging.error("No games were played, no results to write")
+        sys.exit(1)
 
     result = f"""
 
     
 ************** MATCH WITH {agent_number} players **************
 AGENTS:
-{[deployer.agent.player_name for deployer in agents_deployers]}
+{agent_names}
 
 GAME SCORES:
 {scores}
 
+GAME SEEDS:
+{seeds}
+
 AVG SCORE:
 {sum(scores) / len(scores)}
     """
@@ -1,137 +1,218 @@
 import os
 import GameData
+import codec
 import socket
-from game import Game
-from game import Player
+from table import Table
+from game import Game, seedSequence, readSeeds
+from event_log import EventLog
+from compact_game import CompactGame
+import connection
+import transport
+from connection import Connection, AsyncConnection
+from locks import TimedLock
 import threading
+import asyncio
+import argparse
 from constants import *
 from signal import signal, SIGPIPE, SIG_DFL
 import logging
 import sys
 
-mutex = threading.Lock()
 # SERVER
-playerConnections = {}
-game = Game()
+# Tables hosted by this server, by name. The lobby lock guards this dict, each table has a lock of its own.
+# Locks are always taken in this order: lobby, then table.
+lobbyLock = TimedLock("lobby")
+tables = {}
+tableCounter = 0
 
-mutex = threading.Lock()
+numPlayers = 2
+# Codecs accepted from the clients, in order of preference
+acceptedCodecs = codec.CODECS
+# Bytes queued for a single client before the slow client policy (see connection.py) is applied
+sendQueueLimit = SEND_QUEUE_LIMIT
+slowClientPolicy = connection.DISCONNECT
+# Game engine of the tables
+gameClass = Game
+# Every table deals its games with these seeds in order, then with firstSeed, firstSeed + 1, ... or random ones if it is None
+seedList = None
+firstSeed = None
+# The games of all the tables are appended to this event_log.EventLog, if not None
+eventLog = None
+# A standalone server exits when no client is connected, one embedded in the process of its clients keeps running
+exitWhenIdle = True
 
-playersOk = []
 
-statuses = [
-    "Lobby",
-    "Game"
-]
-status = statuses[0]
+def seatPlayer(data: GameData.ClientPlayerAddData, conn: Connection) -> Table:
+    '''
+    Seats a new player at the table it asked for, or at the newest table still waiting in the lobby.
+    A new table is created when there is no such table.
+    Returns the table, or None if the player could not be seated.
+    '''
+    global tableCounter
+    conn.codec = codec.negotiate(getattr(data, "codecs", None), acceptedCodecs)
+    if conn.codec is None:
+        conn.codec = codec.PICKLE if codec.PICKLE in acceptedCodecs else acceptedCodecs[0]
+        conn.send(GameData.ServerActionInvalid(
+            "None of the proposed codecs is accepted, use one of: " + str(acceptedCodecs)))
+        return None
+    tableName = getattr(data, "table", None)
+    if tableName is None:
+        for table in reversed(list(tables.values())):
+            if table.isOpen():
+                tableName = table.name
+                break
+    if tableName is None:
+        tableName = "table" + str(tableCounter)
+        tableCounter += 1
+    if tableName not in tables:
+        tables[tableName] = Table(tableName, numPlayers, gameClass, seedSequence(seedList, firstSeed), eventLog)
+        logging.info("New table: " + tableName)
+    table = tables[tableName]
+    with table.lock:
+        seated = table.addPlayer(data.sender, conn, conn.addr)
+        empty = table.isEmpty()
+    if not seated:
+        if empty:
+            del tables[tableName]
+        return None
+    return table
 
-commandQueue = {}
-numPlayers = 2
 
+def readData(frame: bytes, conn: Connection) -> GameData.ClientToServerData:
+    '''
+    Decodes a frame received from a connection.
+    Returns None, after telling the client why, if the frame cannot be accepted.
+    '''
+    try:
+        return codec.decode(frame, codec.PICKLE in acceptedCodecs)
+    except ValueError as e:
+        logging.warning("Invalid data from " + str(conn.addr) + ": " + str(e))
+        conn.send(GameData.ServerInvalidDataReceived(str(e)))
+        return None
 
-def manageConnection(conn: socket, addr):
-    global status
-    global game
-    with conn:
-        logging.info("Connected by: " + str(addr))
-        keepActive = True
-        playerName = ""
-        while keepActive:
-            print("SERVER WAITING")
-            data = conn.recv(DATASIZE)
-
-            mutex.acquire(True)
-
-            if not data:
-                del playerConnections[playerName]
-                logging.warning("Player disconnected: " + playerName)
-                game.removePlayer(playerName)
-                if len(playerConnections) == 0:
-                    logging.info("Shutting down server")
-                    os._exit(0)
-                keepActive = False
-            else:
+
+def manageData(data: GameData.ClientToServerData, table: Table, playerName: str, conn: Connection):
+    '''
+    Handles a single request received from a connection.
+    The same logic serves both the threaded and the asyncio server, only the Connection differs.
+    Only the lock of the table the player is seated at is held, the lobby lock while joining a table.
+    Returns the table and the name of the player bound to the connection, or (None, None) if the connection has to be closed.
+    '''
+    print(f"SERVER RECEIVED {type(data)} from {data.sender}")
+    if table is None:
+        if type(data) is not GameData.ClientPlayerAddData:
+            conn.send(GameData.ServerInvalidDataReceived(
+                "You must join a table first"))
+            return None, playerName
+        with lobbyLock:
+            table = seatPlayer(data, conn)
+        if table is None:
+            return None, None
+        return table, data.sender
+    with table.lock:
+        table.manageData(data, playerName, conn)
+    return table, playerName
+
+
+def manageDisconnection(table: Table, playerName: str):
+    if table is None:
+        # the client never joined a table
+        return
+    with lobbyLock:
+        with table.lock:
+            table.removePlayer(playerName)
+            empty = table.isEmpty()
+        if empty:
+            logging.info("Closing table " + table.name + ", lock: " + str(table.lock.getStats()))
+            del tables[table.name]
+        if len(tables) == 0 and exitWhenIdle:
+            logging.info("Shutting down server")
+            os._exit(0)
+
+
+def logLockStats():
+    logging.info("Lobby lock: " + str(lobbyLock.getStats()))
+    with lobbyLock:
+        for table in tables.values():
+            logging.info("Table " + table.name + " lock: " + str(table.lock.getStats()))
+
+
+def logConnectionStats(conn: Connection):
+    logging.info("Connection " + str(conn.addr) + " closed: " + str(conn.getStats()))
+
+
+def manageConnection(sock: socket, addr):
+    logging.info("Connected by: " + str(addr))
+    keepActive = True
+    table = None
+    playerName = ""
+    conn = Connection(sock, addr, sendQueueLimit, slowClientPolicy)
+    reader = GameData.FrameReader(sock)
+    while keepActive:
+        print("SERVER WAITING")
+        try:
+            frame = reader.readFrame()
+        except OSError:
+            frame = None
+        except GameData.FrameTooLarge as e:
+            logging.warning("Closing connection " + str(addr) + ": " + str(e))
+            frame = None
+
+        if frame is None:
+            manageDisconnection(table, playerName)
+            keepActive = False
+        else:
+            data = readData(frame, conn)
+            if data is not None:
                 print(
-                    f"SERVER PROCESSING {GameData.GameData.deserialize(data)}")
-                data = GameData.GameData.deserialize(data)
-                print(f"SERVER RECEIVED {type(data)} from {data.sender}")
-                if status == "Lobby":
-                    if type(data) is GameData.ClientPlayerAddData:
-                        playerName = data.sender
-                        commandQueue[playerName] = []
-                        if playerName in playerConnections.keys() or playerName == "" and playerName is None:
-                            logging.warning("Duplicate player: " + playerName)
-                            conn.send(GameData.ServerActionInvalid(
-                                "Player with that name already registered.").serialize())
-                            mutex.release()
-                            return
-                        playerConnections[playerName] = (conn, addr)
-                        logging.info("Player connected: " + playerName)
-                        game.addPlayer(playerName)
-                        conn.send(GameData.ServerPlayerConnectionOk(
-                            playerName).serialize())
-                    elif type(data) is GameData.ClientPlayerStartRequest:
-                        game.setPlayerReady(playerName)
-                        logging.info("Player ready: " + playerName)
-                        conn.send(GameData.ServerPlayerStartRequestAccepted(
-                            len(game.getPlayers()), game.getNumReadyPlayers()).serialize())
-
-                        if len(game.getPlayers()) == game.getNumReadyPlayers() and len(game.getPlayers()) >= numPlayers:
-                            listNames = []
-                            for player in game.getPlayers():
-                                listNames.append(player.name)
-                            logging.info(
-                                "Game start! Between: " + str(listNames))
-                            for player in playerConnections:
-                                playerConnections[player][0].send(
-                                    GameData.ServerStartGameData(listNames).serialize())
-                            game.start()
-
-                    # This ensures every player is ready to send requests
-                    elif type(data) is GameData.ClientPlayerReadyData:
-                        playersOk.append(1)
-                    # If every player is ready to send requests, then the game can start
-                    if len(playersOk) == len(game.getPlayers()):
-                        status = "Game"
-                        for player in commandQueue:
-                            for cmd in commandQueue[player]:
-                                singleData, multipleData = game.satisfyRequest(
-                                    cmd, player)
-                                if singleData is not None:
-                                    playerConnections[player][0].send(
-                                        singleData.serialize())
-                                if multipleData is not None:
-                                    for id in playerConnections:
-                                        playerConnections[id][0].send(
-                                            multipleData.serialize())
-                                        if game.isGameOver():
-                                            os._exit(0)
-                        commandQueue.clear()
-                    elif type(data) is not GameData.ClientPlayerAddData and type(
-                            data) is not GameData.ClientPlayerStartRequest and type(
-                            data) is not GameData.ClientPlayerReadyData:
-                        commandQueue[playerName].append(data)
-                # In game
-                elif status == "Game":
-                    singleData, multipleData = game.satisfyRequest(
-                        data, playerName)
-                    if singleData is not None:
-                        conn.send(singleData.serialize())
-                    if multipleData is not None:
-                        for id in playerConnections:
-                            playerConnections[id][0].send(
-                                multipleData.serialize())
-                            if game.isGameOver():
-                                logging.info("Game over")
-                                logging.info("Game score: " +
-                                             str(game.getScore()))
-                                # os._exit(0)
-                                players = game.getPlayers()
-                                game = Game()
-                                for player in players:
-                                    logging.info("Starting new game")
-                                    game.addPlayer(player.name)
-                                game.start()
-            mutex.release()
+                    f"SERVER PROCESSING {data}")
+                table, playerName = manageData(data, table, playerName, conn)
+            if playerName is None:
+                keepActive = False
+    # outside of the locks: flushing the last frames must not hold up the other connections
+    conn.close()
+    logConnectionStats(conn)
+
+
+async def asyncReadFrame(reader: asyncio.StreamReader) -> bytes:
+    header = await reader.readexactly(HEADERSIZE)
+    datasize = int.from_bytes(header, 'little')
+    GameData.checkFrameSize(datasize)
+    data = await reader.readexactly(datasize)
+    return header + data
+
+
+async def asyncManageConnection(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+    '''
+    Coroutine counterpart of manageConnection.
+    Every request is handled on the event loop, so the locks taken by manageData are never contended.
+    '''
+    addr = writer.get_extra_info("peername")
+    conn = AsyncConnection(writer, addr, sendQueueLimit, slowClientPolicy)
+    logging.info("Connected by: " + str(addr))
+    table = None
+    playerName = ""
+    try:
+        while True:
+            try:
+                frame = await asyncReadFrame(reader)
+            except (asyncio.IncompleteReadError, ConnectionError):
+                manageDisconnection(table, playerName)
+                break
+            except GameData.FrameTooLarge as e:
+                logging.warning("Closing connection " + str(addr) + ": " + str(e))
+                manageDisconnection(table, playerName)
+                break
+            data = readData(frame, conn)
+            if data is not None:
+                table, playerName = manageData(data, table, playerName, conn)
+            # Flow control on our own connection, writes to the other players are flushed by their transports
+            await writer.drain()
+            if playerName is None:
+                break
+    finally:
+        conn.close()
+        logConnectionStats(conn)
 
 
 def manageInput():
@@ -140,35 +221,115 @@ def manageInput():
         if data == "exit":
             logging.info("Closing the server...")
             os._exit(0)
+        elif data == "stats":
+            logLockStats()
 
 
-def manageNetwork():
-    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-        s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-        s.bind((HOST, PORT))
-        logging.info("Hanabi server started on " + HOST + ":" + str(PORT))
+def manageNetwork(listener, daemon: bool = False):
+    with listener:
         while True:
-            s.listen()
-            conn, addr = s.accept()
+            conn, addr = listener.accept()
             threading.Thread(target=manageConnection,
-                             args=(conn, addr)).start()
+                             args=(transport.accepted(conn), addr), daemon=daemon).start()
+
 
+async def asyncManageNetwork(transportName: str, address):
+    # transport.listen binds the socket (and removes a stale unix socket file), the event loop only accepts on it
+    listener = transport.listen(transportName, address)
+    if transportName == transport.UNIX:
+        server = await asyncio.start_unix_server(asyncManageConnection, sock=listener)
+    else:
+        server = await asyncio.start_server(asyncManageConnection, sock=listener)
+    logging.info("Hanabi server (asyncio) started on " + transportName + " " + str(address))
+    async with server:
+        await server.serve_forever()
 
-def start_server(nplayers):
+
+def serve(nplayers, useAsyncio: bool = False, codecs: list = codec.CODECS, queueLimit: int = SEND_QUEUE_LIMIT,
+          policy: str = connection.DISCONNECT, transportName: str = transport.TCP, address=None, standalone: bool = True,
+          engine=Game, seeds: list = None, seed: int = None, eventLogPath: str = None):
+    '''
+    Starts serving the clients in the background and returns.
+    standalone: False for a server embedded in the process of its clients, e.g. on the in-process transport:
+        it does not log to game.log, does not exit when no client is connected and does not keep the process alive.
+    engine: the game engine of the tables, Game or CompactGame.
+    seeds, seed: the seeds of the games played at every table, see game.seedSequence.
+    eventLogPath: the file the games are appended to (see event_log.py), no event log if None.
+    '''
     global numPlayers
+    global acceptedCodecs
+    global sendQueueLimit
+    global slowClientPolicy
+    global exitWhenIdle
+    global gameClass
+    global seedList
+    global firstSeed
+    global eventLog
     numPlayers = nplayers
-    logging.basicConfig(filename="game.log", level=logging.INFO, format='%(asctime)s %(levelname)s: %(message)s',
-                        datefmt="%m/%d/%Y %I:%M:%S %p")
-    logging.getLogger().addHandler(logging.StreamHandler(sys.stdout))
-    threading.Thread(target=manageNetwork).start()
+    acceptedCodecs = codecs
+    sendQueueLimit = queueLimit
+    slowClientPolicy = policy
+    exitWhenIdle = standalone
+    gameClass = engine
+    seedList = seeds
+    firstSeed = seed
+    eventLog = EventLog(eventLogPath) if eventLogPath is not None else None
+    address = address or transport.defaultAddress(transportName)
+    if standalone:
+        logging.basicConfig(filename="game.log", level=logging.INFO, format='%(asctime)s %(levelname)s: %(message)s',
+                            datefmt="%m/%d/%Y %I:%M:%S %p")
+        logging.getLogger().addHandler(logging.StreamHandler(sys.stdout))
+    if useAsyncio:
+        if transportName == transport.INPROC:
+            raise ValueError("The asyncio server only serves sockets, use the threaded server for the in-process transport")
+        threading.Thread(target=asyncio.run, args=(asyncManageNetwork(transportName, address),),
+                         daemon=not standalone).start()
+    else:
+        listener = transport.listen(transportName, address)
+        logging.info("Hanabi server started on " + transportName + " " + str(address))
+        threading.Thread(target=manageNetwork, args=(listener, not standalone), daemon=not standalone).start()
+
+
+def start_server(nplayers, useAsyncio: bool = False, codecs: list = codec.CODECS, queueLimit: int = SEND_QUEUE_LIMIT,
+                 policy: str = connection.DISCONNECT, transportName: str = transport.TCP, address=None, engine=Game,
+                 seeds: list = None, seed: int = None, eventLogPath: str = None):
+    serve(nplayers, useAsyncio, codecs, queueLimit, policy, transportName, address, engine=engine, seeds=seeds, seed=seed,
+          eventLogPath=eventLogPath)
     manageInput()
 
 
 if __name__ == '__main__':
     signal(SIGPIPE, SIG_DFL)
-    print("Type 'exit' to end the program")
-    if len(sys.argv) > 1:
-        if int(sys.argv[1]) > 1:
-            numPlayers = int(sys.argv[1])
+    print("Type 'exit' to end the program, 'stats' to show the lock statistics")
+    parser = argparse.ArgumentParser(description="Hanabi server")
+    parser.add_argument("minNumPlayers", nargs="?", type=int, default=numPlayers,
+                        help="the game does not start until this number of players is reached")
+    parser.add_argument("--asyncio", action="store_true",
+                        help="serve connections as coroutines on a single event loop instead of a thread each")
+    parser.add_argument("--binary-only", action="store_true",
+                        help="refuse pickled data from the clients, only the binary codec is accepted")
+    parser.add_argument("--send-queue-limit", type=int, default=SEND_QUEUE_LIMIT, metavar="BYTES",
+                        help="bytes queued for a single client before the slow client policy is applied")
+    parser.add_argument("--slow-clients", choices=connection.POLICIES, default=connection.DISCONNECT,
+                        help="disconnect the clients whose queue is full, or drop the frames sent to them "
+                             "(move results and game over are never dropped: they disconnect the client)")
+    parser.add_argument("--transport", choices=[transport.TCP, transport.UNIX], default=transport.TCP,
+                        help="listen on a TCP port or on a unix domain socket")
+    parser.add_argument("--address", default=None,
+                        help="host:port for TCP, the socket path for unix (default: " + transport.UNIX_PATH + ")")
+    parser.add_argument("--compact-game", action="store_true",
+                        help="run the games on the compact engine (compact_game.py), same rules with a lighter state")
+    parser.add_argument("--seed", type=int, default=None,
+                        help="deal the games of every table with this seed and the following ones, random seeds if not given")
+    parser.add_argument("--seeds-file", default=None, metavar="FILE",
+                        help="deal the first games of every table with the seeds in this file, e.g. the seeds of a previous run")
+    parser.add_argument("--event-log", default=None, metavar="FILE",
+                        help="append every game played to this file, to be replayed with event_log.py")
+    args = parser.parse_args()
+    if args.minNumPlayers > 1:
+        numPlayers = args.minNumPlayers
 
-    start_server(numPlayers)
+    start_server(numPlayers, args.asyncio, [codec.BINARY] if args.binary_only else codec.CODECS,
+                 args.send_queue_limit, args.slow_clients, args.transport, transport.parseAddress(args.transport, args.address),
+                 CompactGame if args.compact_game else Game,
+                 readSeeds(args.seeds_file) if args.seeds_file is not None else None, args.seed, args.event_log)
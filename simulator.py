@@ -0,0 +1,102 @@
+import argparse
+import logging
+import random
+from copy import deepcopy
+from typing import List
+import GameData
+from game import Game, seedSequence, readSeeds
+from event_log import EventLog
+from compact_game import CompactGame
+from my_client import Client
+from rule_based_agent import RuleBasedAgent
+
+
+class Simulator(object):
+    '''
+    Plays whole games between agents without server nor sockets.
+    The Game is driven directly: the agent in turn chooses its action, its request is satisfied by Game.satisfyRequest
+    and every agent gets its own view of the result, exactly as the server would send it.
+    An action refused by the game aborts the game with a RuntimeError.
+    agents: Client instances created with connect=False, in turn order.
+    gameClass: the game engine, Game or CompactGame.
+    seeds: the seeds of the games, in order (see game.seedSequence). Random seeds if None.
+    eventLog: the event_log.EventLog the games are written to, if not None.
+    '''
+    def __init__(self, agents: List[Client], gameClass=Game, seeds=None, eventLog: EventLog = None) -> None:
+        super().__init__()
+        self.agents = agents
+        self.gameClass = gameClass
+        self.seeds = seeds if seeds is not None else seedSequence()
+        self.eventLog = eventLog
+        self.game = None
+        self.playedSeeds = []
+
+    def playGame(self) -> int:
+        '''
+        Plays a game to the end and returns its score.
+        '''
+        self.game = self.gameClass(self.game.getVersion() if self.game is not None else 0, next(self.seeds), self.eventLog)
+        self.playedSeeds.append(self.game.getSeed())
+        for agent in self.agents:
+            self.game.addPlayer(agent.player_name)
+        self.game.start()
+        for agent in self.agents:
+            # the state shares the hands and the piles of the game, the server would send a copy of them
+            agent.init_game(deepcopy(self.game.getGameState(agent.player_name)))
+
+        agentsByName = {agent.player_name: agent for agent in self.agents}
+        while True:
+            agent = agentsByName[self.agents[0].current_player]
+            action = agent.get_next_action()
+            singleData, multipleData = self.game.satisfyRequest(action.client_to_server_data(), agent.player_name)
+            if singleData is not None:
+                # the game refused the action. Asking again would get the same action from the same state,
+                # and a connected agent would stop on it too (Client.process_response raises)
+                reason = getattr(singleData, "message", None) or getattr(singleData, "data", "")
+                raise RuntimeError(f"{agent.player_name} sent an invalid action ({action}): {reason}")
+            if type(multipleData) is GameData.ServerGameOver:
+                for agent in self.agents:
+                    agent.process_response(multipleData)
+                return multipleData.score
+            views = self.game.getPlayerViews(multipleData)
+            for agent in self.agents:
+                actionResult, newState = agent.process_response(views[agent.player_name])
+                agent.update_state_with_action(actionResult, newState)
+
+    def play(self, gameNumber: int) -> List[int]:
+        return [self.playGame() for _ in range(gameNumber)]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Plays rule based agents against each other in this process, without a server")
+    parser.add_argument("agent_number", nargs="?", type=int, default=2, help="number of agents, from 2 to 5")
+    parser.add_argument("game_number", nargs="?", type=int, default=100, help="number of games to play")
+    parser.add_argument("--compact-game", action="store_true", help="run the games on the compact engine (compact_game.py)")
+    parser.add_argument("--seed", type=int, default=None,
+                        help="deal the games with this seed and the following ones, and seed the agents' choices with it")
+    parser.add_argument("--seeds-file", default=None, metavar="FILE",
+                        help="deal the first games with the seeds in this file: the GAME SEEDS of a results file, or just the seeds")
+    parser.add_argument("--event-log", default=None, metavar="FILE",
+                        help="append every game played to this file, to be replayed with event_log.py")
+    args = parser.parse_args()
+    if args.seed is not None:
+        random.seed(args.seed)
+
+    # the agents log every move
+    logging.getLogger().setLevel(logging.WARNING)
+    agents = [RuleBasedAgent(f"agent{a}", args.game_number, args.agent_number, connect=False) for a in range(args.agent_number)]
+    seeds = seedSequence(readSeeds(args.seeds_file) if args.seeds_file is not None else None, args.seed)
+    simulator = Simulator(agents, CompactGame if args.compact_game else Game, seeds,
+                          EventLog(args.event_log) if args.event_log is not None else None)
+    scores = simulator.play(args.game_number)
+    print(f"""
+************** MATCH WITH {args.agent_number} players **************
+GAME SCORES:
+{scores}
+
+GAME SEEDS:
+{simulator.playedSeeds}
+
+AVG SCORE:
+{sum(scores) / len(scores)}
+""")
@@ -0,0 +1,150 @@
+import logging
+import GameData
+import codec
+from game import Game, seedSequence
+from connection import Connection, isDroppable
+from locks import TimedLock
+
+
+class Table(object):
+    '''
+    A single game table hosted by the server.
+    Each table owns its Game, its lobby state and its command queue, so a server can run many of them at once.
+    Its lock has to be held while using it: requests to different tables are served in parallel.
+    name: the table identifier, chosen by the clients or assigned by the server.
+    numPlayers: the game does not start until this number of players is reached.
+    gameClass: the game engine, Game or CompactGame.
+    seeds: the seeds of the games played at the table, in order (see game.seedSequence). Random seeds if None.
+    eventLog: the event_log.EventLog the games are written to, if not None.
+    '''
+
+    MAX_PLAYERS = 5
+
+    statuses = [
+        "Lobby",
+        "Game"
+    ]
+
+    def __init__(self, name: str, numPlayers: int, gameClass=Game, seeds=None, eventLog=None) -> None:
+        super().__init__()
+        self.name = name
+        self.numPlayers = numPlayers
+        self.gameClass = gameClass
+        self.seeds = seeds if seeds is not None else seedSequence()
+        self.eventLog = eventLog
+        self.game = gameClass(seed=next(self.seeds), eventLog=eventLog)
+        self.status = self.statuses[0]
+        self.playerConnections = {}
+        self.playersOk = []
+        self.commandQueue = {}
+        # the lobby gets closed as soon as the game start is announced
+        self.open = True
+        self.lock = TimedLock("table " + name)
+
+    def isOpen(self) -> bool:
+        return self.open and len(self.playerConnections) < self.MAX_PLAYERS
+
+    def isEmpty(self) -> bool:
+        return len(self.playerConnections) == 0
+
+    def addPlayer(self, playerName: str, conn: Connection, addr) -> bool:
+        if playerName in self.playerConnections.keys() or playerName == "" or playerName is None:
+            logging.warning("Duplicate player: " + str(playerName))
+            conn.send(GameData.ServerActionInvalid(
+                "Player with that name already registered."))
+            return False
+        if not self.isOpen():
+            logging.warning("Table " + self.name + " is not accepting players")
+            conn.send(GameData.ServerActionInvalid(
+                "Table " + self.name + " is not accepting players."))
+            return False
+        self.commandQueue[playerName] = []
+        self.playerConnections[playerName] = (conn, addr)
+        logging.info("Player connected: " + playerName + " at table " + self.name)
+        self.game.addPlayer(playerName)
+        conn.send(GameData.ServerPlayerConnectionOk(
+            playerName, self.name, conn.codec))
+        return True
+
+    def removePlayer(self, playerName: str):
+        del self.playerConnections[playerName]
+        self.commandQueue.pop(playerName, None)
+        logging.warning("Player disconnected: " + playerName + " from table " + self.name)
+        self.game.removePlayer(playerName)
+
+    def manageData(self, data: GameData.ClientToServerData, playerName: str, conn: Connection):
+        '''
+        Handles a request sent by a player already seated at this table.
+        '''
+        if self.status == "Lobby":
+            if type(data) is GameData.ClientPlayerStartRequest:
+                self.game.setPlayerReady(playerName)
+                logging.info("Player ready: " + playerName)
+                conn.send(GameData.ServerPlayerStartRequestAccepted(
+                    len(self.game.getPlayers()), self.game.getNumReadyPlayers()))
+
+                if len(self.game.getPlayers()) == self.game.getNumReadyPlayers() and len(self.game.getPlayers()) >= self.numPlayers:
+                    listNames = []
+                    for player in self.game.getPlayers():
+                        listNames.append(player.name)
+                    logging.info(
+                        "Game start at table " + self.name + "! Between: " + str(listNames) + ", seed " + str(self.game.getSeed()))
+                    self.open = False
+                    self.broadcast(GameData.ServerStartGameData(listNames))
+                    self.game.start()
+
+            # This ensures every player is ready to send requests
+            elif type(data) is GameData.ClientPlayerReadyData:
+                self.playersOk.append(1)
+            # If every player is ready to send requests, then the game can start
+            if len(self.playersOk) == len(self.game.getPlayers()):
+                self.status = "Game"
+                for player in self.commandQueue:
+                    for cmd in self.commandQueue[player]:
+                        self.__satisfyRequest(cmd, player, self.playerConnections[player][0])
+                    self.commandQueue[player] = []
+            elif type(data) is not GameData.ClientPlayerAddData and type(
+                    data) is not GameData.ClientPlayerStartRequest and type(
+                    data) is not GameData.ClientPlayerReadyData:
+                self.commandQueue[playerName].append(data)
+        # In game
+        elif self.status == "Game":
+            self.__satisfyRequest(data, playerName, conn)
+
+    def broadcast(self, data: GameData.ServerToClientData):
+        '''
+        Sends data to every player at the table.
+        Each view of the data is encoded once per codec and the same frame is written to all the players sharing it.
+        '''
+        views = self.game.getPlayerViews(data)
+        droppable = isDroppable(data)
+        frames = {}
+        for playerName in self.playerConnections:
+            conn = self.playerConnections[playerName][0]
+            view = views.get(playerName, data)
+            key = (id(view), conn.codec)
+            if key not in frames:
+                frames[key] = codec.encode(view, conn.codec)
+            conn.sendFrame(frames[key], droppable)
+
+    def __satisfyRequest(self, data: GameData.ClientToServerData, playerName: str, conn: Connection):
+        singleData, multipleData = self.game.satisfyRequest(
+            data, playerName)
+        if singleData is not None:
+            conn.send(singleData)
+        if multipleData is not None:
+            self.broadcast(multipleData)
+            if self.game.isGameOver():
+                logging.info("Game over at table " + self.name)
+                logging.info("Game score: " +
+                             str(self.game.getScore()))
+                self.__restart()
+
+    def __restart(self):
+        players = self.game.getPlayers()
+        # the state version keeps increasing, clients still holding the previous game state are behind
+        self.game = self.gameClass(self.game.getVersion(), next(self.seeds), self.eventLog)
+        logging.info("Starting new game at table " + self.name + " with seed " + str(self.game.getSeed()))
+        for player in players:
+            self.game.addPlayer(player.name)
+        self.game.start()
@@ -0,0 +1,143 @@
+import copy
+import logging
+import random
+import unittest
+from unittest import mock
+from client_state.agent_state import AgentState
+from client_state.card_info import Color, Value, DECK_SIZE, DECK_COLOR_STRUCTURE, DECK_VALUE_STRUCTURE, \
+    DECK_SINGLE_FIREWORK_STRUCTURE, COLOR_INDEXES, card_index
+from game import seedSequence
+from rule_based_agent import RuleBasedAgent
+from simulator import Simulator
+
+logging.disable(logging.CRITICAL)
+
+
+def referenceMarginals(card, seenCards) -> (dict, dict):
+    '''
+    The color and value probabilities of a hidden card as the per-card code computed them before the batched
+    AgentState.update_current_belief, one branch for each combination of hints.
+    '''
+    possibleColors = dict(card.possible_colors)
+    possibleValues = dict(card.possible_values)
+    if card.hasColorHint():
+        possibleColors = {color: 0 for color in Color.getColors()}
+        possibleColors[card.hint_color] = 1
+    if card.hasValueHint():
+        possibleValues = {value: 0 for value in Value.getValues()}
+        possibleValues[card.hint_value] = 1
+    if card.hasColorHint() and card.hasValueHint():
+        return possibleColors, possibleValues
+
+    notExcludedValues = Value.getValues().difference(card.excluded_values)
+    notExcludedColors = Color.getColors().difference(card.excluded_colors)
+    if card.hasColorHint():
+        excludedCards = sum(DECK_SINGLE_FIREWORK_STRUCTURE[value] for value in card.excluded_values)
+        colorRow = seenCards[COLOR_INDEXES[card.hint_color]]
+        seen = {value: colorRow[value.value - 1] for value in notExcludedValues}
+        totalCards = DECK_COLOR_STRUCTURE[card.hint_color] - excludedCards - sum(seen.values())
+        for value in possibleValues:
+            if value in card.excluded_values:
+                possibleValues[value] = 0
+            else:
+                possibleValues[value] = (DECK_SINGLE_FIREWORK_STRUCTURE[value] - seen[value]) / totalCards
+    elif card.hasValueHint():
+        excludedCards = DECK_SINGLE_FIREWORK_STRUCTURE[card.hint_value] * len(card.excluded_colors)
+        seen = {color: seenCards[COLOR_INDEXES[color]][card.hint_value.value - 1] for color in notExcludedColors}
+        totalCards = DECK_VALUE_STRUCTURE[card.hint_value] - excludedCards - sum(seen.values())
+        for color in possibleColors:
+            if color in card.excluded_colors:
+                possibleColors[color] = 0
+            else:
+                possibleColors[color] = (DECK_SINGLE_FIREWORK_STRUCTURE[card.hint_value] - seen[color]) / totalCards
+    else:
+        excludedCards = 0
+        for color in card.excluded_colors:
+            possibleColors[color] = 0
+            excludedCards += DECK_COLOR_STRUCTURE[color]
+        excludedPerColor = 0
+        for value in card.excluded_values:
+            excludedPerColor += DECK_SINGLE_FIREWORK_STRUCTURE[value]
+            possibleValues[value] = 0
+            excludedCards += DECK_VALUE_STRUCTURE[value] - DECK_SINGLE_FIREWORK_STRUCTURE[value] * len(card.excluded_colors)
+        seenTotal = 0
+        seenByValue = {value: 0 for value in Value.getValues()}
+        seenByColor = {color: 0 for color in Color.getColors()}
+        for color in notExcludedColors:
+            colorRow = seenCards[COLOR_INDEXES[color]]
+            for value in notExcludedValues:
+                count = colorRow[value.value - 1]
+                seenTotal += count
+                seenByValue[value] += count
+                seenByColor[color] += count
+        totalCards = DECK_SIZE - excludedCards - seenTotal
+        for color in notExcludedColors:
+            possibleColors[color] = (DECK_COLOR_STRUCTURE[color] - excludedPerColor - seenByColor[color]) / totalCards
+        for value in notExcludedValues:
+            possibleValues[value] = (DECK_VALUE_STRUCTURE[value] - DECK_SINGLE_FIREWORK_STRUCTURE[value] * len(card.excluded_colors)
+                                     - seenByValue[value]) / totalCards
+    return possibleColors, possibleValues
+
+
+def referenceJoint(card, seenCards) -> list:
+    '''
+    The joint color/value probabilities of a hidden card as the per-card code computed them,
+    indexed as client_state.card_info.card_index.
+    '''
+    if card.hasColorHint() and card.hasValueHint():
+        # the card is known, and already counted among the seen cards
+        belief = [0.0] * len(card.belief)
+        belief[card_index(card.hint_color, card.hint_value)] = 1.0
+        return belief
+    belief = []
+    for color in Color:
+        colorPossible = color == card.hint_color if card.hasColorHint() else color not in card.excluded_colors
+        colorRow = seenCards[COLOR_INDEXES[color]]
+        for value in Value:
+            valuePossible = value == card.hint_value if card.hasValueHint() else value not in card.excluded_values
+            belief.append(DECK_SINGLE_FIREWORK_STRUCTURE[value] - colorRow[value.value - 1] if colorPossible and valuePossible else 0)
+    totalCards = sum(belief)
+    return [possibleCards / totalCards for possibleCards in belief]
+
+
+class BeliefTest(unittest.TestCase):
+    '''
+    The belief computed for the whole hand at once must match the per-card computation
+    on every state reached by the agents in simulated games.
+    '''
+    def checkGames(self, agentNumber: int, gameNumber: int, seed: int):
+        update = AgentState.update_current_belief
+        checkedCards = []
+
+        def checkedUpdate(state):
+            hand = copy.deepcopy(state.hand)
+            update(state)
+            for card, before in zip(state.hand, hand):
+                possibleColors, possibleValues = referenceMarginals(before, state.seen_cards)
+                self.assertEqual(card.possible_colors, possibleColors)
+                self.assertEqual(card.possible_values, possibleValues)
+                for probability, expected in zip(card.belief, referenceJoint(before, state.seen_cards)):
+                    self.assertAlmostEqual(probability, expected, delta=1e-12)
+                checkedCards.append(card)
+
+        random.seed(seed)
+        agents = [RuleBasedAgent(f"agent{a}", gameNumber, agentNumber, connect=False) for a in range(agentNumber)]
+        with mock.patch.object(AgentState, "update_current_belief", checkedUpdate):
+            Simulator(agents, seeds=seedSequence(first=seed)).play(gameNumber)
+        self.assertGreater(len(checkedCards), 0)
+
+    def testTwoPlayers(self):
+        self.checkGames(2, 2, 7)
+
+    def testThreePlayers(self):
+        self.checkGames(3, 2, 7)
+
+    def testFourPlayers(self):
+        self.checkGames(4, 2, 7)
+
+    def testFivePlayers(self):
+        self.checkGames(5, 2, 7)
+
+
+if __name__ == '__main__':
+    unittest.main()
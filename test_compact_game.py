@@ -0,0 +1,55 @@
+import logging
+import random
+import unittest
+import GameData
+from compact_game import CompactGame
+from game import Game
+from test_delta import stateKey
+from test_legal_actions import actionKey
+
+logging.disable(logging.CRITICAL)
+
+
+class CompactGameTest(unittest.TestCase):
+    '''
+    CompactGame is a drop-in for Game: with the same seed and the same moves
+    both engines must show the same states, legal actions and hint masks, and end with the same score.
+    '''
+    def checkSameGame(self, agentNumber: int, seed: int):
+        rng = random.Random(seed)
+        names = [f"player{p}" for p in range(agentNumber)]
+        games = [Game(0, seed), CompactGame(0, seed)]
+        for game in games:
+            for name in names:
+                game.addPlayer(name)
+            game.start()
+
+        move = 0
+        while True:
+            for name in names + ["nobody"]:
+                self.assertEqual(stateKey(games[1].getGameState(name)), stateKey(games[0].getGameState(name)),
+                                 f"state of {name}, move {move}")
+            for name in names:
+                self.assertEqual(games[1].getHintMasks(name), games[0].getHintMasks(name), f"masks of {name}, move {move}")
+            legalActions = games[0].getLegalActions()
+            # the order of the actions is not part of getLegalActions
+            self.assertEqual(sorted(actionKey(action) for action in games[1].getLegalActions()),
+                             sorted(actionKey(action) for action in legalActions), f"move {move}")
+
+            action = rng.choice(legalActions)
+            results = [game.satisfyRequest(action, action.sender) for game in games]
+            self.assertEqual([type(data) for data in results[1]], [type(data) for data in results[0]], f"move {move}")
+            if type(results[0][1]) is GameData.ServerGameOver:
+                self.assertEqual(results[1][1].score, results[0][1].score)
+                self.assertEqual(games[1].getScore(), games[0].getScore())
+                return
+            move += 1
+
+    def testSameGames(self):
+        for agentNumber in range(2, 6):
+            for seed in range(10):
+                self.checkSameGame(agentNumber, seed)
+
+
+if __name__ == '__main__':
+    unittest.main()
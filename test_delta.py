@@ -0,0 +1,128 @@
+import logging
+import random
+import unittest
+from copy import copy, deepcopy
+import GameData
+import codec
+from compact_game import CompactGame
+from game import Game
+from my_client import Client
+
+logging.disable(logging.CRITICAL)
+
+
+def stateKey(state: GameData.ServerGameStateData) -> tuple:
+    '''
+    Everything a player is told by a game state, comparable between states built by the game and by the clients.
+    Cards are their color and value, as on the wire.
+    '''
+    return (state.currentPlayer, state.handSize, state.usedNoteTokens, state.usedStormTokens, state.version,
+            [(p.name, [(c.color, c.value) for c in p.hand]) for p in state.players],
+            {color: [(c.color, c.value) for c in pile] for color, pile in state.tableCards.items()},
+            [(c.color, c.value) for c in state.discardPile])
+
+
+class LocalClient(Client):
+    '''
+    A client whose frames are encoded and decoded with codecName instead of going through a socket.
+    The state it asks for is answered by the game, as the server would.
+    '''
+    def __init__(self, playerName: str, game, codecName: str) -> None:
+        super().__init__(playerName, connect=False)
+        self.game = game
+        self.codecName = codecName
+        self.resyncs = 0
+
+    def receive(self, data: GameData.ServerToClientData):
+        return self.process_response(codec.decode(codec.encode(data, self.codecName)))
+
+    def get_game_status(self) -> GameData.ServerGameStateData:
+        self.resyncs += 1
+        self.game_state = codec.decode(codec.encode(self.game.getGameState(self.player_name), self.codecName))
+        return copy(self.game_state)
+
+    def _init_game_state(self, state: GameData.ServerGameStateData):
+        super()._init_game_state(state)
+
+    def update_state_with_action(self, played_action, new_state: GameData.ServerGameStateData):
+        super().update_state_with_action(played_action, new_state)
+
+    def get_next_action(self):
+        raise NotImplementedError
+
+    def game_over(self, score: int, seed: int = None):
+        super().game_over(score, seed)
+
+
+class DeltaTest(unittest.TestCase):
+    '''
+    Clients keep their copy of the game state up to date with the deltas attached to the results of the moves:
+    after every move it must be the state the game would send them, through every codec.
+    '''
+    def playGame(self, gameClass, codecName: str, agentNumber: int, seed: int, missed: dict = None):
+        '''
+        Plays a game with random legal moves and checks the state of every client after each move.
+        missed: {player name: move number} the player does not get the result of, as if the frame was lost.
+        Returns the clients.
+        '''
+        missed = missed or {}
+        rng = random.Random(seed)
+        game = gameClass(0, seed)
+        clients = [LocalClient(f"player{p}", game, codecName) for p in range(agentNumber)]
+        for client in clients:
+            game.addPlayer(client.player_name)
+        game.start()
+        for client in clients:
+            client.init_game(codec.decode(codec.encode(deepcopy(game.getGameState(client.player_name)), codecName)))
+
+        move = 0
+        while True:
+            action = rng.choice(game.getLegalActions())
+            _, result = game.satisfyRequest(action, action.sender)
+            if type(result) is GameData.ServerGameOver:
+                return clients
+            views = game.getPlayerViews(result)
+            for client in clients:
+                if missed.get(client.player_name) == move:
+                    continue
+                actionResult, newState = client.receive(views[client.player_name])
+                client.update_state_with_action(actionResult, newState)
+                self.assertEqual(stateKey(client.game_state), stateKey(game.getGameState(client.player_name)),
+                                 f"{client.player_name}, move {move}")
+            move += 1
+
+    def checkDeltas(self, gameClass, codecName: str):
+        for agentNumber in range(2, 6):
+            for seed in range(3):
+                clients = self.playGame(gameClass, codecName, agentNumber, seed)
+                # the deltas alone are enough, the drawer's one included: nobody asks for the whole state
+                self.assertEqual([client.resyncs for client in clients], [0] * agentNumber)
+
+    def checkResync(self, gameClass, codecName: str):
+        clients = self.playGame(gameClass, codecName, 3, 0, missed={"player1": 5})
+        # the result after the missed one does not follow the version of the client: it asks for the state once
+        self.assertEqual([client.resyncs for client in clients], [0, 1, 0])
+
+    def testGameBinary(self):
+        self.checkDeltas(Game, codec.BINARY)
+
+    def testGamePickle(self):
+        self.checkDeltas(Game, codec.PICKLE)
+
+    def testCompactGameBinary(self):
+        self.checkDeltas(CompactGame, codec.BINARY)
+
+    def testCompactGamePickle(self):
+        self.checkDeltas(CompactGame, codec.PICKLE)
+
+    def testResyncBinary(self):
+        self.checkResync(Game, codec.BINARY)
+        self.checkResync(CompactGame, codec.BINARY)
+
+    def testResyncPickle(self):
+        self.checkResync(Game, codec.PICKLE)
+        self.checkResync(CompactGame, codec.PICKLE)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,106 @@
+import logging
+import os
+import random
+import tempfile
+import unittest
+import GameData
+from compact_game import CompactGame
+from event_log import EventLog, MAGIC, readGames
+from game import Game
+
+logging.disable(logging.CRITICAL)
+
+
+def playToTheEnd(game, rng: random.Random) -> int:
+    '''
+    Plays random legal moves until the game is over and returns the score.
+    '''
+    while True:
+        action = rng.choice(game.getLegalActions())
+        _, result = game.satisfyRequest(action, action.sender)
+        if type(result) is GameData.ServerGameOver:
+            return result.score
+
+
+class SnapshotEventLogTest(unittest.TestCase):
+    '''
+    A lookahead must leave no trace in the event log, while snapshot() and restore() alone never keep a game out of it.
+    '''
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp(suffix=".hnb")
+        os.close(fd)
+        os.remove(self.path)
+
+    def tearDown(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    def startGame(self, gameClass):
+        game = gameClass(0, 7, EventLog(self.path))
+        for name in ("p0", "p1", "p2"):
+            game.addPlayer(name)
+        game.start()
+        rng = random.Random(1)
+        for _ in range(10):
+            action = rng.choice(game.getLegalActions())
+            game.satisfyRequest(action, action.sender)
+        self.assertEqual(os.path.getsize(self.path), len(MAGIC))
+        return game
+
+    def checkLogged(self, game):
+        '''
+        The event log holds the game, once, and its replay ends on the fireworks of the game.
+        '''
+        games = list(readGames(self.path))
+        self.assertEqual(len(games), 1)
+        self.assertEqual(games[0].seed, 7)
+        self.assertEqual(games[0].score, game.getScore())
+        replay = games[0].stateAt(games[0].numMoves())
+        self.assertEqual(replay.getScore(), sum(game.getFireworkHeights().values()))
+
+    def checkLookahead(self, gameClass):
+        game = self.startGame(gameClass)
+        # two lookaheads to the end of the game, one per tried line
+        for seed in (2, 3):
+            snapshot = game.lookahead()
+            playToTheEnd(game, random.Random(seed))
+            game.restore(snapshot)
+            self.assertEqual(os.path.getsize(self.path), len(MAGIC))
+        # the real line of play is written once, with the moves before the lookaheads and none of theirs
+        playToTheEnd(game, random.Random(4))
+        self.checkLogged(game)
+
+    def checkSnapshot(self, gameClass):
+        game = self.startGame(gameClass)
+        snapshot = game.snapshot()
+        game.restore(snapshot)
+        playToTheEnd(game, random.Random(4))
+        self.checkLogged(game)
+
+    def checkSnapshotPlayedOn(self, gameClass):
+        game = self.startGame(gameClass)
+        game.snapshot()
+        playToTheEnd(game, random.Random(4))
+        self.checkLogged(game)
+
+    def testLookaheadGame(self):
+        self.checkLookahead(Game)
+
+    def testLookaheadCompactGame(self):
+        self.checkLookahead(CompactGame)
+
+    def testSnapshotGame(self):
+        self.checkSnapshot(Game)
+
+    def testSnapshotCompactGame(self):
+        self.checkSnapshot(CompactGame)
+
+    def testSnapshotPlayedOnGame(self):
+        self.checkSnapshotPlayedOn(Game)
+
+    def testSnapshotPlayedOnCompactGame(self):
+        self.checkSnapshotPlayedOn(CompactGame)
+
+
+if __name__ == '__main__':
+    unittest.main()
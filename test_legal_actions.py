@@ -0,0 +1,71 @@
+import logging
+import random
+import unittest
+from copy import deepcopy
+import GameData
+from compact_game import CompactGame
+from game import Game
+from rule_based_agent import RuleBasedAgent
+
+logging.disable(logging.CRITICAL)
+
+
+def actionKey(data: GameData.ClientToServerData) -> tuple:
+    '''
+    What a request asks for, comparable between the requests built by the game and by the agents.
+    '''
+    if type(data) is GameData.ClientHintData:
+        return "hint", data.sender, data.destination, data.type, data.value
+    if type(data) is GameData.ClientPlayerPlayCardRequest:
+        return "play", data.sender, data.handCardOrdered
+    return "discard", data.sender, data.handCardOrdered
+
+
+class LegalActionsTest(unittest.TestCase):
+    '''
+    The game must accept every action of getLegalActions(), and the agents must find the same actions
+    from what they see of the game with AgentState.get_legal_actions().
+    '''
+    def checkGames(self, gameClass, agentNumber: int, seeds: range):
+        rng = random.Random(agentNumber)
+        for seed in seeds:
+            game = gameClass(0, seed)
+            agents = [RuleBasedAgent(f"agent{a}", 1, agentNumber, connect=False) for a in range(agentNumber)]
+            for agent in agents:
+                game.addPlayer(agent.player_name)
+            game.start()
+            for agent in agents:
+                agent.init_game(deepcopy(game.getGameState(agent.player_name)))
+            agentsByName = {agent.player_name: agent for agent in agents}
+
+            while True:
+                legalActions = game.getLegalActions()
+                agent = agentsByName[agents[0].current_player]
+                self.assertEqual({actionKey(action.client_to_server_data()) for action in agent.state.get_legal_actions()},
+                                 {actionKey(action) for action in legalActions})
+                for action in legalActions:
+                    snapshot = game.snapshot()
+                    singleData, _ = game.satisfyRequest(action, action.sender)
+                    self.assertIsNone(singleData, f"seed {seed}: {actionKey(action)} refused")
+                    game.restore(snapshot)
+
+                action = rng.choice(legalActions)
+                _, multipleData = game.satisfyRequest(action, action.sender)
+                if type(multipleData) is GameData.ServerGameOver:
+                    break
+                views = game.getPlayerViews(multipleData)
+                for agent in agents:
+                    actionResult, newState = agent.process_response(views[agent.player_name])
+                    agent.update_state_with_action(actionResult, newState)
+
+    def testGame(self):
+        for agentNumber in range(2, 6):
+            self.checkGames(Game, agentNumber, range(5))
+
+    def testCompactGame(self):
+        for agentNumber in range(2, 6):
+            self.checkGames(CompactGame, agentNumber, range(5))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,176 @@
+# Transports between server and clients: TCP, unix domain sockets and in-process queues
+import os
+import queue
+import socket
+import tempfile
+import threading
+from constants import HOST, PORT
+
+TCP = "tcp"
+UNIX = "unix"
+INPROC = "inproc"
+TRANSPORTS = [TCP, UNIX, INPROC]
+
+UNIX_PATH = os.path.join(tempfile.gettempdir(), "hanabi.sock")
+INPROC_NAME = "hanabi"
+
+
+def defaultAddress(transportName: str):
+    if transportName == TCP:
+        return (HOST, PORT)
+    if transportName == UNIX:
+        return UNIX_PATH
+    if transportName == INPROC:
+        return INPROC_NAME
+    raise ValueError("Unknown transport: " + str(transportName))
+
+
+def parseAddress(transportName: str, address: str):
+    '''
+    Parses an address given on the command line: host:port for TCP, a path for unix sockets, a name for in-process queues.
+    Returns the default address of the transport if address is None.
+    '''
+    if address is None:
+        return defaultAddress(transportName)
+    if transportName == TCP:
+        host, _, port = address.rpartition(":")
+        return (host or HOST, int(port))
+    return address
+
+
+class QueueSocket(object):
+    '''
+    One end of an in-process connection, exposing the few socket methods used by servers and clients.
+    The bytes given to sendall are handed to the other end as they are, without copies. recv returns them
+    one sendall at a time whatever the requested size, the length prefix of the frames tells where they end.
+    '''
+    def __init__(self) -> None:
+        super().__init__()
+        self.incoming = queue.SimpleQueue()
+        self.peer = None
+        self.closed = False
+
+    @staticmethod
+    def pair():
+        first = QueueSocket()
+        second = QueueSocket()
+        first.peer = second
+        second.peer = first
+        return first, second
+
+    def sendall(self, data: bytes):
+        if self.closed or self.peer.closed:
+            raise BrokenPipeError("In-process connection closed")
+        self.peer.incoming.put(bytes(data))
+
+    def recv(self, size: int) -> bytes:
+        data = self.incoming.get()
+        if not data:
+            # end of stream: every following recv returns it too
+            self.incoming.put(data)
+        return data
+
+    def shutdown(self, how=None):
+        self.close()
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        # wakes up both the reader of this end and the one of the other end
+        self.incoming.put(b"")
+        self.peer.incoming.put(b"")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class QueueListener(object):
+    '''
+    Accepts in-process connections made with connect(INPROC, name).
+    '''
+    def __init__(self, name: str) -> None:
+        super().__init__()
+        self.name = name
+        self.pending = queue.SimpleQueue()
+
+    def accept(self):
+        return self.pending.get(), self.name
+
+    def close(self):
+        with _listenersLock:
+            if _listeners.get(self.name) is self:
+                del _listeners[self.name]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+_listeners = {}
+_listenersLock = threading.Lock()
+
+
+def listen(transportName: str, address=None):
+    '''
+    Returns a listener whose accept() returns (connection, address), like a listening socket.
+    '''
+    address = address or defaultAddress(transportName)
+    if transportName == TCP:
+        # with the protocol explicit asyncio disables Nagle on the connections it accepts, as accepted() does
+        s = socket.socket(socket.AF_INET, socket.SOCK_STREAM, socket.IPPROTO_TCP)
+        s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        s.bind(address)
+        s.listen()
+        return s
+    if transportName == UNIX:
+        # a socket file left by a server that did not exit cleanly would make bind fail
+        if os.path.exists(address):
+            os.remove(address)
+        s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        s.bind(address)
+        s.listen()
+        return s
+    if transportName == INPROC:
+        listener = QueueListener(address)
+        with _listenersLock:
+            _listeners[address] = listener
+        return listener
+    raise ValueError("Unknown transport: " + str(transportName))
+
+
+def accepted(conn):
+    '''
+    Sets up a connection returned by accept().
+    '''
+    if isinstance(conn, socket.socket) and conn.family in (socket.AF_INET, socket.AF_INET6):
+        # frames are small and written whole: waiting to coalesce them only adds latency
+        conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    return conn
+
+
+def connect(transportName: str, address=None):
+    '''
+    Returns a connection to a server listening on the given transport, exposing sendall, recv and close.
+    '''
+    address = address or defaultAddress(transportName)
+    if transportName == TCP:
+        return accepted(socket.create_connection(address))
+    if transportName == UNIX:
+        s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        s.connect(address)
+        return s
+    if transportName == INPROC:
+        with _listenersLock:
+            listener = _listeners.get(address)
+        if listener is None:
+            raise ConnectionRefusedError("No in-process server named " + str(address))
+        clientEnd, serverEnd = QueueSocket.pair()
+        listener.pending.put(serverEnd)
+        return clientEnd
+    raise ValueError("Unknown transport: " + str(transportName))